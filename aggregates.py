@@ -0,0 +1,200 @@
+"""Dashboard aggregates maintained on write.
+
+Totals, per-day revenue, per-type animal counts and the stock levels shown
+on the dashboard are kept in a small JSON file and updated by every writer,
+so reading them costs the same however much history is stored.  The file
+records the storage signature it matches; if storage was changed behind its
+back (init_game.py, a manual edit) the aggregates are rebuilt from the raw
+tables on the next read.  Compaction rewrites storage without changing what
+is in it, so ``restamp`` only records the new signature.  Each change of
+content gets a new ``version`` token, which the dashboard's ETag is built on.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import uuid
+
+from cache import file_signature
+from lazy_imports import lazy_import
+from stock_analysis import LOW_STOCK_THRESHOLD
+
+pd = lazy_import("pandas")
+
+
+DAILY_REVENUE_DAYS = 30
+
+
+def _empty() -> dict:
+    return {
+        "total_animals": 0,
+        "animal_types": {},
+        "total_invoices": 0,
+        "total_revenue": 0.0,
+        "daily_revenue": {},
+        "stock": {},
+        "source": None,
+        "version": None,
+    }
+
+
+def _frame(rows) -> pd.DataFrame:
+    if isinstance(rows, pd.DataFrame):
+        return rows
+    return pd.DataFrame(list(rows or []))
+
+
+def _add_counts(counts: dict, series: pd.Series):
+    for key, value in series.to_dict().items():
+        counts[str(key)] = counts.get(str(key), 0) + value
+
+
+def _stock_entry(row: dict, entry: dict = None) -> dict:
+    entry = dict(entry or {"name": "", "reference": row["Reference"], "quantity": 0, "type": ""})
+    for col, key in (("Name", "name"), ("Type", "type")):
+        if col in row:
+            entry[key] = "" if pd.isna(row[col]) else row[col]
+    if "Quantity" in row:
+        qty = pd.to_numeric(row["Quantity"], errors="coerce")
+        entry["quantity"] = 0 if pd.isna(qty) else int(qty)
+    return entry
+
+
+def _fold(data: dict, animals_df: pd.DataFrame, invoices_df: pd.DataFrame):
+    if not animals_df.empty:
+        data["total_animals"] += len(animals_df)
+        if "Animal Type" in animals_df.columns:
+            _add_counts(data["animal_types"], animals_df["Animal Type"].value_counts())
+    if not invoices_df.empty:
+        data["total_invoices"] += len(invoices_df)
+        amounts = pd.to_numeric(invoices_df["Total Amount"], errors="coerce").fillna(0.0)
+        data["total_revenue"] += float(amounts.sum())
+        days = pd.to_datetime(invoices_df["Timestamp"], errors="coerce").dt.strftime("%Y-%m-%d")
+        _add_counts(data["daily_revenue"], amounts.groupby(days).sum().astype(float))
+
+
+def _fold_stock(data: dict, stock_df: pd.DataFrame):
+    for row in stock_df.to_dict("records"):
+        data["stock"][row["Reference"]] = _stock_entry(row)
+
+
+def _view(data: dict) -> dict:
+    stock_items = list(data["stock"].values())
+    sorted_days = sorted(data["daily_revenue"])[-DAILY_REVENUE_DAYS:]
+    return {
+        "total_animals": data["total_animals"],
+        "animal_types": dict(sorted(data["animal_types"].items(), key=lambda kv: -kv[1])),
+        "stock_items": stock_items,
+        "low_stock_items": [item for item in stock_items if item["quantity"] < LOW_STOCK_THRESHOLD],
+        "total_invoices": data["total_invoices"],
+        "total_revenue": round(data["total_revenue"], 2),
+        "daily_revenue": {day: round(data["daily_revenue"][day], 2) for day in sorted_days},
+    }
+
+
+def dashboard_summary(animals_df: pd.DataFrame, invoices_df: pd.DataFrame, stock_df: pd.DataFrame) -> dict:
+    """Dashboard statistics computed directly from tables, in the same shape.
+
+    Only Animal Type, Timestamp and Total Amount are used from the history
+    tables, so callers can pass just those columns.
+    """
+    data = _empty()
+    _fold(data, animals_df, invoices_df)
+    _fold_stock(data, stock_df)
+    return _view(data)
+
+
+class DashboardAggregates:
+    """Running dashboard statistics for one storage backend."""
+
+    def __init__(self, path: str, storage):
+        self.path = path
+        self.storage = storage
+        self._data = None
+        self._file_sig = None
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> dict:
+        """Dashboard statistics in the shape get_dashboard_data returns."""
+        with self._lock:
+            return _view(self._current())
+
+    def begin_write(self):
+        """Storage signature before a write; pass it to ``record``."""
+        return self._source()
+
+    def record(self, before_sig, appends: dict = None, stock_rows: list = None):
+        """Fold a completed storage write into the aggregates.
+
+        ``appends`` maps table names to the rows (or DataFrame) just added;
+        ``stock_rows`` are Stock rows that were inserted or changed, with at
+        least a Reference.  If the aggregates did not match storage as it was
+        before the write, they are rebuilt instead (which includes it).
+        """
+        with self._lock:
+            data = self._current(before_sig)
+            if data is None:
+                return
+            appends = appends or {}
+            _fold(data, _frame(appends.get("Animals")), _frame(appends.get("Invoices")))
+            for row in stock_rows or []:
+                ref = row["Reference"]
+                data["stock"][ref] = _stock_entry(row, data["stock"].get(ref))
+            self._save(data)
+
+    def restamp(self, before_sig):
+        """Record storage's new signature after a rewrite that kept its content (compaction)."""
+        with self._lock:
+            data = self._current(before_sig)
+            if data is not None and data.get("source") != self._source():
+                self._save(data, changed=False)
+
+    def version(self):
+        """Token that changes whenever the aggregated content does."""
+        with self._lock:
+            return self._current().get("version")
+
+    def rebuild(self) -> dict:
+        """Recompute everything from the raw tables and return the new aggregates."""
+        with self._lock:
+            return self._rebuild()
+
+    def _current(self, before_sig=None) -> dict:
+        sig = file_signature(self.path)[0]
+        if self._data is None or sig != self._file_sig:
+            try:
+                with open(self.path, "r") as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError):
+                self._data = None
+            self._file_sig = sig
+        if before_sig is not None:
+            if self._data is None or self._data.get("source") != before_sig:
+                self._rebuild()
+                return None
+        elif self._data is None or self._data.get("source") != self._source():
+            self._rebuild()
+        return self._data
+
+    def _rebuild(self) -> dict:
+        data = _empty()
+        _fold(data, self.storage.read_table("Animals"), self.storage.read_table("Invoices"))
+        _fold_stock(data, self.storage.read_table("Stock"))
+        self._save(data)
+        return data
+
+    def _source(self):
+        # JSON has no tuples; compare in the form the file stores
+        return json.loads(json.dumps(self.storage.cache.signature()))
+
+    def _save(self, data: dict, changed: bool = True):
+        data["source"] = self._source()
+        if changed:
+            data["version"] = uuid.uuid4().hex
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+        self._data = data
+        self._file_sig = file_signature(self.path)[0]
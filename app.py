@@ -1,125 +1,117 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file
+from __future__ import annotations
+
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, g
+import click
 import os
+import sys
 from datetime import datetime
-from datetime import timedelta
-import pandas as pd
-from threading import Lock
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_RIGHT
 import json
+import hashlib
+import base64
+import math
+import contextlib
+import time
+from storage import open_storage, BackgroundCompactor, TABLE_COLUMNS, INVOICE_SORT_COLUMNS
+from locks import LockManager
+from transactions import TransactionManager, TransactionAborted
+from stock_analysis import analyze_stock
+from sales_analysis import product_sales, reference_backfill, daily_units
+from forecast import rates_from_history, recommend_orders
+from simulation import (
+    Clinic, POLICIES, PAYMENT_METHODS, STORAGE_COST_PER_UNIT, invoice_line_rows, compare_policies,
+)
+from aggregates import DashboardAggregates, dashboard_summary
+from snapshots import SnapshotStore, SnapshotUnavailable, SNAPSHOT_TABLES
+from cache import file_signature
+from metrics import metrics, server_timing_header
+from profiling import Profiler
+from invoice_pdf import invoice_styles, render_invoices_combined
+from pdf_cache import PdfCache
+from pdf_jobs import PdfJobQueue
+from whatif_jobs import WhatifJobs
+from lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
 
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev-secret-key")
 
-_excel_lock = Lock()
 EXCEL_FILENAME = "animals.xlsx"
+DATABASE_FILENAME = "clinic.db"
 SHEET_NAME = "Animals"
+INVOICES_DIR = "invoices"
+PDF_CACHE_DIR = os.path.join(INVOICES_DIR, "cache")
+AGGREGATES_FILENAME = "dashboard_aggregates.json"
+STATE_FILENAME = "simulation_state.json"
+SNAPSHOT_DIR = "snapshots"
+PROFILE_DIR = "profiles"
+WHATIF_DIR = "whatif"
+
+# System of record (SQLite by default, CLINIC_STORAGE=excel for the old workbook)
+storage = open_storage(sqlite_path=DATABASE_FILENAME, excel_path=EXCEL_FILENAME)
+
+# Dashboard statistics, updated by every writer below
+aggregates = DashboardAggregates(AGGREGATES_FILENAME, storage)
+
+# Shared/exclusive locks per table plus the state and aggregates files,
+# held across threads and across app processes (lock files in <store>.locks/).
+# Every writer also holds AGGREGATES_LOCK exclusively, because the aggregates
+# are folded against the storage signature from before the write, so writes
+# are serialized; the table locks let reads of one table go on while
+# another table is written
+STATE_LOCK = "SimulationState"
+AGGREGATES_LOCK = "Aggregates"
+SNAPSHOT_LOCK = "Snapshot"
+ALL_TABLES = list(TABLE_COLUMNS)
+locks = LockManager(storage.path + ".locks", aliases=storage.lock_aliases)
+
+# Writes are durable once journaled; folding the journal into the workbook
+# (or checkpointing the SQLite WAL) happens in the background
+compactor = BackgroundCompactor(storage, lock=lambda: rewriting_storage())
+
+# Invoice PDFs are rendered on first download, in worker processes
+# (PDF_WORKERS=0 renders inline), and kept in a size-bounded cache
+pdf_jobs = PdfJobQueue()
+pdf_cache = PdfCache(PDF_CACHE_DIR)
+# What-if comparisons from the web run on a pool of their own (WHATIF_WORKERS),
+# so they never hold up PDF downloads; jobs left running by a process that
+# exited are marked failed
+whatif_jobs = WhatifJobs(WHATIF_DIR)
+whatif_jobs.fail_orphans()
+
+# Columnar copies of the history tables for reporting (needs pyarrow);
+# CLINIC_SNAPSHOT_FORMAT=parquet|feather, CLINIC_SNAPSHOT_PARTITION=month|day
+snapshots = SnapshotStore(
+    SNAPSHOT_DIR,
+    fmt=os.environ.get("CLINIC_SNAPSHOT_FORMAT", "parquet"),
+    partition=os.environ.get("CLINIC_SNAPSHOT_PARTITION", "month"),
+)
 
 
 def get_stock_items():
-    """Return list of stock items from Excel."""
-    items = []
-    if not os.path.exists(EXCEL_FILENAME):
-        return items
-    with _excel_lock:
-        try:
-            stock_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Stock")
-        except Exception:
-            return items
-    for _, row in stock_df.iterrows():
-        qty = int(row.get("Quantity", 0)) if not pd.isna(row.get("Quantity")) else 0
-        if qty == 0:
-            urgency = "CRITICAL"
-        elif qty < 5:
-            urgency = "HIGH"
-        elif qty < 10:
-            urgency = "MEDIUM"
-        else:
-            urgency = "OK"
-        items.append({
-            "timestamp": row.get("Timestamp", ""),
-            "reference": row.get("Reference", ""),
-            "name": row.get("Name", ""),
-            "quantity": qty,
-            "price": float(row.get("Price", 0)) if not pd.isna(row.get("Price")) else 0.0,
-            "type": row.get("Type", ""),
-            "urgency": urgency,
-        })
-    return items
+    """Return list of stock items from storage."""
+    with locks.read("Stock"):
+        stock_df = storage.read_table("Stock")
+    analysis = analyze_stock(stock_df)
+    return analysis[["timestamp", "reference", "name", "quantity", "price", "type", "urgency"]].to_dict("records")
 
 
 def upsert_stock_to_excel(row_dict: dict):
     """Insert or update a stock item (add or overwrite entire row)."""
-    stock_sheet = "Stock"
-    columns = [
-        "Timestamp",
-        "Reference",
-        "Name",
-        "Quantity",
-        "Price",
-        "Type",
-    ]
-
     row_with_ts = {
         "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         **row_dict,
     }
 
-    with _excel_lock:
-        if os.path.exists(EXCEL_FILENAME):
-            try:
-                # Try to read existing Stock sheet
-                existing_df = pd.read_excel(EXCEL_FILENAME, sheet_name=stock_sheet)
-            except Exception:
-                # Stock sheet doesn't exist or is unreadable
-                existing_df = pd.DataFrame(columns=columns)
-        else:
-            existing_df = pd.DataFrame(columns=columns)
-
-        ref = row_dict.get("Reference", "").strip()
-        if ref and not existing_df.empty and "Reference" in existing_df.columns:
-            match_idx = existing_df[existing_df["Reference"] == ref].index
-            if not match_idx.empty:
-                for col in columns:
-                    if col in row_with_ts:
-                        existing_df.loc[match_idx[0], col] = row_with_ts[col]
-                combined = existing_df
-            else:
-                new_df = pd.DataFrame([row_with_ts], columns=columns)
-                combined = pd.concat([existing_df, new_df], ignore_index=True)
-        else:
-            new_df = pd.DataFrame([row_with_ts], columns=columns)
-            combined = pd.concat([existing_df, new_df], ignore_index=True)
-
-        # Write back to Excel with multiple sheets
-        with pd.ExcelWriter(EXCEL_FILENAME, engine="openpyxl", mode="a" if os.path.exists(EXCEL_FILENAME) else "w") as writer:
-            # Preserve existing Animals sheet if it exists
-            if os.path.exists(EXCEL_FILENAME):
-                try:
-                    animals_df = pd.read_excel(EXCEL_FILENAME, sheet_name=SHEET_NAME)
-                    animals_df.to_excel(writer, sheet_name=SHEET_NAME, index=False)
-                except Exception:
-                    pass
-            combined.to_excel(writer, sheet_name=stock_sheet, index=False)
+    with locks.write("Stock", AGGREGATES_LOCK):
+        before = aggregates.begin_write()
+        storage.upsert_stock(row_with_ts)
+        aggregates.record(before, stock_rows=[row_with_ts])
 
 
 def save_invoice_to_excel(invoice_data: dict):
-    """Save invoice to the Invoices sheet in Excel."""
-    invoice_sheet = "Invoices"
-    columns = [
-        "Timestamp",
-        "Invoice Number",
-        "Owner Name",
-        "Items",
-        "Total Amount",
-        "Payment Method",
-        "PDF Path",
-    ]
+    """Append one invoice row to the Invoices table (no rewrite of existing rows)."""
 
     row = {
         "Timestamp": invoice_data["timestamp"],
@@ -131,222 +123,169 @@ def save_invoice_to_excel(invoice_data: dict):
         "PDF Path": invoice_data["pdf_path"],
     }
 
-    new_df = pd.DataFrame([row], columns=columns)
+    with locks.write("Invoices", "InvoiceLines", AGGREGATES_LOCK):
+        before = aggregates.begin_write()
+        storage.commit(appends={
+            "Invoices": [row],
+            "InvoiceLines": invoice_line_rows(invoice_data["invoice_number"], invoice_data.get("items", [])),
+        })
+        aggregates.record(before, appends={"Invoices": [row]})
+
+
+def load_invoice_data(invoice_num):
+    """Rebuild the data needed to render an invoice from storage, or None."""
+    with locks.read("Invoices", "InvoiceLines"):
+        found = storage.get_invoice(invoice_num)
+    if found is None:
+        return None
+    row, lines = found
+    if not lines:
+        # Recorded before line items were stored; nothing to render from
+        return None
+    return {
+        "invoice_number": row["Invoice Number"],
+        "timestamp": row["Timestamp"],
+        "owner_name": row["Owner Name"],
+        "payment_method": row["Payment Method"],
+        "total": float(row["Total Amount"]),
+        "items": [
+            {
+                "name": line["Name"],
+                "quantity": int(line["Quantity"]),
+                "unit_price": float(line["Unit Price"]),
+                "total": float(line["Total"]),
+            }
+            for line in lines
+        ],
+    }
 
-    with _excel_lock:
-        if os.path.exists(EXCEL_FILENAME):
-            try:
-                existing_df = pd.read_excel(EXCEL_FILENAME, sheet_name=invoice_sheet)
-                combined = pd.concat([existing_df, new_df], ignore_index=True)
-            except Exception:
-                combined = new_df
-        else:
-            combined = new_df
-
-        # Write to Excel preserving other sheets
-        with pd.ExcelWriter(EXCEL_FILENAME, engine="openpyxl", mode="a" if os.path.exists(EXCEL_FILENAME) else "w") as writer:
-            if os.path.exists(EXCEL_FILENAME):
-                # Preserve Animals sheet if present (simulation may write to it)
-                try:
-                    animals_df = pd.read_excel(EXCEL_FILENAME, sheet_name=SHEET_NAME)
-                    animals_df.to_excel(writer, sheet_name=SHEET_NAME, index=False)
-                except Exception:
-                    pass
-                try:
-                    stock_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Stock")
-                    stock_df.to_excel(writer, sheet_name="Stock", index=False)
-                except Exception:
-                    pass
-            combined.to_excel(writer, sheet_name=invoice_sheet, index=False)
-
-
-def generate_invoice_pdf(invoice_data: dict) -> str:
-    """Generate a PDF invoice and return the file path."""
-    # Create invoices directory if it doesn't exist
-    invoices_dir = "invoices"
-    os.makedirs(invoices_dir, exist_ok=True)
-
-    # Generate filename
-    invoice_num = invoice_data["invoice_number"]
-    pdf_filename = f"invoice_{invoice_num}.pdf"
-    pdf_path = os.path.join(invoices_dir, pdf_filename)
-
-    # Create PDF
-    doc = SimpleDocTemplate(pdf_path, pagesize=letter)
-    elements = []
-    styles = getSampleStyleSheet()
-
-    # Custom styles
-    title_style = ParagraphStyle(
-        "CustomTitle",
-        parent=styles["Heading1"],
-        fontSize=24,
-        textColor=colors.HexColor("#1a237e"),
-        spaceAfter=30,
-        alignment=TA_CENTER,
-    )
 
-    # Title
-    title = Paragraph("VETERINARY CLINIC INVOICE", title_style)
-    elements.append(title)
-    elements.append(Spacer(1, 0.2 * inch))
-
-    # Invoice details
-    info_data = [
-        ["Invoice Number:", invoice_num],
-        ["Date:", invoice_data["timestamp"]],
-        ["Owner Name:", invoice_data["owner_name"]],
-        ["Payment Method:", invoice_data["payment_method"]],
-    ]
-    info_table = Table(info_data, colWidths=[2 * inch, 4 * inch])
-    info_table.setStyle(
-        TableStyle(
-            [
-                ("FONTNAME", (0, 0), (0, -1), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, -1), 11),
-                ("TEXTCOLOR", (0, 0), (0, -1), colors.HexColor("#424242")),
-                ("ALIGN", (0, 0), (0, -1), "RIGHT"),
-                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 8),
-            ]
-        )
-    )
-    elements.append(info_table)
-    elements.append(Spacer(1, 0.4 * inch))
-
-    # Items table
-    items_data = [["Item/Service", "Quantity", "Unit Price", "Total"]]
-    for item in invoice_data["items"]:
-        items_data.append(
-            [
-                item["name"],
-                str(item["quantity"]),
-                f"${float(item['unit_price']):.2f}",
-                f"${float(item['total']):.2f}",
-            ]
-        )
-
-    items_table = Table(items_data, colWidths=[3 * inch, 1 * inch, 1.5 * inch, 1.5 * inch])
-    items_table.setStyle(
-        TableStyle(
-            [
-                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#1a237e")),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, 0), 12),
-                ("ALIGN", (1, 0), (-1, -1), "CENTER"),
-                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
-                ("TOPPADDING", (0, 0), (-1, 0), 12),
-                ("GRID", (0, 0), (-1, -1), 1, colors.HexColor("#e0e0e0")),
-                ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#f5f5f5")]),
-                ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
-                ("FONTSIZE", (0, 1), (-1, -1), 10),
-            ]
-        )
-    )
-    elements.append(items_table)
-    elements.append(Spacer(1, 0.3 * inch))
-
-    # Total
-    total_data = [["TOTAL:", f"${float(invoice_data['total']):.2f}"]]
-    total_table = Table(total_data, colWidths=[5.5 * inch, 1.5 * inch])
-    total_table.setStyle(
-        TableStyle(
-            [
-                ("FONTNAME", (0, 0), (-1, -1), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, -1), 14),
-                ("ALIGN", (0, 0), (0, 0), "RIGHT"),
-                ("ALIGN", (1, 0), (1, 0), "CENTER"),
-                ("TEXTCOLOR", (0, 0), (-1, -1), colors.HexColor("#1a237e")),
-                ("BACKGROUND", (1, 0), (1, 0), colors.HexColor("#e3f2fd")),
-                ("BOX", (1, 0), (1, 0), 2, colors.HexColor("#1a237e")),
-                ("TOPPADDING", (0, 0), (-1, -1), 10),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 10),
-            ]
-        )
-    )
-    elements.append(total_table)
-
-    # Build PDF
-    doc.build(elements)
-    return pdf_path
-
-
-def get_dashboard_data():
-    """Read Excel data and compute dashboard statistics."""
-    data = {
-        "total_animals": 0,
-        "animal_types": {},
-        "stock_items": [],
-        "low_stock_items": [],
-        "total_invoices": 0,
-        "total_revenue": 0.0,
-        "daily_revenue": {},
+INVOICES_PER_PAGE = 50
+MAX_INVOICES_PER_PAGE = 500
+
+
+def invoice_filters(args) -> dict:
+    """Invoice filters from query arguments; raises ValueError on a malformed date."""
+    filters = {}
+    for key in ("start", "end"):
+        value = args.get(key, "").strip()
+        if value:
+            datetime.strptime(value, "%Y-%m-%d")
+            filters[key] = value
+    owner = args.get("owner", "").strip()
+    if owner:
+        filters["owner"] = owner
+    payment = args.get("payment", "").strip()
+    if payment:
+        filters["payment"] = payment
+    return filters
+
+
+def invoice_sort(args):
+    """``(sort key, descending)`` from query arguments; newest first by default."""
+    sort = args.get("sort", "date")
+    if sort not in INVOICE_SORT_COLUMNS:
+        sort = "date"
+    return sort, args.get("order", "desc") != "asc"
+
+
+def encode_cursor(cursor) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(token: str):
+    """Inverse of encode_cursor; raises ValueError on a malformed token."""
+    cursor = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    if not isinstance(cursor, list) or len(cursor) != 2:
+        raise ValueError("bad cursor")
+    return cursor
+
+
+def invoice_pdf_numbers() -> set:
+    """Invoice numbers with a PDF on disk, from one listing per directory."""
+    numbers = pdf_cache.cached_numbers()
+    if os.path.isdir(INVOICES_DIR):
+        for entry in os.scandir(INVOICES_DIR):
+            if entry.name.startswith("invoice_") and entry.name.endswith(".pdf"):
+                numbers.add(entry.name[len("invoice_"):-len(".pdf")])
+    return numbers
+
+
+def invoice_summary(row: dict, pdf_numbers: set) -> dict:
+    """One Invoices row as shown in the list and the API."""
+    number = "" if pd.isna(row["Invoice Number"]) else str(row["Invoice Number"])
+    total = pd.to_numeric(row["Total Amount"], errors="coerce")
+    return {
+        "timestamp": "" if pd.isna(row["Timestamp"]) else str(row["Timestamp"]),
+        "number": number,
+        "owner": "" if pd.isna(row["Owner Name"]) else row["Owner Name"],
+        "payment": "" if pd.isna(row["Payment Method"]) else row["Payment Method"],
+        "total": 0.0 if pd.isna(total) else float(total),
+        "pdf_exists": number in pdf_numbers,
     }
 
-    if not os.path.exists(EXCEL_FILENAME):
-        return data
 
-    with _excel_lock:
-        # Animals data
-        try:
-            animals_df = pd.read_excel(EXCEL_FILENAME, sheet_name=SHEET_NAME)
-            if not animals_df.empty:
-                data["total_animals"] = len(animals_df)
-                
-                # Count by animal type
-                if "Animal Type" in animals_df.columns:
-                    type_counts = animals_df["Animal Type"].value_counts().to_dict()
-                    data["animal_types"] = type_counts
-        except Exception:
-            # Animals sheet doesn't exist or is empty - that's OK
-            data["animal_types"] = {"No Data": 1}
-            pass
+def invoice_pdf_path(invoice_num) -> str:
+    """Path of an invoice PDF written before PDFs were cached on demand."""
+    return os.path.join(INVOICES_DIR, f"invoice_{invoice_num}.pdf")
 
-        # Stock data
-        try:
-            stock_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Stock")
-            for _, row in stock_df.iterrows():
-                item = {
-                    "name": row.get("Name", ""),
-                    "reference": row.get("Reference", ""),
-                    "quantity": int(row.get("Quantity", 0)),
-                    "type": row.get("Type", ""),
-                }
-                data["stock_items"].append(item)
-                
-                # Low stock alert (quantity < 10)
-                if item["quantity"] < 10:
-                    data["low_stock_items"].append(item)
-        except Exception:
-            pass
 
-        # Invoices data
-        try:
-            invoices_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Invoices")
-            data["total_invoices"] = len(invoices_df)
-            
-            if "Total Amount" in invoices_df.columns:
-                data["total_revenue"] = float(invoices_df["Total Amount"].sum())
-            
-            # Daily revenue (last 30 days)
-            if "Timestamp" in invoices_df.columns and "Total Amount" in invoices_df.columns:
-                invoices_df["Timestamp"] = pd.to_datetime(invoices_df["Timestamp"], errors="coerce")
-                invoices_df["Date"] = invoices_df["Timestamp"].dt.strftime("%Y-%m-%d")
-                daily = invoices_df.groupby("Date")["Total Amount"].sum().to_dict()
-                # Get last 30 days sorted
-                sorted_days = sorted(daily.keys())[-30:]
-                data["daily_revenue"] = {day: daily[day] for day in sorted_days}
-        except Exception:
-            pass
+def get_dashboard_data(analytics: bool = False):
+    """Dashboard statistics, from the aggregates maintained on write.
+
+    With ``analytics`` they are recomputed from the columnar snapshot instead,
+    reading only the Timestamp, Total Amount and Animal Type columns; the
+    snapshot is brought up to date first if Animals or Invoices have changed.
+    """
+    if not analytics:
+        with locks.read(AGGREGATES_LOCK):
+            return aggregates.snapshot()
+    with locks.read(*SNAPSHOT_TABLES):
+        current = snapshots.is_current(storage)
+    if not current:
+        export_snapshot()
+    with locks.read(SNAPSHOT_LOCK):
+        animals_df = snapshots.read("Animals", columns=["Animal Type"])
+        invoices_df = snapshots.read("Invoices", columns=["Timestamp", "Total Amount"])
+    with locks.read("Stock"):
+        stock_df = storage.read_table("Stock")
+    return dashboard_summary(animals_df, invoices_df, stock_df)
+
+
+def export_snapshot(full: bool = False) -> dict:
+    """Write changed partitions of the history tables to the columnar snapshot."""
+    with locks.acquire(read=SNAPSHOT_TABLES, write=[SNAPSHOT_LOCK]):
+        return snapshots.export(storage, full=full)
 
-    return data
+
+@contextlib.contextmanager
+def rewriting_storage():
+    """Exclusive locks for compacting storage; the aggregates are restamped after.
+
+    Compaction changes storage's files but not the data in them, so the
+    aggregates are kept (and the dashboard ETag with them) rather than rebuilt.
+    """
+    with locks.write(*ALL_TABLES, AGGREGATES_LOCK):
+        before = aggregates.begin_write()
+        yield
+        aggregates.restamp(before)
+
+
+def data_version() -> str:
+    """Version of everything the dashboard shows; changes on any write, in any process.
+
+    Every write to storage updates the aggregates, which get a new version
+    token, and the rest comes from the simulation state file, whose mtime
+    and size identify it.  Compacting storage changes neither.
+    """
+    with locks.read(AGGREGATES_LOCK):
+        sig = (aggregates.version(), file_signature(STATE_FILENAME))
+    return hashlib.sha1(repr(sig).encode("utf-8")).hexdigest()[:16]
 
 
 def get_simulation_state():
     """Get current simulation state (day number, budget, etc.)."""
-    state_file = "simulation_state.json"
+    state_file = STATE_FILENAME
     default_state = {
         "current_day": 1,
         "budget": 5000.0,
@@ -370,266 +309,133 @@ def get_simulation_state():
 
 def save_simulation_state(state):
     """Save simulation state to file."""
-    state_file = "simulation_state.json"
-    with open(state_file, 'w') as f:
+    state_file = STATE_FILENAME
+    # Write a temp file and swap it in, so readers never see a partial file
+    tmp_file = f"{state_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
         json.dump(state, f, indent=2)
+        # Durable before it replaces the old state: a commit's intent file is
+        # removed right after this, and is the only other copy of the state
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, state_file)
+
+
+def consumption_rates(state: dict) -> dict:
+    """Smoothed daily usage per Stock reference, as of the state's current day.
+
+    Kept up to date by simulate_days; states saved before that are seeded
+    from the invoice line history.
+    """
+    consumption = state.get("consumption")
+    if consumption is not None:
+        return consumption["rates"]
+    with locks.read("Invoices", "InvoiceLines"):
+        lines_df = storage.read_table("InvoiceLines")
+        invoices_df = storage.read_table("Invoices")
+    return rates_from_history(daily_units(lines_df, invoices_df))
 
 
 def get_dss_recommendations():
-    """Decision Support System: analyze stock and provide purchase recommendations."""
-    recommendations = []
-    
-    if not os.path.exists(EXCEL_FILENAME):
-        return recommendations
-    
-    with _excel_lock:
+    """Decision Support System: reorder what forecast usage says will run short, within budget."""
+    state = get_simulation_state()
+    with locks.read("Stock"):
         try:
-            stock_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Stock")
-            
-            for _, row in stock_df.iterrows():
-                qty = int(row.get("Quantity", 0))
-                name = row.get("Name", "")
-                ref = row.get("Reference", "")
-                price = float(row.get("Price", 0))
-                item_type = row.get("Type", "")
-                
-                # DSS logic: recommend purchase based on stock level
-                if qty == 0:
-                    recommended_qty = 50
-                    urgency = "CRITICAL"
-                elif qty < 5:
-                    recommended_qty = 30
-                    urgency = "HIGH"
-                elif qty < 10:
-                    recommended_qty = 20
-                    urgency = "MEDIUM"
-                else:
-                    continue
-                
-                total_cost = recommended_qty * price
-                recommendations.append({
-                    "reference": ref,
-                    "name": name,
-                    "current_qty": qty,
-                    "recommended_qty": recommended_qty,
-                    "unit_price": price,
-                    "total_cost": total_cost,
-                    "urgency": urgency,
-                    "type": item_type
-                })
+            stock_df = storage.read_table("Stock")
         except Exception:
-            pass
-    
-    # Sort by urgency and return
-    urgency_order = {"CRITICAL": 0, "HIGH": 1, "MEDIUM": 2}
-    recommendations.sort(key=lambda x: urgency_order.get(x["urgency"], 3))
-    return recommendations
+            return []
 
+    # Most urgent (fewest days of cover) first
+    recommendations = recommend_orders(
+        stock_df, consumption_rates(state), state["budget"], holding_cost=STORAGE_COST_PER_UNIT
+    )
+    return recommendations[
+        ["reference", "name", "current_qty", "recommended_qty", "unit_price", "total_cost", "urgency", "type",
+         "daily_usage", "days_of_cover", "budget_limited"]
+    ].to_dict("records")
+
+
+MAX_ADVANCE_DAYS = 365
+MAX_WHATIF_TRIALS = 5000
+# Per policy; larger comparisons are for the compare-policies command
+MAX_WEB_WHATIF_TRIALS = 500
+
+
+def simulate_days(n: int = 1):
+    """Simulate ``n`` consecutive days and write them to storage in one flush.
+
+    The days run on the in-memory simulation kernel; visits, invoices and
+    stock consumption accumulate there, and storage and the simulation
+    state see a single transaction at the end.  No PDFs are rendered here;
+    see invoices_download.
+    """
+    # Seeding the rates from the history takes read locks on Invoices and
+    # InvoiceLines, which the transaction's last attempt holds for writing
+    seed_rates = consumption_rates(get_simulation_state())
+
+    def plan(txn):
+        state = txn.state
+        if "consumption" not in state:
+            state["consumption"] = {"rates": seed_rates}
+        clinic = Clinic(state, txn.stock_table(), record=True)
+        days = clinic.run_days(n)
+
+        txn.state = clinic.state
+        # Only the stock rows that were consumed need to be written back
+        txn.stock_updates = clinic.stock_updates()
+        txn.appends = clinic.appends()
+        txn.result = {
+            "first_day": days[0]["day"] if days else state["current_day"],
+            "last_day": days[-1]["day"] if days else state["current_day"] - 1,
+            "daily": [
+                {key: day[key] for key in ("day", "animals_treated", "revenue", "overhead")}
+                for day in days
+            ],
+            "events": days[-1]["events"] if days else [],
+            "animals_treated": sum(d["animals_treated"] for d in days),
+            "revenue": round(sum(d["revenue"] for d in days), 2),
+            "new_budget": clinic.state["budget"]
+        }
+
+    # Simulated from a snapshot without holding locks; if stock or state
+    # changed meanwhile the whole batch is simulated again on fresh data
+    return transactions.run(plan, tables=ALL_TABLES).result
 
-def simulate_day():
-    """Simulate one day: random events, stock consumption, animal visits, auto invoice generation with line items, and daily overhead costs."""
-    import random
 
+def whatif_start():
+    """The current state (with consumption rates) and Stock, to start what-if runs from."""
     state = get_simulation_state()
-    events = []
-    daily_revenue = 0.0
-    day_number = state["current_day"]
-    try:
-        base_date = datetime.fromisoformat(state["start_date"]).date()
-    except Exception:
-        base_date = datetime.now().date()
-    sim_date = base_date + timedelta(days=day_number - 1)
+    if "consumption" not in state:
+        state["consumption"] = {"rates": consumption_rates(state)}
+    with locks.read("Stock"):
+        stock_df = storage.read_table("Stock")
+    return state, stock_df
 
-    num_visits = random.randint(3, 8)
-    animal_types = ["Dog", "Cat", "Rabbit", "Bird", "Hamster"]
-    owner_names = ["John Smith", "Mary Johnson", "David Lee", "Sarah Wilson", "Mike Brown", "Emma Davis"]
-
-    with _excel_lock:
-        try:
-            stock_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Stock")
-        except Exception:
-            stock_df = pd.DataFrame(columns=["Timestamp", "Reference", "Name", "Quantity", "Price", "Type"])
-        try:
-            animals_df = pd.read_excel(EXCEL_FILENAME, sheet_name=SHEET_NAME)
-        except Exception:
-            animals_df = pd.DataFrame(columns=["Timestamp", "Animal Name", "Animal Type", "Medical History", "Age", "Sex", "Owner Name", "Owner Email", "Owner Phone", "Comments"])
-        try:
-            invoices_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Invoices")
-        except Exception:
-            invoices_df = pd.DataFrame(columns=["Timestamp", "Invoice Number", "Owner Name", "Items", "Total Amount", "Payment Method", "PDF Path"])
-
-        for i in range(num_visits):
-            animal_type = random.choice(animal_types)
-            animal_name = f"{animal_type} #{random.randint(100, 999)}"
-            owner_name = random.choice(owner_names)
-            age = random.randint(1, 15)
-            sex = random.choice(["Male", "Female"])
-
-            new_animal = pd.DataFrame([{
-                "Timestamp": datetime.combine(sim_date, datetime.now().time()).strftime("%Y-%m-%d %H:%M:%S"),
-                "Animal Name": animal_name,
-                "Animal Type": animal_type,
-                "Medical History": "Simulation visit",
-                "Age": age,
-                "Sex": sex,
-                "Owner Name": owner_name,
-                "Owner Email": f"{owner_name.lower().replace(' ', '.')}@email.com",
-                "Owner Phone": f"+1-555-{random.randint(1000, 9999)}",
-                "Comments": f"Day {day_number} visit"
-            }])
-            animals_df = pd.concat([animals_df, new_animal], ignore_index=True)
-
-            line_items = []
-
-            # Consultation fee
-            consult_fee = round(random.uniform(30, 80), 2)
-            line_items.append({
-                "name": "Consultation Fee",
-                "quantity": 1,
-                "unit_price": consult_fee,
-                "total": consult_fee,
-            })
-
-            # Vaccines (50% chance)
-            if random.random() < 0.5:
-                vaccine_rows = stock_df[stock_df["Type"] == "Vaccine"]
-                if not vaccine_rows.empty:
-                    idx = vaccine_rows.sample(1).index[0]
-                    if stock_df.loc[idx, "Quantity"] > 0:
-                        stock_df.loc[idx, "Quantity"] -= 1
-                        item_name = stock_df.loc[idx, "Name"]
-                        item_price = float(stock_df.loc[idx, "Price"])
-                        sell_unit = round(item_price * 2.0, 2)
-                        line_items.append({
-                            "name": item_name,
-                            "quantity": 1,
-                            "unit_price": sell_unit,
-                            "total": sell_unit,
-                        })
-
-            # Medicine (40% chance)
-            if random.random() < 0.4:
-                medicine_rows = stock_df[stock_df["Type"] == "Medicine"]
-                if not medicine_rows.empty:
-                    idx = medicine_rows.sample(1).index[0]
-                    consume_qty = random.randint(1, 3)
-                    current = stock_df.loc[idx, "Quantity"]
-                    actual_consume = min(consume_qty, current)
-                    if actual_consume > 0:
-                        stock_df.loc[idx, "Quantity"] -= actual_consume
-                        item_name = stock_df.loc[idx, "Name"]
-                        item_price = float(stock_df.loc[idx, "Price"])
-                        sell_unit = round(item_price * 1.8, 2)
-                        line_items.append({
-                            "name": item_name,
-                            "quantity": int(actual_consume),
-                            "unit_price": sell_unit,
-                            "total": round(sell_unit * int(actual_consume), 2),
-                        })
-
-            # Accessories (30% chance)
-            if random.random() < 0.3:
-                acc_rows = stock_df[stock_df["Type"] == "Accessory"]
-                if not acc_rows.empty:
-                    idx = acc_rows.sample(1).index[0]
-                    consume_qty = random.randint(1, 2)
-                    current = stock_df.loc[idx, "Quantity"]
-                    actual_consume = min(consume_qty, current)
-                    if actual_consume > 0:
-                        stock_df.loc[idx, "Quantity"] -= actual_consume
-                        item_name = stock_df.loc[idx, "Name"]
-                        item_price = float(stock_df.loc[idx, "Price"])
-                        sell_unit = round(item_price * 3.0, 2)
-                        line_items.append({
-                            "name": item_name,
-                            "quantity": int(actual_consume),
-                            "unit_price": sell_unit,
-                            "total": round(sell_unit * int(actual_consume), 2),
-                        })
-
-            visit_total = round(sum(li["total"] for li in line_items), 2)
-            daily_revenue += visit_total
-
-            invoice_num = f"{state['current_day']}{i+1:02d}{random.randint(100, 999)}"
-            items_summary = "; ".join([f"{li['name']} (x{li['quantity']})" for li in line_items])
-            invoice_data = {
-                "timestamp": datetime.combine(sim_date, datetime.now().time()).strftime("%Y-%m-%d %H:%M:%S"),
-                "invoice_number": invoice_num,
-                "owner_name": owner_name,
-                "payment_method": random.choice(["Cash", "Card", "Insurance"]),
-                "items": line_items,
-                "total": visit_total,
-                "items_summary": items_summary,
-                "pdf_path": ""
-            }
-            pdf_path = generate_invoice_pdf(invoice_data)
-            invoice_data["pdf_path"] = pdf_path
-
-            invoices_df = pd.concat([invoices_df, pd.DataFrame([{
-                "Timestamp": invoice_data["timestamp"],
-                "Invoice Number": invoice_num,
-                "Owner Name": owner_name,
-                "Items": items_summary,
-                "Total Amount": visit_total,
-                "Payment Method": invoice_data["payment_method"],
-                "PDF Path": pdf_path
-            }])], ignore_index=True)
-
-            events.append({
-                "type": "visit",
-                "animal": f"{animal_name} ({animal_type})",
-                "items_used": [f"{li['name']} x{li['quantity']}" for li in line_items],
-                "revenue": visit_total
-            })
-
-        with pd.ExcelWriter(EXCEL_FILENAME, engine="openpyxl") as writer:
-            animals_df.to_excel(writer, sheet_name=SHEET_NAME, index=False)
-            stock_df.to_excel(writer, sheet_name="Stock", index=False)
-            invoices_df.to_excel(writer, sheet_name="Invoices", index=False)
-
-    # Operational costs (rent and storage)
-    RENT_PER_DAY = 100.0
-    try:
-        with _excel_lock:
-            stock_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Stock")
-            total_units = int(stock_df["Quantity"].fillna(0).sum())
-    except Exception:
-        total_units = 0
-    STORAGE_COST_PER_UNIT = 0.01
-    storage_cost = round(STORAGE_COST_PER_UNIT * total_units, 2)
-    overhead_total = round(RENT_PER_DAY + storage_cost, 2)
-
-    state["current_day"] += 1
-    state["budget"] += daily_revenue
-    state["budget"] -= overhead_total
-    if overhead_total > 0:
-        events.append({"type": "cost", "name": "Clinic Rent", "cost": RENT_PER_DAY})
-        if storage_cost > 0:
-            events.append({"type": "cost", "name": "Storage Cost", "cost": storage_cost, "units": total_units})
-    state["daily_events"] = events
-    state["total_animals_treated"] += num_visits
-    save_simulation_state(state)
 
+def simulate_day():
+    """Simulate one day: random events, stock consumption, animal visits, auto invoice generation with line items, and daily overhead costs."""
+    result = simulate_days(1)
     return {
-        "day": day_number,
-        "events": events,
-        "animals_treated": num_visits,
-        "revenue": round(daily_revenue, 2),
-        "new_budget": state["budget"]
+        "day": result["first_day"],
+        "events": result["events"],
+        "animals_treated": result["animals_treated"],
+        "revenue": result["revenue"],
+        "new_budget": result["new_budget"]
     }
 
 
 def reset_simulation(full: bool = True):
-    """Reset simulation. If full=True, wipe all data (Excel, invoices, state) to a fresh start."""
+    """Reset simulation. If full=True, wipe all data (tables, Excel export, invoices, state) to a fresh start."""
     # Remove existing files for a truly fresh state
     if full:
+        pdf_cache.clear()
         if os.path.exists(EXCEL_FILENAME):
             try:
                 os.remove(EXCEL_FILENAME)
             except Exception:
                 pass
         # Delete all generated invoice PDFs
-        invoices_dir = "invoices"
+        invoices_dir = INVOICES_DIR
         if os.path.isdir(invoices_dir):
             for fname in os.listdir(invoices_dir):
                 if fname.lower().endswith(".pdf"):
@@ -638,9 +444,9 @@ def reset_simulation(full: bool = True):
                     except Exception:
                         pass
         # Reset state file
-        if os.path.exists("simulation_state.json"):
+        if os.path.exists(STATE_FILENAME):
             try:
-                os.remove("simulation_state.json")
+                os.remove(STATE_FILENAME)
             except Exception:
                 pass
 
@@ -650,9 +456,9 @@ def reset_simulation(full: bool = True):
         "budget": 5000.0,
         "daily_events": [],
         "total_animals_treated": 0,
-        "start_date": datetime.now().date().isoformat()
+        "start_date": datetime.now().date().isoformat(),
+        "consumption": {"rates": {}},
     }
-    save_simulation_state(initial_state)
 
     # Initial stock baseline
     initial_stock = [
@@ -669,21 +475,70 @@ def reset_simulation(full: bool = True):
     stock_df = pd.DataFrame(initial_stock)
     stock_df["Timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    # Create fresh Excel file with empty Animals & Invoices sheets
-    with _excel_lock:
-        with pd.ExcelWriter(EXCEL_FILENAME, engine="openpyxl") as writer:
-            # Empty Animals sheet
-            animals_cols = ["Timestamp", "Animal Name", "Animal Type", "Medical History", "Age", "Sex", "Owner Name", "Owner Email", "Owner Phone", "Comments"]
-            pd.DataFrame(columns=animals_cols).to_excel(writer, sheet_name=SHEET_NAME, index=False)
-            # Stock
-            stock_df.to_excel(writer, sheet_name="Stock", index=False)
-            # Empty Invoices sheet
-            invoice_cols = ["Timestamp", "Invoice Number", "Owner Name", "Items", "Total Amount", "Payment Method", "PDF Path"]
-            pd.DataFrame(columns=invoice_cols).to_excel(writer, sheet_name="Invoices", index=False)
+    # Fresh tables: empty Animals & Invoices, baseline Stock
+    with locks.write(*ALL_TABLES, STATE_LOCK, AGGREGATES_LOCK):
+        # A new version, so transactions that read the old state conflict
+        initial_state["version"] = get_simulation_state().get("version", 0) + 1
+        save_simulation_state(initial_state)
+        storage.reset(stock_df)
+        aggregates.rebuild()
 
     return initial_state
 
 
+# Budget + stock changes (purchases, simulated days) commit as one unit,
+# validated optimistically; finish any commit a crash interrupted
+transactions = TransactionManager(
+    storage,
+    STATE_FILENAME,
+    load_state=get_simulation_state,
+    save_state=save_simulation_state,
+    lock=lambda tables: locks.write(*tables, STATE_LOCK, AGGREGATES_LOCK),
+    aggregates=aggregates,
+)
+with locks.write(*ALL_TABLES, STATE_LOCK, AGGREGATES_LOCK):
+    transactions.recover()
+
+
+@app.before_request
+def start_background_work():
+    compactor.start()
+
+
+@app.before_request
+def start_request_metrics():
+    metrics.begin_request(request.endpoint or "unknown")
+
+
+# Requests profiled on demand (?profile=<CLINIC_PROFILE_KEY>) or sampled
+# (CLINIC_PROFILE_RATE); see profiling.py
+profiler = Profiler.from_env(PROFILE_DIR)
+
+
+@app.before_request
+def start_profile():
+    if profiler.enabled:
+        g.profile = profiler.start(request.args.get("profile"))
+
+
+@app.teardown_request
+def finish_profile(exc):
+    # Runs even when the request failed, so the profiler is always freed
+    run = g.pop("profile", None)
+    if run is not None:
+        saved = profiler.stop(run, request.endpoint or "unknown")
+        if saved:
+            app.logger.info("Saved profile %s", saved)
+
+
+@app.after_request
+def finish_request_metrics(response):
+    timings = metrics.end_request(request.method, response.status_code)
+    if timings:
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
+
 @app.route("/", methods=["GET"])
 def root_redirect():
     return redirect(url_for("dashboard"))
@@ -707,8 +562,8 @@ def stock_submit():
         row = {
             "Reference": form.get("reference", "").strip(),
             "Name": form.get("name", "").strip(),
-            "Quantity": form.get("quantity", "").strip(),
-            "Price": form.get("price", "").strip(),
+            "Quantity": int(form.get("quantity", "").strip()),
+            "Price": float(form.get("price", "").strip()),
             "Type": form.get("type", "").strip(),
         }
         upsert_stock_to_excel(row)
@@ -724,63 +579,121 @@ def stock_refill():
     if not reference or quantity_add <= 0:
         flash("Invalid refill parameters.", "error")
         return redirect(url_for("stock"))
-    with _excel_lock:
-        try:
-            stock_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Stock")
-        except Exception:
-            flash("Stock sheet not found.", "error")
-            return redirect(url_for("stock"))
-        idx = stock_df[stock_df["Reference"] == reference].index
-        if idx.empty:
-            flash("Reference not found.", "error")
-            return redirect(url_for("stock"))
-        stock_df.loc[idx[0], "Quantity"] = int(stock_df.loc[idx[0], "Quantity"] or 0) + quantity_add
-        stock_df.loc[idx[0], "Timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        # Preserve other sheets
-        try:
-            animals_df = pd.read_excel(EXCEL_FILENAME, sheet_name=SHEET_NAME)
-        except Exception:
-            animals_df = pd.DataFrame()
-        try:
-            invoices_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Invoices")
-        except Exception:
-            invoices_df = pd.DataFrame()
-        with pd.ExcelWriter(EXCEL_FILENAME, engine="openpyxl") as writer:
-            if not animals_df.empty:
-                animals_df.to_excel(writer, sheet_name=SHEET_NAME, index=False)
-            stock_df.to_excel(writer, sheet_name="Stock", index=False)
-            if not invoices_df.empty:
-                invoices_df.to_excel(writer, sheet_name="Invoices", index=False)
+    with locks.write("Stock", AGGREGATES_LOCK):
+        before = aggregates.begin_write()
+        updated = storage.adjust_stock(reference, quantity_add, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        if updated is not None:
+            aggregates.record(before, stock_rows=[updated])
+    if updated is None:
+        flash("Reference not found.", "error")
+        return redirect(url_for("stock"))
     flash(f"Refilled {reference} by {quantity_add} units.", "success")
     return redirect(url_for("stock"))
 
 
 @app.route("/invoices", methods=["GET"])
 def invoices_list():
-    invoices = []
-    if os.path.exists(EXCEL_FILENAME):
-        with _excel_lock:
-            try:
-                invoices_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Invoices")
-                for _, row in invoices_df.iterrows():
-                    invoices.append({
-                        "timestamp": row.get("Timestamp", ""),
-                        "number": row.get("Invoice Number", ""),
-                        "owner": row.get("Owner Name", ""),
-                        "total": float(row.get("Total Amount", 0)),
-                        "pdf_exists": os.path.exists(os.path.join("invoices", f"invoice_{row.get('Invoice Number', '')}.pdf"))
-                    })
-            except Exception:
-                pass
-    return render_template("invoices.html", invoices=invoices)
+    """One page of invoices, filtered and sorted in storage."""
+    try:
+        filters = invoice_filters(request.args)
+    except ValueError:
+        flash("Dates must be in YYYY-MM-DD format.", "error")
+        filters = {}
+    sort, descending = invoice_sort(request.args)
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+        per_page = min(MAX_INVOICES_PER_PAGE, max(1, int(request.args.get("per_page", INVOICES_PER_PAGE))))
+    except ValueError:
+        page, per_page = 1, INVOICES_PER_PAGE
+
+    pdf_numbers = invoice_pdf_numbers()
+    with locks.read("Invoices"):
+        total = storage.count_invoices(filters)
+        pages = max(1, math.ceil(total / per_page))
+        # Past the end (the listing shrank, or a hand-edited URL): show the last page
+        page = min(page, pages)
+        rows = list(storage.iter_invoices(filters, sort, descending, offset=(page - 1) * per_page, limit=per_page))
+    invoices = [invoice_summary(row, pdf_numbers) for row, _ in rows]
+
+    def page_url(number):
+        return url_for("invoices_list", **{**request.args.to_dict(), "page": number})
+
+    return render_template(
+        "invoices.html",
+        invoices=invoices,
+        total=total,
+        page=page,
+        pages=pages,
+        page_url=page_url,
+        filters=filters,
+        sort=sort,
+        order="desc" if descending else "asc",
+        sort_keys=list(INVOICE_SORT_COLUMNS),
+        payment_methods=PAYMENT_METHODS,
+    )
+
+
+@app.route("/api/invoices", methods=["GET"])
+def invoices_api():
+    """Invoices as NDJSON, one object per line, streamed as they are read.
+
+    Takes the same filters and sort as /invoices, plus ``limit`` and
+    ``cursor`` (the ``cursor`` of the last row received) to continue a listing.
+    """
+    try:
+        filters = invoice_filters(request.args)
+        after = decode_cursor(request.args["cursor"]) if request.args.get("cursor") else None
+        limit = int(request.args["limit"]) if request.args.get("limit") else None
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be positive")
+    except ValueError:
+        return {"error": "Invalid date, cursor or limit."}, 400
+    sort, descending = invoice_sort(request.args)
+
+    pdf_numbers = invoice_pdf_numbers()
+    with locks.read("Invoices"):
+        rows = storage.iter_invoices(filters, sort, descending, after=after, limit=limit)
+
+    def generate():
+        for row, cursor in rows:
+            yield json.dumps({**invoice_summary(row, pdf_numbers), "cursor": encode_cursor(cursor)}) + "\n"
+
+    return app.response_class(generate(), mimetype="application/x-ndjson")
+
+
+@app.route("/api/product-sales", methods=["GET"])
+def product_sales_api():
+    """Units sold, revenue and margin per product, from the invoice lines.
+
+    ``start``/``end`` (YYYY-MM-DD) restrict it to invoices in that range.
+    """
+    try:
+        filters = invoice_filters(request.args)
+    except ValueError:
+        return {"error": "Dates must be in YYYY-MM-DD format."}, 400
+    with locks.read("Invoices", "InvoiceLines", "Stock"):
+        lines_df = storage.read_table("InvoiceLines")
+        invoices_df = storage.read_table("Invoices")
+        stock_df = storage.read_table("Stock")
+    sales = product_sales(lines_df, invoices_df, stock_df, since=filters.get("start"), until=filters.get("end"))
+    return {"products": sales.round(2).to_dict("records")}
+
 
 @app.route("/invoices/download/<invoice_num>")
 def invoices_download(invoice_num):
-    pdf_path = os.path.join("invoices", f"invoice_{invoice_num}.pdf")
-    if os.path.exists(pdf_path):
-        return send_file(pdf_path, as_attachment=True, download_name=f"invoice_{invoice_num}.pdf")
-    flash("Invoice not found.", "error")
-    return redirect(url_for("invoices_list"))
+    pdf_path = invoice_pdf_path(invoice_num)
+    if not os.path.exists(pdf_path):
+        invoice_data = load_invoice_data(invoice_num)
+        if invoice_data is None:
+            flash("Invoice not found.", "error")
+            return redirect(url_for("invoices_list"))
+        try:
+            # Cached by content; rendered in a worker process on a miss
+            pdf_path = pdf_cache.get_or_render(invoice_data, pdf_jobs.render)
+        except Exception as e:
+            flash(f"Failed to render invoice: {e}", "error")
+            return redirect(url_for("invoices_list"))
+    return send_file(os.path.abspath(pdf_path), as_attachment=True, download_name=f"invoice_{invoice_num}.pdf")
 
 
 @app.route("/dashboard", methods=["GET"])
@@ -790,13 +703,30 @@ def dashboard():
     return render_template("dashboard.html", state=state)
 
 
+# Serialized /api/dashboard-data body for the current data version
+_dashboard_body = (None, None)
+
+
 @app.route("/api/dashboard-data", methods=["GET"])
 def dashboard_data():
-    """Return dashboard data as JSON for Chart.js."""
-    data = get_dashboard_data()
-    state = get_simulation_state()
-    data["simulation_state"] = state
-    return data
+    """Return dashboard data as JSON for Chart.js (ETag-validated, 304 when unchanged)."""
+    global _dashboard_body
+    version = data_version()
+    if version in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        cached_version, body = _dashboard_body
+        if cached_version != version:
+            data = get_dashboard_data()
+            data["simulation_state"] = get_simulation_state()
+            data["data_version"] = version
+            body = json.dumps(data)
+            _dashboard_body = (version, body)
+        response = app.response_class(body, mimetype="application/json")
+    response.set_etag(version)
+    # Let browsers keep the body but revalidate on every poll
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 
 @app.route("/simulation", methods=["GET"])
@@ -810,11 +740,34 @@ def simulation():
 @app.route("/simulation/next-day", methods=["POST"])
 def simulation_next_day():
     """Advance to next day in simulation."""
-    result = simulate_day()
+    try:
+        result = simulate_day()
+    except TransactionAborted as e:
+        flash(f"The day was not simulated: {e}", "error")
+        return redirect(url_for("simulation"))
     flash(f"Day {result['day']}: Treated {result['animals_treated']} animals. Revenue: ${result['revenue']:.2f}", "success")
     return redirect(url_for("simulation"))
 
 
+@app.route("/simulation/advance", methods=["POST"])
+def simulation_advance():
+    """Advance several days in one batch (days=N in the query string or form)."""
+    try:
+        days = int(request.values.get("days", 1))
+    except ValueError:
+        days = 0
+    if days < 1 or days > MAX_ADVANCE_DAYS:
+        flash(f"Number of days must be between 1 and {MAX_ADVANCE_DAYS}.", "error")
+        return redirect(url_for("simulation"))
+    try:
+        result = simulate_days(days)
+    except TransactionAborted as e:
+        flash(f"The days were not simulated: {e}", "error")
+        return redirect(url_for("simulation"))
+    flash(f"Days {result['first_day']}-{result['last_day']}: Treated {result['animals_treated']} animals. Revenue: ${result['revenue']:.2f}", "success")
+    return redirect(url_for("simulation"))
+
+
 @app.route("/simulation/reset", methods=["POST"])
 def simulation_reset():
     """Full reset: wipe all data and reinitialize."""
@@ -823,6 +776,42 @@ def simulation_reset():
     return redirect(url_for("simulation"))
 
 
+@app.route("/simulation/compare", methods=["GET"])
+def simulation_compare():
+    """Monte Carlo what-if form, and the state or results of the job in ?job=."""
+    job = {"days": 30, "trials": 200, "seed": 0}
+    if "job" in request.args:
+        found = whatif_jobs.get(request.args["job"])
+        if found is None:
+            flash("That comparison is no longer available; run it again.", "error")
+        elif found["status"] == "failed":
+            flash(f"The comparison failed: {found['error']}", "error")
+        else:
+            job = found
+    return render_template(
+        "simulation_compare.html",
+        job=job,
+        max_days=MAX_ADVANCE_DAYS,
+        max_trials=MAX_WEB_WHATIF_TRIALS,
+    )
+
+
+@app.route("/simulation/compare", methods=["POST"])
+def simulation_compare_start():
+    """Start a what-if comparison of each purchasing policy from the current state on the what-if pool."""
+    try:
+        days = int(request.form.get("days", 30))
+        trials = int(request.form.get("trials", 200))
+        seed = int(request.form.get("seed", 0))
+    except ValueError:
+        days, trials, seed = 30, 200, 0
+    days = min(max(days, 1), MAX_ADVANCE_DAYS)
+    trials = min(max(trials, 1), MAX_WEB_WHATIF_TRIALS)
+    state, stock_df = whatif_start()
+    job_id = whatif_jobs.start(state, stock_df, days=days, trials=trials, seed=seed)
+    return redirect(url_for("simulation_compare", job=job_id))
+
+
 @app.route("/simulation/buy", methods=["POST"])
 def simulation_buy():
     """Purchase items per DSS with adjustable quantity; server calculates cost."""
@@ -832,53 +821,221 @@ def simulation_buy():
         flash("Invalid purchase parameters.", "error")
         return redirect(url_for("simulation"))
 
-    state = get_simulation_state()
+    def purchase(txn):
+        item = txn.stock_item(reference)
+        if item is None:
+            raise TransactionAborted("Item not found in stock.")
+        unit_price = float(item["Price"] or 0.0)
+        total_cost = unit_price * quantity
+        if txn.state["budget"] < total_cost:
+            raise TransactionAborted(f"Insufficient budget! Need ${total_cost:.2f}, have ${txn.state['budget']:.2f}")
+        # Deduct budget and add the units in the same commit
+        txn.state["budget"] -= total_cost
+        current = 0 if pd.isna(item["Quantity"]) else int(item["Quantity"])
+        txn.stock_updates = [{
+            "Reference": reference,
+            "Quantity": current + quantity,
+            "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }]
+        txn.result = (unit_price, total_cost)
 
-    with _excel_lock:
-        try:
-            stock_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Stock")
-        except Exception:
-            flash("Stock sheet not found.", "error")
-            return redirect(url_for("simulation"))
+    try:
+        unit_price, total_cost = transactions.run(purchase, tables=["Stock"]).result
+    except TransactionAborted as e:
+        flash(str(e), "error")
+        return redirect(url_for("simulation"))
 
-        idx = stock_df[stock_df["Reference"] == reference].index
-        if idx.empty:
-            flash("Item not found in stock.", "error")
-            return redirect(url_for("simulation"))
+    flash(f"Purchased {quantity} units of {reference} for ${total_cost:.2f} (unit ${unit_price:.2f}).", "success")
+    return redirect(url_for("simulation"))
 
-        unit_price = float(stock_df.loc[idx[0], "Price"] or 0.0)
-        total_cost = unit_price * quantity
-        if state["budget"] < total_cost:
-            flash(f"Insufficient budget! Need ${total_cost:.2f}, have ${state['budget']:.2f}", "error")
-            return redirect(url_for("simulation"))
 
-        # Deduct budget
-        state["budget"] -= total_cost
-        save_simulation_state(state)
+@app.route("/api/cache-stats", methods=["GET"])
+def cache_stats():
+    """Hit/miss counters and size of the table and PDF caches."""
+    return {"tables": storage.cache.stats(), "pdfs": pdf_cache.stats()}
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Timing histograms in Prometheus text format (CLINIC_METRICS=1)."""
+    if not metrics.export:
+        return app.response_class("Metrics are disabled; set CLINIC_METRICS=1.\n", status=404, mimetype="text/plain")
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/lock-stats", methods=["GET"])
+def lock_stats():
+    """Lock acquisitions and wait time, and transaction commits/conflicts, in this process."""
+    return {"locks": locks.stats(), "transactions": transactions.stats()}
+
+
+@app.route("/export/excel", methods=["GET"])
+def export_excel():
+    """Export all tables to the Excel workbook and download it."""
+    # Exclusive: with the excel backend exporting compacts the workbook
+    with rewriting_storage():
+        storage.export_excel(EXCEL_FILENAME)
+    return send_file(os.path.abspath(EXCEL_FILENAME), as_attachment=True, download_name=EXCEL_FILENAME)
+
+
+@app.cli.command("export-excel")
+def export_excel_command():
+    """Write all tables to the Excel workbook (flask --app app export-excel)."""
+    # Exclusive: with the excel backend exporting compacts the workbook
+    with rewriting_storage():
+        storage.export_excel(EXCEL_FILENAME)
+    print(f"Exported {storage.name} tables to {EXCEL_FILENAME}")
+
+
+@app.cli.command("rebuild-aggregates")
+def rebuild_aggregates_command():
+    """Recompute dashboard aggregates from the raw tables and report drift (flask --app app rebuild-aggregates)."""
+    with locks.write(AGGREGATES_LOCK):
+        before = aggregates.snapshot()
+        aggregates.rebuild()
+        after = aggregates.snapshot()
+    # Running float sums may differ from a fresh sum in the last digits
+    drift = [key for key in after if key != "total_revenue" and before[key] != after[key]]
+    if abs(before["total_revenue"] - after["total_revenue"]) > 0.005:
+        drift.append("total_revenue")
+    if drift:
+        print(f"Rebuilt dashboard aggregates; these differed from the maintained values: {', '.join(drift)}")
+    else:
+        print("Rebuilt dashboard aggregates; maintained values matched.")
+
+
+@app.cli.command("export-snapshot")
+@click.option("--full", is_flag=True, help="Rewrite every partition, not just the changed ones.")
+def export_snapshot_command(full):
+    """Write Animals and Invoices to Parquet/Feather files (flask --app app export-snapshot)."""
+    try:
+        summary = export_snapshot(full=full)
+    except SnapshotUnavailable as e:
+        print(e)
+        return
+    for table, counts in summary.items():
+        print(f"{table}: {counts['written']} partitions written, {counts['unchanged']} unchanged, "
+              f"{counts['removed']} removed")
+    print(f"Snapshot ({snapshots.fmt}, by {snapshots.partition}) in {os.path.abspath(SNAPSHOT_DIR)}")
+
+
+@app.cli.command("dashboard-report")
+@click.option("--analytics", is_flag=True, help="Compute from the columnar snapshot instead of the maintained aggregates.")
+def dashboard_report_command(analytics):
+    """Print the dashboard statistics as JSON (flask --app app dashboard-report [--analytics])."""
+    try:
+        data = get_dashboard_data(analytics=analytics)
+    except SnapshotUnavailable as e:
+        print(e)
+        return
+    print(json.dumps(data, indent=2))
+
+
+@app.cli.command("backfill-line-references")
+def backfill_line_references_command():
+    """Fill in the Stock reference of invoice lines recorded without one (flask --app app backfill-line-references)."""
+    with locks.write("InvoiceLines", "Stock"):
+        mapping, ambiguous = reference_backfill(storage.read_table("InvoiceLines"), storage.read_table("Stock"))
+        # One update per product name, not per line; lines with a reference keep it
+        for name, reference in mapping.items():
+            storage.update_rows("InvoiceLines", "Name", name, {"Reference": reference}, blank="Reference")
+    if mapping:
+        print(f"Set the reference on invoice lines for {len(mapping)} products: {', '.join(mapping.values())}")
+    elif not ambiguous:
+        print("Every invoice line for a stock item already has its reference.")
+    if ambiguous:
+        print(f"Left without a reference, several Stock items share these names: {', '.join(ambiguous)}")
+
+
+@app.cli.command("compare-policies")
+@click.option("--days", default=30, show_default=True)
+@click.option("--trials", default=1000, show_default=True, type=click.IntRange(1, MAX_WHATIF_TRIALS))
+@click.option("--seed", default=0, show_default=True)
+@click.option("--policy", "policies", multiple=True, type=click.Choice(list(POLICIES)), help="Policies to run (default: all).")
+def compare_policies_command(days, trials, seed, policies):
+    """Monte Carlo what-if of purchasing policies from the current state, as JSON (flask --app app compare-policies)."""
+    state, stock_df = whatif_start()
+    results = compare_policies(state, stock_df, policies=policies or tuple(POLICIES), days=days, trials=trials, seed=seed)
+    print(json.dumps(results, indent=2))
+
+
+@app.cli.command("export-invoice-pdfs")
+@click.argument("output")
+@click.option("--date", "day", help="Only invoices from this day (YYYY-MM-DD).")
+def export_invoice_pdfs_command(output, day):
+    """Render invoices into one multi-page PDF (flask --app app export-invoice-pdfs OUT.pdf)."""
+    with locks.read("Invoices"):
+        invoices_df = storage.read_table("Invoices")
+    if day:
+        invoices_df = invoices_df[invoices_df["Timestamp"].astype(str).str.startswith(day)]
+    invoices = [load_invoice_data(num) for num in invoices_df["Invoice Number"]]
+    invoices = [inv for inv in invoices if inv is not None]
+    if not invoices:
+        print("No invoices with line items to render.")
+        return
+    render_invoices_combined(invoices, output)
+    print(f"Rendered {len(invoices)} invoices to {output}")
+
+
+@app.cli.command("serve")
+@click.option("--bind", default=lambda: os.environ.get("CLINIC_BIND", "127.0.0.1:8000"), show_default="127.0.0.1:8000")
+@click.option("--workers", type=int, help="Worker processes (default: one per CPU, one with the excel backend).")
+@click.option("--threads", type=int, help="Threads per worker (default: 4).")
+def serve_command(bind, workers, threads):
+    """Serve with gunicorn, or waitress on Windows, instead of the debug server (flask --app app serve)."""
+    os.environ["CLINIC_BIND"] = bind
+    if workers:
+        os.environ["CLINIC_WORKERS"] = str(workers)
+    if threads:
+        os.environ["CLINIC_THREADS"] = str(threads)
+    here = os.path.dirname(os.path.abspath(__file__))
+    if os.name != "nt":
+        # Replace this process with the gunicorn master; the settings are in gunicorn.conf.py
+        os.execv(sys.executable, [sys.executable, "-m", "gunicorn", "-c", os.path.join(here, "gunicorn.conf.py"),
+                                  "--pythonpath", here, "app:app"])
+    import waitress
+
+    # waitress has no worker processes: one process, all the threads
+    if workers and workers > 1:
+        print("waitress serves from one process; --workers is ignored. Run one app per port to use more cores.")
+    if "CLINIC_WARMUP" not in os.environ:
+        warmup()
+    waitress.serve(app, listen=bind, threads=threads or 4)
+
+
+# Tables every page needs; the workbook backend parses them all at once
+WARMUP_TABLES = ["Stock", "Invoices", "InvoiceLines"]
+
+
+def warmup() -> dict:
+    """Load the hot tables, the dashboard aggregates and ReportLab; returns milliseconds per step.
+
+    Run before serving with CLINIC_WARMUP=1, so the first requests don't pay
+    for the pandas and ReportLab imports and the first parse of the store.
+    """
+    steps = {}
+
+    def step(name, fn):
+        t0 = time.perf_counter()
+        fn()
+        steps[name] = round((time.perf_counter() - t0) * 1000, 1)
+
+    def read_tables():
+        with locks.read(*WARMUP_TABLES):
+            if storage.name == "excel":
+                storage.read_all()
+            else:
+                for table in WARMUP_TABLES:
+                    storage.read_table(table)
 
-        # Update quantity
-        current_qty = int(stock_df.loc[idx[0], "Quantity"] or 0)
-        stock_df.loc[idx[0], "Quantity"] = current_qty + quantity
-        stock_df.loc[idx[0], "Timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    step("tables", read_tables)
+    step("aggregates", lambda: get_dashboard_data())
+    step("reportlab", invoice_styles)
+    return steps
 
-        # Preserve other sheets
-        try:
-            animals_df = pd.read_excel(EXCEL_FILENAME, sheet_name=SHEET_NAME)
-        except Exception:
-            animals_df = pd.DataFrame()
-        try:
-            invoices_df = pd.read_excel(EXCEL_FILENAME, sheet_name="Invoices")
-        except Exception:
-            invoices_df = pd.DataFrame()
-        with pd.ExcelWriter(EXCEL_FILENAME, engine="openpyxl") as writer:
-            if not animals_df.empty:
-                animals_df.to_excel(writer, sheet_name=SHEET_NAME, index=False)
-            stock_df.to_excel(writer, sheet_name="Stock", index=False)
-            if not invoices_df.empty:
-                invoices_df.to_excel(writer, sheet_name="Invoices", index=False)
 
-    flash(f"Purchased {quantity} units of {reference} for ${total_cost:.2f} (unit ${unit_price:.2f}).", "success")
-    return redirect(url_for("simulation"))
+if os.environ.get("CLINIC_WARMUP", "").strip().lower() in ("1", "true", "yes", "on"):
+    app.logger.info("Warmed up in %s ms", warmup())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,4 @@
+"""Benchmarks for the clinic app's storage and rendering hot paths.
+
+Run from the repository root, e.g. ``python -m benchmarks.bench_invoice_append``.
+"""
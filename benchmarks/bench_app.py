@@ -0,0 +1,237 @@
+"""Request latency and peak memory of the app's hot paths as the history grows.
+
+    python -m benchmarks.bench_app
+    python -m benchmarks.bench_app --sizes 1000 100000 --backends sqlite --json bench.json
+    python -m benchmarks.bench_app --json new.json --baseline old.json
+
+For each backend and size a synthetic store (benchmarks.datagen) is written
+to a temporary directory and the app is imported fresh in a child process
+running there, so every dataset starts cold.  Each scenario is called once
+to warm up (reported as ``first_ms``), ``--repeats`` times to time it, and
+once more under tracemalloc for the peak Python allocation.  Routes go
+through Flask's test client; save_invoice_to_excel has no route of its own
+and is called directly.  ``--data-dir`` keeps generated stores between runs
+(each run works on a copy).  With ``--baseline`` the medians and peaks are
+also shown relative to an earlier ``--json`` file, e.g. from another commit.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.datagen import generate, fits_workbook, invoice_numbers, write_store  # noqa: E402
+
+
+SCENARIOS = [
+    "get_stock_items",
+    "get_dashboard_data",
+    "invoices_list",
+    "generate_invoice_pdf",
+    "save_invoice_to_excel",
+    "upsert_stock_to_excel",
+    "simulate_day",
+]
+
+
+def make_invoice(i: int) -> dict:
+    items = [
+        {"name": "Consultation Fee", "quantity": 1, "unit_price": 55.0, "total": 55.0, "reference": None},
+        {"name": "Rabies Vaccine", "quantity": 1, "unit_price": 50.0, "total": 50.0, "reference": "VAC001"},
+    ]
+    return {
+        "invoice_number": f"B{i:07d}",
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "owner_name": "Mary Johnson",
+        "items": items,
+        "items_summary": "Consultation Fee (x1); Rabies Vaccine (x1)",
+        "total": 105.0,
+        "payment_method": "Card",
+        "pdf_path": "",
+    }
+
+
+def scenario_calls(app_module, rows: int) -> dict:
+    """One callable per scenario, taking the call number."""
+    client = app_module.app.test_client()
+    pages = max(1, rows // app_module.INVOICES_PER_PAGE)
+
+    def dashboard(i):
+        # Time the statistics, not the serialized body kept between polls
+        app_module._dashboard_body = (None, None)
+        return client.get("/api/dashboard-data")
+
+    def download(i):
+        # A different invoice each call, so every call renders
+        number = invoice_numbers([(i * 7919) % max(rows, 1)])[0]
+        response = client.get(f"/invoices/download/{number}")
+        if response.status_code != 200:
+            raise RuntimeError(f"invoice {number} was not rendered (status {response.status_code})")
+        return response
+
+    def upsert(i):
+        return client.post("/stock/submit", data={
+            "reference": "VAC001", "name": "Rabies Vaccine", "quantity": str(10 + i % 40), "price": "25.0", "type": "Vaccine",
+        })
+
+    # Scenario names are kept from older runs so --baseline still lines them up
+    return {
+        "get_stock_items": lambda i: client.get("/stock"),
+        "get_dashboard_data": dashboard,
+        "invoices_list": lambda i: client.get(f"/invoices?page={1 + (i * 7919) % pages}"),
+        "generate_invoice_pdf": download,
+        "save_invoice_to_excel": lambda i: app_module.save_invoice_to_excel(make_invoice(i)),
+        "upsert_stock_to_excel": upsert,
+        "simulate_day": lambda i: client.post("/simulation/next-day"),
+    }
+
+
+def measure(name: str, call, repeats: int) -> dict:
+    def once(i):
+        t0 = time.perf_counter()
+        response = call(i)
+        elapsed = (time.perf_counter() - t0) * 1000
+        if response is not None and response.status_code >= 400:
+            raise RuntimeError(f"{name}: status {response.status_code}")
+        return elapsed
+
+    first = once(0)
+    samples = sorted(once(i) for i in range(1, repeats + 1))
+    tracemalloc.start()
+    once(repeats + 1)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "first_ms": round(first, 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "max_ms": round(samples[-1], 3),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def run_dataset(directory: str, backend: str, rows: int, scenarios: list, repeats: int) -> dict:
+    """In a fresh process: import the app on ``directory`` and time every scenario."""
+    os.chdir(directory)
+    os.environ["CLINIC_STORAGE"] = backend
+    # Render PDFs in this process, so their time and memory are measured
+    os.environ.setdefault("PDF_WORKERS", "0")
+    t0 = time.perf_counter()
+    import app as app_module
+    import_ms = round((time.perf_counter() - t0) * 1000, 3)
+    calls = scenario_calls(app_module, rows)
+    results = [{"scenario": name, **measure(name, calls[name], repeats)} for name in scenarios]
+    max_rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    return {"import_ms": import_ms, "max_rss_kib": max_rss_kib, "scenarios": results}
+
+
+def dataset(data_dir: str, backend: str, rows: int, stock_items: int, seed: int) -> str:
+    """Directory holding the generated store, generating it if ``data_dir`` has none yet."""
+    directory = os.path.join(data_dir, f"{backend}-{rows}-{stock_items}-{seed}")
+    if not os.path.isdir(directory):
+        tables = generate(rows, stock_items, seed)
+        if backend == "excel" and not fits_workbook(tables):
+            return None
+        write_store(directory + ".tmp", backend, tables)
+        os.replace(directory + ".tmp", directory)
+    return directory
+
+
+def run(sizes, backends, scenarios, repeats, stock_items, seed, data_dir):
+    results = []
+    datasets = []
+    spawn = get_context("spawn")
+    for rows in sizes:
+        for backend in backends:
+            source = dataset(data_dir, backend, rows, stock_items, seed)
+            if source is None:
+                print(f"skipping {backend} at {rows} rows: too many rows for a worksheet", file=sys.stderr)
+                continue
+            with tempfile.TemporaryDirectory() as tmp:
+                work = os.path.join(tmp, "store")
+                shutil.copytree(source, work)
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                    measured = pool.submit(run_dataset, work, backend, rows, scenarios, repeats).result()
+            datasets.append({"backend": backend, "rows": rows, "import_ms": measured["import_ms"],
+                             "max_rss_kib": measured["max_rss_kib"]})
+            results.extend({"backend": backend, "rows": rows, **r} for r in measured["scenarios"])
+    return results, datasets
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def relative(results: list, baseline_path: str):
+    """Add median and peak ratios against the same rows of a baseline file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r["backend"], r["rows"], r["scenario"]): r for r in baseline["results"]}
+    for r in results:
+        old = before.get((r["backend"], r["rows"], r["scenario"]))
+        if old:
+            r["median_x"] = round(r["median_ms"] / old["median_ms"], 2) if old["median_ms"] else None
+            r["peak_x"] = round(r["peak_kib"] / old["peak_kib"], 2) if old["peak_kib"] else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--backends", nargs="+", default=["sqlite", "excel"], choices=["excel", "sqlite"])
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--stock-items", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="keep generated stores here between runs")
+    parser.add_argument("--baseline", help="earlier --json output to compare against")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results, datasets = run(args.sizes, args.backends, args.scenarios, args.repeats,
+                                args.stock_items, args.seed, args.data_dir or tmp)
+    if args.baseline:
+        relative(results, args.baseline)
+
+    print(f"{'backend':<8}{'rows':>9}  {'scenario':<24}{'first ms':>10}{'median ms':>11}{'p95 ms':>10}{'peak KiB':>11}"
+          + (f"{'median x':>10}{'peak x':>8}" if args.baseline else ""))
+    for r in results:
+        print(f"{r['backend']:<8}{r['rows']:>9}  {r['scenario']:<24}{r['first_ms']:>10}{r['median_ms']:>11}"
+              f"{r['p95_ms']:>10}{r['peak_kib']:>11}"
+              + (f"{str(r.get('median_x', '-')):>10}{str(r.get('peak_x', '-')):>8}" if args.baseline else ""))
+    for d in datasets:
+        print(f"{d['backend']:<8}{d['rows']:>9}  import {d['import_ms']} ms, max RSS {d['max_rss_kib']} KiB")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeats": args.repeats,
+                "results": results,
+                "datasets": datasets,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Dashboard statistics over a long history: workbook parse vs columnar snapshot.
+
+    python -m benchmarks.bench_dashboard_snapshot
+    python -m benchmarks.bench_dashboard_snapshot --sizes 10000 --formats parquet
+
+For each size the Invoices and Animals tables are seeded with N rows (one
+year of history per ~3k invoices), then the dashboard statistics are
+computed from a cold parse of the workbook and from a Parquet/Feather
+snapshot reading only the columns they need.  Needs pyarrow.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregates import dashboard_summary  # noqa: E402
+from storage import ExcelBackend, TABLE_COLUMNS  # noqa: E402
+from snapshots import SnapshotStore  # noqa: E402
+
+
+ANIMAL_TYPES = ["Dog", "Cat", "Rabbit", "Bird", "Hamster"]
+
+
+def seed(backend, n: int):
+    start = datetime(2020, 1, 1)
+    stamps = [(start + timedelta(hours=3 * i)).strftime("%Y-%m-%d %H:%M:%S") for i in range(n)]
+    invoices = pd.DataFrame({
+        "Timestamp": stamps,
+        "Invoice Number": [f"{i:08d}" for i in range(n)],
+        "Owner Name": "Mary Johnson",
+        "Items": "Consultation Fee (x1); Rabies Vaccine (x1)",
+        "Total Amount": [50.0 + (i % 7) * 12.5 for i in range(n)],
+        "Payment Method": "Card",
+    }, columns=TABLE_COLUMNS["Invoices"])
+    animals = pd.DataFrame({
+        "Timestamp": stamps,
+        "Animal Name": [f"Pet {i}" for i in range(n)],
+        "Animal Type": [ANIMAL_TYPES[i % len(ANIMAL_TYPES)] for i in range(n)],
+        "Age": [1 + i % 15 for i in range(n)],
+        "Owner Name": "Mary Johnson",
+    }, columns=TABLE_COLUMNS["Animals"])
+    stock = pd.DataFrame(
+        [{"Timestamp": stamps[0], "Reference": "VAC001", "Name": "Rabies Vaccine",
+          "Quantity": 10, "Price": 25.0, "Type": "Vaccine"}]
+    )
+    backend.replace_all({"Invoices": invoices, "Animals": animals, "Stock": stock})
+
+
+def timed(fn, repeats: int) -> float:
+    samples = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def run(sizes, formats, repeats):
+    results = []
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.xlsx")
+            backend = ExcelBackend(path)
+            seed(backend, n)
+            backend.compact()
+
+            def from_workbook():
+                tables = ExcelBackend(path, cache=False).read_all()
+                return dashboard_summary(tables["Animals"], tables["Invoices"], tables["Stock"])
+
+            row = {"rows": n, "workbook_ms": timed(from_workbook, min(repeats, 3))}
+            stock_df = backend.read_table("Stock")
+            for fmt in formats:
+                store = SnapshotStore(os.path.join(tmp, fmt), fmt=fmt, partition="month")
+                store.export(backend)
+
+                def from_snapshot():
+                    return dashboard_summary(
+                        store.read("Animals", columns=["Animal Type"]),
+                        store.read("Invoices", columns=["Timestamp", "Total Amount"]),
+                        stock_df,
+                    )
+
+                assert from_snapshot()["total_invoices"] == n
+                row[f"{fmt}_ms"] = timed(from_snapshot, repeats)
+            results.append(row)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--formats", nargs="+", default=["parquet", "feather"], choices=["parquet", "feather"])
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.formats, args.repeats)
+    columns = ["workbook_ms"] + [f"{fmt}_ms" for fmt in args.formats]
+    print(f"{'rows':>8}" + "".join(f"{c:>14}" for c in columns))
+    for r in results:
+        print(f"{r['rows']:>8}" + "".join(f"{r[c]:>14}" for c in columns))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
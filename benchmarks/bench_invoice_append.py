@@ -0,0 +1,121 @@
+"""Per-invoice write latency as the Invoices history grows.
+
+    python -m benchmarks.bench_invoice_append
+    python -m benchmarks.bench_invoice_append --sizes 1000 10000 --legacy
+
+For each backend the Invoices table is seeded with N rows, then single
+invoices are recorded one at a time.  ``--legacy`` also times the old
+read-concat-rewrite path of save_invoice_to_excel for comparison (slow:
+it rewrites the whole workbook per invoice).
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import ExcelBackend, SQLiteBackend, TABLE_COLUMNS  # noqa: E402
+
+
+def make_invoice(i: int) -> dict:
+    ts = datetime(2025, 1, 1) + timedelta(minutes=7 * i)
+    return {
+        "Timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
+        "Invoice Number": f"{i:08d}",
+        "Owner Name": "Mary Johnson",
+        "Items": "Consultation Fee (x1); Rabies Vaccine (x1)",
+        "Total Amount": 95.5,
+        "Payment Method": "Card",
+        "PDF Path": "",
+    }
+
+
+def seed(backend, n: int):
+    invoices = pd.DataFrame([make_invoice(i) for i in range(n)], columns=TABLE_COLUMNS["Invoices"])
+    stock = pd.DataFrame(
+        [{"Timestamp": "2025-01-01 00:00:00", "Reference": "VAC001", "Name": "Rabies Vaccine",
+          "Quantity": 10, "Price": 25.0, "Type": "Vaccine"}]
+    )
+    backend.replace_all({"Invoices": invoices, "Stock": stock})
+
+
+def legacy_append(path: str, row: dict):
+    """The pre-journal save_invoice_to_excel: read, concat, rewrite every sheet."""
+    existing = pd.read_excel(path, sheet_name="Invoices")
+    combined = pd.concat([existing, pd.DataFrame([row])], ignore_index=True)
+    others = {s: pd.read_excel(path, sheet_name=s) for s in ("Animals", "Stock")}
+    with pd.ExcelWriter(path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
+        for sheet, df in others.items():
+            df.to_excel(writer, sheet_name=sheet, index=False)
+        combined.to_excel(writer, sheet_name="Invoices", index=False)
+
+
+def time_appends(append, start: int, repeats: int) -> list:
+    samples = []
+    for k in range(repeats):
+        row = make_invoice(start + k)
+        t0 = time.perf_counter()
+        append(row)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def run(sizes, repeats, backends, legacy, legacy_max):
+    results = []
+    for n in sizes:
+        for name in backends:
+            with tempfile.TemporaryDirectory() as tmp:
+                if name == "excel":
+                    backend = ExcelBackend(os.path.join(tmp, "bench.xlsx"))
+                else:
+                    backend = SQLiteBackend(os.path.join(tmp, "bench.db"))
+                seed(backend, n)
+                samples = time_appends(lambda row: backend.append_rows("Invoices", [row]), n, repeats)
+                results.append(summarize(name, n, samples))
+                if name == "excel" and legacy and n <= legacy_max:
+                    backend.compact()
+                    samples = time_appends(lambda row: legacy_append(backend.path, row), n, min(repeats, 3))
+                    results.append(summarize("excel-legacy", n, samples))
+    return results
+
+
+def summarize(name: str, n: int, samples: list) -> dict:
+    ordered = sorted(samples)
+    return {
+        "backend": name,
+        "existing_rows": n,
+        "appends": len(samples),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--backends", nargs="+", default=["excel", "sqlite"], choices=["excel", "sqlite"])
+    parser.add_argument("--legacy", action="store_true", help="also time the old full-rewrite path")
+    parser.add_argument("--legacy-max", type=int, default=10000, help="largest size to run --legacy at")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeats, args.backends, args.legacy, args.legacy_max)
+    print(f"{'backend':<14}{'rows':>10}{'median ms':>12}{'p95 ms':>10}{'max ms':>10}")
+    for r in results:
+        print(f"{r['backend']:<14}{r['existing_rows']:>10}{r['median_ms']:>12}{r['p95_ms']:>10}{r['max_ms']:>10}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Per-invoice PDF render time: styles rebuilt per call vs. built once.
+
+    python -m benchmarks.bench_invoice_render
+    python -m benchmarks.bench_invoice_render --invoices 200 --json render.json
+
+``legacy`` is the original generate_invoice_pdf body, which rebuilt the
+sample stylesheet, the title style and three TableStyles on every call.
+``current`` is invoice_pdf.render_invoice_pdf; ``batch-files`` and
+``batch-combined`` use the batch API (separate files / one multi-page PDF).
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.lib.pagesizes import letter  # noqa: E402
+from reportlab.lib import colors  # noqa: E402
+from reportlab.lib.units import inch  # noqa: E402
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer  # noqa: E402
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle  # noqa: E402
+from reportlab.lib.enums import TA_CENTER  # noqa: E402
+
+from invoice_pdf import render_invoice_pdf, render_invoices, render_invoices_combined  # noqa: E402
+
+
+def make_invoice(i: int) -> dict:
+    items = [
+        {"name": "Consultation Fee", "quantity": 1, "unit_price": 55.0, "total": 55.0},
+        {"name": "Rabies Vaccine", "quantity": 1, "unit_price": 50.0, "total": 50.0},
+        {"name": "Pain Relief", "quantity": 2, "unit_price": 36.0, "total": 72.0},
+    ]
+    return {
+        "invoice_number": f"{i:06d}",
+        "timestamp": "2025-11-22 10:30:00",
+        "owner_name": "Mary Johnson",
+        "payment_method": "Card",
+        "items": items,
+        "total": sum(li["total"] for li in items),
+    }
+
+
+def legacy_render(invoice_data: dict, pdf_path: str) -> str:
+    """Original implementation: every style object is rebuilt per invoice."""
+    doc = SimpleDocTemplate(pdf_path, pagesize=letter)
+    elements = []
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        "CustomTitle",
+        parent=styles["Heading1"],
+        fontSize=24,
+        textColor=colors.HexColor("#1a237e"),
+        spaceAfter=30,
+        alignment=TA_CENTER,
+    )
+    elements.append(Paragraph("VETERINARY CLINIC INVOICE", title_style))
+    elements.append(Spacer(1, 0.2 * inch))
+    info_data = [
+        ["Invoice Number:", invoice_data["invoice_number"]],
+        ["Date:", invoice_data["timestamp"]],
+        ["Owner Name:", invoice_data["owner_name"]],
+        ["Payment Method:", invoice_data["payment_method"]],
+    ]
+    info_table = Table(info_data, colWidths=[2 * inch, 4 * inch])
+    info_table.setStyle(TableStyle([
+        ("FONTNAME", (0, 0), (0, -1), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, -1), 11),
+        ("TEXTCOLOR", (0, 0), (0, -1), colors.HexColor("#424242")),
+        ("ALIGN", (0, 0), (0, -1), "RIGHT"),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 8),
+    ]))
+    elements.append(info_table)
+    elements.append(Spacer(1, 0.4 * inch))
+    items_data = [["Item/Service", "Quantity", "Unit Price", "Total"]]
+    for item in invoice_data["items"]:
+        items_data.append([
+            item["name"],
+            str(item["quantity"]),
+            f"${float(item['unit_price']):.2f}",
+            f"${float(item['total']):.2f}",
+        ])
+    items_table = Table(items_data, colWidths=[3 * inch, 1 * inch, 1.5 * inch, 1.5 * inch])
+    items_table.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#1a237e")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, 0), 12),
+        ("ALIGN", (1, 0), (-1, -1), "CENTER"),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
+        ("TOPPADDING", (0, 0), (-1, 0), 12),
+        ("GRID", (0, 0), (-1, -1), 1, colors.HexColor("#e0e0e0")),
+        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#f5f5f5")]),
+        ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
+        ("FONTSIZE", (0, 1), (-1, -1), 10),
+    ]))
+    elements.append(items_table)
+    elements.append(Spacer(1, 0.3 * inch))
+    total_table = Table([["TOTAL:", f"${float(invoice_data['total']):.2f}"]], colWidths=[5.5 * inch, 1.5 * inch])
+    total_table.setStyle(TableStyle([
+        ("FONTNAME", (0, 0), (-1, -1), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, -1), 14),
+        ("ALIGN", (0, 0), (0, 0), "RIGHT"),
+        ("ALIGN", (1, 0), (1, 0), "CENTER"),
+        ("TEXTCOLOR", (0, 0), (-1, -1), colors.HexColor("#1a237e")),
+        ("BACKGROUND", (1, 0), (1, 0), colors.HexColor("#e3f2fd")),
+        ("BOX", (1, 0), (1, 0), 2, colors.HexColor("#1a237e")),
+        ("TOPPADDING", (0, 0), (-1, -1), 10),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 10),
+    ]))
+    elements.append(total_table)
+    doc.build(elements)
+    return pdf_path
+
+
+def run(count: int) -> list:
+    invoices = [make_invoice(i) for i in range(count)]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        def paths(prefix):
+            return [os.path.join(tmp, f"{prefix}_{i}.pdf") for i in range(count)]
+
+        # Warm up both paths (imports, font metrics, the style cache)
+        legacy_render(invoices[0], os.path.join(tmp, "warm_legacy.pdf"))
+        render_invoice_pdf(invoices[0], os.path.join(tmp, "warm_current.pdf"))
+
+        scenarios = [
+            ("legacy", lambda: [legacy_render(d, p) for d, p in zip(invoices, paths("legacy"))]),
+            ("current", lambda: [render_invoice_pdf(d, p) for d, p in zip(invoices, paths("current"))]),
+            ("batch-files", lambda: render_invoices(list(zip(invoices, paths("batch"))))),
+            ("batch-combined", lambda: render_invoices_combined(invoices, os.path.join(tmp, "combined.pdf"))),
+        ]
+        for name, fn in scenarios:
+            t0 = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - t0
+            results.append({
+                "scenario": name,
+                "invoices": count,
+                "total_s": round(elapsed, 4),
+                "per_invoice_ms": round(elapsed * 1000 / count, 3),
+            })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=100)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.invoices)
+    base = results[0]["per_invoice_ms"]
+    print(f"{'scenario':<16}{'per invoice ms':>16}{'speedup':>10}")
+    for r in results:
+        print(f"{r['scenario']:<16}{r['per_invoice_ms']:>16}{base / r['per_invoice_ms']:>9.2f}x")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Throughput of the production server as the number of workers grows.
+
+    python -m benchmarks.bench_serve
+    python -m benchmarks.bench_serve --workers 1 2 4 8 --clients 32 --seconds 20 --json serve.json
+
+For each worker count the app is started with ``flask --app app serve``
+(gunicorn, see gunicorn.conf.py) on a copy of a synthetic store, and every
+route is loaded for ``--seconds`` by ``--clients`` keep-alive connections.
+``dashboard`` polls /api/dashboard-data, ``invoices`` pages through
+/invoices and ``pdf`` downloads a different invoice every time, so each
+call renders (PDF_WORKERS=0: rendering happens in the web worker, the part
+that is scaled here).  Reported are requests per second, median and p95
+latency, and the speedup over the smallest worker count.  Whether more
+workers help is what this measures: no speedup is possible past the number
+of cores, and the client threads share the machine, so run it where there
+are cores to spare.  Needs gunicorn (not Windows).
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_app import dataset, git_commit  # noqa: E402
+from benchmarks.datagen import invoice_numbers  # noqa: E402
+
+
+ROUTES = ["dashboard", "invoices", "pdf"]
+
+
+def paths(route: str, rows: int):
+    """Endless request paths for ``route``."""
+    if route == "dashboard":
+        return itertools.repeat("/api/dashboard-data")
+    if route == "invoices":
+        pages = max(1, rows // 50)
+        return (f"/invoices?page={1 + (i * 7919) % pages}" for i in itertools.count())
+    return (f"/invoices/download/{invoice_numbers([(i * 7919) % rows])[0]}" for i in itertools.count())
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(port: int, server: subprocess.Popen, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with status {server.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/api/dashboard-data")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+def load(port: int, route_paths, clients: int, seconds: float) -> dict:
+    """Requests from ``clients`` threads for ``seconds``; latencies of the successful ones."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        mine = []
+        while time.monotonic() < stop_at:
+            with lock:
+                path = next(route_paths)
+            t0 = time.perf_counter()
+            try:
+                conn.request("GET", path)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                ok = False
+            if ok:
+                mine.append((time.perf_counter() - t0) * 1000)
+            else:
+                with lock:
+                    errors[0] += 1
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": round(len(latencies) / elapsed, 1),
+        "median_ms": round(statistics.median(latencies), 2) if latencies else None,
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2) if latencies else None,
+    }
+
+
+def run_workers(source: str, backend: str, rows: int, workers: int, threads: int, routes: list,
+                clients: int, seconds: float) -> list:
+    with tempfile.TemporaryDirectory() as tmp:
+        work = os.path.join(tmp, "store")
+        shutil.copytree(source, work)
+        port = free_port()
+        env = {**os.environ, "CLINIC_STORAGE": backend, "PDF_WORKERS": "0"}
+        command = [sys.executable, "-m", "flask", "--app", os.path.join(ROOT, "app.py"), "serve",
+                   "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--threads", str(threads)]
+        with open(os.path.join(tmp, "server.log"), "w") as log:
+            server = subprocess.Popen(command, cwd=work, env=env, stdout=log, stderr=subprocess.STDOUT)
+            try:
+                wait_ready(port, server)
+                results = []
+                for route in routes:
+                    route_paths = paths(route, rows)
+                    # Warm every worker's connections and caches first
+                    load(port, route_paths, clients, min(1.0, seconds))
+                    results.append({"backend": backend, "rows": rows, "workers": workers, "threads": threads,
+                                    "route": route, **load(port, route_paths, clients, seconds)})
+                return results
+            finally:
+                server.terminate()
+                server.wait(timeout=60)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=4, help="threads per worker")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent connections")
+    parser.add_argument("--seconds", type=float, default=10, help="load per route and worker count")
+    parser.add_argument("--routes", nargs="+", default=ROUTES, choices=ROUTES)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--backend", default="sqlite", choices=["excel", "sqlite"])
+    parser.add_argument("--stock-items", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="keep generated stores here between runs")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    cores = os.cpu_count() or 1
+    if max(args.workers) > cores:
+        print(f"note: only {cores} CPUs; throughput can't scale past {cores} workers", file=sys.stderr)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        source = dataset(args.data_dir or tmp, args.backend, args.rows, args.stock_items, args.seed)
+        if source is None:
+            parser.error(f"{args.rows} rows don't fit in a worksheet")
+        for workers in sorted(args.workers):
+            results.extend(run_workers(source, args.backend, args.rows, workers, args.threads, args.routes,
+                                       args.clients, args.seconds))
+
+    base = {}
+    for r in results:
+        first = base.setdefault(r["route"], r)
+        r["speedup"] = round(r["rps"] / first["rps"], 2) if first["rps"] else None
+
+    print(f"{'route':<11}{'workers':>8}{'req/s':>10}{'median ms':>11}{'p95 ms':>10}{'errors':>8}{'speedup':>9}")
+    for r in sorted(results, key=lambda r: (ROUTES.index(r["route"]), r["workers"])):
+        print(f"{r['route']:<11}{r['workers']:>8}{r['rps']:>10}{str(r['median_ms']):>11}{str(r['p95_ms']):>10}"
+              f"{r['errors']:>8}{str(r['speedup']):>9}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": cores,
+                "clients": args.clients,
+                "seconds": args.seconds,
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
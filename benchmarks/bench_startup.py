@@ -0,0 +1,155 @@
+"""Cold-start cost of the app: import time by module, warmup, first requests.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --rows 100000 --backends excel --json startup.json
+
+Each run starts a fresh interpreter under ``python -X importtime`` in a copy
+of a synthetic store (benchmarks.datagen), imports the app, optionally runs
+its warmup (CLINIC_WARMUP=1), then times the first call of a few routes.
+Runs with and without warmup show where the cold-start cost goes: warmup
+moves the first parse of the store and the pandas/ReportLab imports out of
+the first requests and into startup.  The slowest top-level imports are
+listed from the importtime report; ``--json`` keeps everything, with the
+commit hash, to track cold starts over time.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_app import dataset, git_commit, invoice_numbers  # noqa: E402
+
+
+# Timed in a fresh interpreter; prints one JSON line
+CHILD = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+t0 = time.perf_counter()
+import app
+import_ms = (time.perf_counter() - t0) * 1000
+print({marker!r}, file=sys.stderr, flush=True)
+client = app.app.test_client()
+first = {{}}
+for name, path in {routes!r}:
+    t0 = time.perf_counter()
+    status = client.get(path).status_code
+    first[name] = round((time.perf_counter() - t0) * 1000, 3)
+    if status != 200:
+        raise SystemExit(f"{{path}}: status {{status}}")
+print(json.dumps({{"import_ms": round(import_ms, 3), "first_ms": first}}))
+"""
+
+STARTED = "-- app imported --"
+IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def routes(rows: int) -> list:
+    number = invoice_numbers([rows // 2])[0]
+    return [
+        ("stock", "/stock"),
+        ("dashboard_data", "/api/dashboard-data"),
+        ("invoices", "/invoices"),
+        ("invoice_pdf", f"/invoices/download/{number}"),
+    ]
+
+
+def top_imports(report: str, top: int) -> list:
+    """The ``top`` slowest packages to import, and whether startup or the first requests paid.
+
+    Packages imported by other packages count towards those (werkzeug is
+    part of flask).  Lazily imported packages show up under the first
+    requests, when their first attribute access imports them.
+    """
+    entries = []
+    phase = "startup"
+    for line in report.splitlines():
+        if line == STARTED:
+            phase = "first requests"
+            continue
+        match = IMPORTTIME.match(line)
+        if match:
+            entries.append((len(match.group(3)), match.group(4), int(match.group(2)), phase))
+    # importtime prints a module after its imports; walked backwards, parents come first
+    totals = {}
+    parents = []  # (indent, whether inside a package's import)
+    for indent, name, cumulative_us, during in reversed(entries):
+        while parents and parents[-1][0] >= indent:
+            parents.pop()
+        package = name.split(".")[0]
+        external = not os.path.exists(os.path.join(ROOT, package + ".py"))
+        inside = bool(parents) and parents[-1][1]
+        parents.append((indent, inside or external))
+        if external and not inside:
+            totals[(package, during)] = totals.get((package, during), 0) + cumulative_us
+    slowest = sorted(totals.items(), key=lambda item: -item[1])[:top]
+    return [{"module": package, "ms": round(us / 1000, 1), "during": during} for (package, during), us in slowest]
+
+
+def run_once(source: str, backend: str, rows: int, warmup: bool, top: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        work = os.path.join(tmp, "store")
+        shutil.copytree(source, work)
+        env = {**os.environ, "CLINIC_STORAGE": backend, "CLINIC_WARMUP": "1" if warmup else "0",
+               "PDF_WORKERS": "0"}
+        child = CHILD.format(root=ROOT, routes=routes(rows), marker=STARTED)
+        done = subprocess.run([sys.executable, "-X", "importtime", "-c", child], cwd=work, env=env,
+                              capture_output=True, text=True)
+    if done.returncode:
+        raise RuntimeError(f"{backend} at {rows} rows: {done.stdout[-500:]}{done.stderr[-2000:]}")
+    measured = json.loads(done.stdout.strip().splitlines()[-1])
+    return {"backend": backend, "rows": rows, "warmup": warmup, **measured,
+            "slowest_imports": top_imports(done.stderr, top)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--backends", nargs="+", default=["sqlite", "excel"], choices=["excel", "sqlite"])
+    parser.add_argument("--stock-items", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=8, help="slowest imports to list")
+    parser.add_argument("--data-dir", help="keep generated stores here between runs")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backends:
+            source = dataset(args.data_dir or tmp, backend, args.rows, args.stock_items, args.seed)
+            if source is None:
+                print(f"skipping {backend} at {args.rows} rows: too many rows for a worksheet", file=sys.stderr)
+                continue
+            for warmup in (False, True):
+                results.append(run_once(source, backend, args.rows, warmup, args.top))
+
+    names = [name for name, _ in routes(args.rows)]
+    print(f"{'backend':<8}{'rows':>9}  {'warmup':<8}{'import ms':>10}"
+          + "".join(f"{'first ' + n:>22}" for n in names))
+    for r in results:
+        print(f"{r['backend']:<8}{r['rows']:>9}  {str(r['warmup']):<8}{r['import_ms']:>10}"
+              + "".join(f"{r['first_ms'][n]:>22}" for n in names))
+    for r in results:
+        if not r["warmup"]:
+            print(f"\n{r['backend']}, no warmup: slowest imports")
+            for entry in r["slowest_imports"]:
+                print(f"  {entry['module']:<20}{entry['ms']:>8} ms  during {entry['during']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Synthetic clinic data for benchmarks: a Stock catalog and N visits of history.
+
+    python -m benchmarks.datagen --rows 100000 --out /tmp/clinic-100k
+    python -m benchmarks.datagen --rows 1000000 --backend sqlite --stock-items 500 --out /tmp/clinic-1m
+
+Every visit is one Animals row and one invoice: a consultation fee plus the
+items used, drawn from the catalog with the simulation's own consumption
+rules (VISIT_CONSUMPTION), so totals, Items summaries and InvoiceLines agree
+as they do in real data.  Visits are spread over ``years`` of history.
+Generation is vectorized; a million visits take seconds, writing the
+workbook takes much longer than writing the database.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simulation import ANIMAL_TYPES, OWNER_NAMES, PAYMENT_METHODS, VISIT_CONSUMPTION  # noqa: E402
+from storage import ExcelBackend, SQLiteBackend, TABLE_COLUMNS  # noqa: E402
+
+
+START = "2020-01-01"
+FIRST_INVOICE = 10_000_000
+# Rows per sheet an .xlsx file can hold, header included
+EXCEL_MAX_ROWS = 1_048_576
+
+# (type, reference prefix, base names, price range)
+CATALOG = [
+    ("Vaccine", "VAC", ["Rabies Vaccine", "Distemper Vaccine", "Parvovirus Vaccine", "Leptospirosis Vaccine",
+                        "Bordetella Vaccine", "Feline Leukemia Vaccine", "Calicivirus Vaccine", "Lyme Vaccine"],
+     (18.0, 45.0)),
+    ("Medicine", "MED", ["Antibiotic Pills", "Pain Relief", "Anti-Inflammatory", "Dewormer", "Flea Treatment",
+                         "Ear Drops", "Eye Ointment", "Antifungal Cream", "Heart Medication", "Allergy Tablets"],
+     (6.0, 40.0)),
+    ("Accessory", "ACC", ["Syringe 5ml", "Bandages", "Surgical Gloves", "Recovery Cone", "Gauze Pads",
+                          "Leash", "Collar", "Food Bowl", "Shampoo", "Nail Clippers"],
+     (0.5, 15.0)),
+]
+
+
+def stock_catalog(items: int = 30, seed: int = 0, timestamp: str = f"{START} 00:00:00") -> pd.DataFrame:
+    """A Stock table of ``items`` rows split across the catalog types.
+
+    Names repeat the base names with a size/strength suffix once a type has
+    more items than base names; references are unique (VAC001, MED014, ...).
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for k, (stock_type, prefix, names, (low, high)) in enumerate(CATALOG):
+        count = items // len(CATALOG) + (k < items % len(CATALOG))
+        for i in range(count):
+            variant = i // len(names)
+            name = names[i % len(names)] + (f" {variant + 1}x" if variant else "")
+            rows.append({
+                "Timestamp": timestamp,
+                "Reference": f"{prefix}{i + 1:03d}",
+                "Name": name,
+                "Quantity": int(rng.integers(0, 80)),
+                "Price": round(float(rng.uniform(low, high)), 2),
+                "Type": stock_type,
+            })
+    return pd.DataFrame(rows, columns=TABLE_COLUMNS["Stock"])
+
+
+def invoice_numbers(visits) -> list:
+    """Invoice number of each visit index: digits only, no leading zero (the workbook reads them back as numbers)."""
+    return [str(FIRST_INVOICE + int(i)) for i in visits]
+
+
+def history(n: int, stock_df: pd.DataFrame, seed: int = 0, start: str = START, years: float = 3) -> dict:
+    """Animals, Invoices and InvoiceLines for ``n`` visits, oldest first."""
+    rng = np.random.default_rng(seed)
+    seconds = np.sort(rng.integers(0, int(years * 365 * 86400), n))
+    stamps = (pd.Timestamp(start) + pd.to_timedelta(seconds, unit="s")).strftime("%Y-%m-%d %H:%M:%S").to_numpy()
+    owners = np.array(OWNER_NAMES, dtype=object)[rng.integers(0, len(OWNER_NAMES), n)]
+    animal_types = np.array(ANIMAL_TYPES, dtype=object)[rng.integers(0, len(ANIMAL_TYPES), n)]
+    numbers = pd.Series(invoice_numbers(np.arange(n)), dtype=object)
+
+    animals = pd.DataFrame({
+        "Timestamp": stamps,
+        "Animal Name": animal_types + " #" + rng.integers(100, 1000, n).astype(str).astype(object),
+        "Animal Type": animal_types,
+        "Medical History": "Routine visit",
+        "Age": rng.integers(1, 16, n),
+        "Sex": np.array(["Male", "Female"], dtype=object)[rng.integers(0, 2, n)],
+        "Owner Name": owners,
+        "Owner Email": pd.Series(owners).str.lower().str.replace(" ", ".") + "@email.com",
+        "Owner Phone": "+1-555-" + rng.integers(1000, 10000, n).astype(str).astype(object),
+        "Comments": "",
+    }, columns=TABLE_COLUMNS["Animals"])
+
+    # Line 1 is the consultation fee, then one line per consumption type used
+    fees = np.round(rng.uniform(30, 80, n), 2)
+    parts = [pd.DataFrame({"visit": np.arange(n), "kind": 0, "Name": "Consultation Fee", "Quantity": 1,
+                           "Unit Price": fees, "Reference": None})]
+    prices = pd.to_numeric(stock_df["Price"]).to_numpy()
+    for k, (stock_type, chance, max_units, markup) in enumerate(VISIT_CONSUMPTION, start=1):
+        rows = np.flatnonzero(stock_df["Type"].to_numpy() == stock_type)
+        if not len(rows):
+            continue
+        visits = np.flatnonzero(rng.random(n) < chance)
+        picked = rows[rng.integers(0, len(rows), len(visits))]
+        parts.append(pd.DataFrame({
+            "visit": visits,
+            "kind": k,
+            "Name": stock_df["Name"].to_numpy()[picked],
+            "Quantity": rng.integers(1, max_units + 1, len(visits)),
+            "Unit Price": np.round(markup * prices[picked], 2),
+            "Reference": stock_df["Reference"].to_numpy()[picked],
+        }))
+    lines = pd.concat(parts, ignore_index=True).sort_values(["visit", "kind"], kind="stable")
+    lines["Total"] = np.round(lines["Unit Price"] * lines["Quantity"], 2)
+    lines["Line"] = lines.groupby("visit").cumcount() + 1
+    lines["Invoice Number"] = numbers.to_numpy()[lines["visit"].to_numpy()]
+
+    # Lines are sorted by visit, so each visit's labels are one slice
+    labels = (lines["Name"] + " (x" + lines["Quantity"].astype(str) + ")").tolist()
+    bounds = np.searchsorted(lines["visit"].to_numpy(), np.arange(n + 1))
+    summary = ["; ".join(labels[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+    invoices = pd.DataFrame({
+        "Timestamp": stamps,
+        "Invoice Number": numbers,
+        "Owner Name": owners,
+        "Items": summary,
+        "Total Amount": np.round(lines.groupby("visit")["Total"].sum().to_numpy(), 2),
+        "Payment Method": np.array(PAYMENT_METHODS, dtype=object)[rng.integers(0, len(PAYMENT_METHODS), n)],
+        "PDF Path": "",
+    }, columns=TABLE_COLUMNS["Invoices"])
+    return {
+        "Animals": animals,
+        "Invoices": invoices,
+        "InvoiceLines": lines[TABLE_COLUMNS["InvoiceLines"]].reset_index(drop=True),
+    }
+
+
+def generate(rows: int, stock_items: int = 30, seed: int = 0, years: float = 3) -> dict:
+    """All four tables: a catalog of ``stock_items`` and ``rows`` visits."""
+    stock_df = stock_catalog(stock_items, seed)
+    return {"Stock": stock_df, **history(rows, stock_df, seed, years=years)}
+
+
+def fits_workbook(tables: dict) -> bool:
+    """Whether every table fits in one worksheet."""
+    return all(len(df) < EXCEL_MAX_ROWS for df in tables.values())
+
+
+def write_store(directory: str, backend: str, tables: dict) -> str:
+    """Write ``tables`` where the app expects them (animals.xlsx or clinic.db in ``directory``)."""
+    os.makedirs(directory, exist_ok=True)
+    if backend == "excel":
+        if not fits_workbook(tables):
+            raise ValueError(f"a table has more than {EXCEL_MAX_ROWS - 1} rows, too many for a worksheet")
+        store = ExcelBackend(os.path.join(directory, "animals.xlsx"), cache=False)
+        store.replace_all(tables)
+        store.compact()
+    elif backend == "sqlite":
+        store = SQLiteBackend(os.path.join(directory, "clinic.db"))
+        store.replace_all(tables)
+        store.compact()
+    else:
+        raise ValueError(f"Unknown storage backend: {backend!r}")
+    return store.path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000, help="visits (Animals and Invoices rows)")
+    parser.add_argument("--stock-items", type=int, default=30)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", default="excel", choices=["excel", "sqlite"])
+    parser.add_argument("--out", required=True, help="directory to write animals.xlsx / clinic.db to")
+    args = parser.parse_args(argv)
+
+    tables = generate(args.rows, args.stock_items, args.seed, args.years)
+    path = write_store(args.out, args.backend, tables)
+    print(f"{path}: " + ", ".join(f"{len(df)} {name}" for name, df in tables.items()))
+
+
+if __name__ == "__main__":
+    main()
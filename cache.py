@@ -0,0 +1,245 @@
+"""In-process cache of parsed tables, keyed on the backing files' mtime/size."""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+
+from lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get("CLINIC_CACHE_MB", "256")) * 1024 * 1024)
+
+
+def file_signature(*paths):
+    """Return a (mtime_ns, size) tuple per path; missing files give None."""
+    sig = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+
+def apply_row_update(df: pd.DataFrame, key_col: str, key, values: dict, blank: str = None):
+    """Set ``values`` on the rows of ``df`` whose ``key_col`` equals ``key`` (in place).
+
+    With ``blank``, only rows whose ``blank`` column is empty are changed.
+    """
+    if df.empty or key_col not in df.columns:
+        return
+    mask = df[key_col].astype(str) == str(key)
+    if blank is not None:
+        mask &= df[blank].isna() | (df[blank].astype(str).str.strip() == "")
+    if mask.any():
+        for col, value in values.items():
+            df.loc[mask, col] = value
+
+
+def _index_rows(index: dict, keys: pd.Series, start: int):
+    """Add row positions ``start``, ``start + 1``, ... to ``index`` under their keys."""
+    for pos, key in enumerate(keys.astype(str), start):
+        index.setdefault(key, []).append(pos)
+
+
+class TableCache:
+    """Holds parsed DataFrames until the files they came from change.
+
+    Entries are only valid for the signature they were loaded under; any
+    change in mtime or size (another process writing, a manual edit) drops
+    them.  Writers in this process call ``begin_write``/``finish_write`` so
+    their own changes update the cache in place instead of forcing a reparse.
+
+    Cached tables can also be indexed on a key column (``lookup``): a hash
+    map from key to row positions, built on first use and kept in step with
+    appends and updates, so finding a row by key costs the same however
+    long the table is.
+    """
+
+    def __init__(self, *paths, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.paths = paths
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # table -> [DataFrame, nbytes, pending appends, indexes]
+        self._valid_for = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def signature(self):
+        return file_signature(*self.paths)
+
+    def get(self, table: str, loader):
+        """Return a copy of ``table``, calling ``loader()`` on a miss."""
+        return self.get_many([table], lambda: {table: loader()})[table]
+
+    def get_many(self, tables: list, loader):
+        """Return copies of several tables; ``loader()`` returns all of them on a miss."""
+        sig = self.signature()
+        with self._lock:
+            self._check(sig)
+            if all(t in self._entries for t in tables):
+                self.hits += len(tables)
+                for t in tables:
+                    self._entries.move_to_end(t)
+                return {t: self._materialize(t).copy() for t in tables}
+            self.misses += len(tables)
+        loaded = loader()
+        with self._lock:
+            # Only keep what we loaded if the files didn't change meanwhile
+            if sig == self._valid_for:
+                for t, df in loaded.items():
+                    self._store(t, df)
+        return {t: loaded[t].copy() for t in tables}
+
+    def begin_write(self):
+        """Signature before a write; pass it to ``finish_write``."""
+        return self.signature()
+
+    def finish_write(self, before_sig, replaced: dict = None, appended: dict = None,
+                     updated: dict = None, dropped=()):
+        """Apply a completed write to the cached tables.
+
+        ``replaced`` maps tables to their full new content, ``appended`` maps
+        tables to DataFrames of new rows, ``updated`` maps tables to lists of
+        ``(key_col, key, values[, blank])`` row updates (see
+        ``apply_row_update``), and ``dropped`` tables are
+        simply forgotten.  If someone else wrote since the cache was last
+        checked, everything not in ``replaced`` is discarded.
+        """
+        new_sig = self.signature()
+        with self._lock:
+            if before_sig != self._valid_for:
+                self._clear()
+            self._valid_for = new_sig
+            for t in dropped:
+                self._discard(t)
+            for t, new_rows in (appended or {}).items():
+                entry = self._entries.get(t)
+                if entry is None or new_rows is None or new_rows.empty:
+                    continue
+                # Queue the rows; they are concatenated once, on the next read,
+                # so an append costs the same however long the table is
+                nbytes = int(new_rows.memory_usage(index=True, deep=True).sum())
+                start = len(entry[0]) + sum(len(df) for df in entry[2])
+                for key_col, index in entry[3].items():
+                    _index_rows(index, new_rows[key_col], start)
+                entry[1] += nbytes
+                entry[2].append(new_rows)
+                self._bytes += nbytes
+                self._evict()
+            for t, changes in (updated or {}).items():
+                if t not in self._entries:
+                    continue
+                df = self._materialize(t)
+                indexes = self._entries[t][3]
+                for key_col, key, values, *blank in changes:
+                    apply_row_update(df, key_col, key, values, *blank)
+                    for col in values:
+                        # A changed key moves rows between buckets; rebuild on next use
+                        indexes.pop(col, None)
+            for t, df in (replaced or {}).items():
+                self._store(t, df.copy())
+
+    def lookup(self, table: str, key_col: str, key, loader=None):
+        """Rows of ``table`` whose ``key_col`` equals ``key``, as a list of dicts.
+
+        Keys compare as strings.  Without a ``loader``, returns None when the
+        table is not cached (the caller should ask the backing store);
+        with one, loads the table on a miss like ``get``.
+        """
+        sig = self.signature()
+        with self._lock:
+            self._check(sig)
+            if table in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(table)
+                return self._lookup(table, key_col, key)
+            if loader is None:
+                return None
+            self.misses += 1
+        df = loader()
+        with self._lock:
+            if sig == self._valid_for:
+                self._store(table, df)
+                if table in self._entries:
+                    return self._lookup(table, key_col, key)
+        # Too big to cache, or the files changed while loading
+        return df[df[key_col].astype(str) == str(key)].to_dict("records")
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+            self._valid_for = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": list(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _check(self, sig):
+        if sig != self._valid_for:
+            self._clear()
+            self._valid_for = sig
+
+    def _store(self, table: str, df: pd.DataFrame):
+        self._discard(table)
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        self._entries[table] = [df, nbytes, [], {}]
+        self._bytes += nbytes
+        self._evict()
+
+    def _evict(self):
+        # Least recently used tables go first when over the memory bound
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, evicted, _, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+            self.evictions += 1
+
+    def _materialize(self, table: str) -> pd.DataFrame:
+        entry = self._entries[table]
+        if entry[2]:
+            frames = [df for df in [entry[0], *entry[2]] if not df.empty]
+            entry[0] = pd.concat(frames, ignore_index=True) if frames else entry[0]
+            entry[2] = []
+        return entry[0]
+
+    def _lookup(self, table: str, key_col: str, key) -> list:
+        entry = self._entries[table]
+        index = entry[3].get(key_col)
+        if index is None:
+            index = entry[3][key_col] = {}
+            _index_rows(index, self._materialize(table)[key_col], 0)
+        return [self._row_at(entry, pos) for pos in index.get(str(key), ())]
+
+    def _row_at(self, entry, pos: int) -> dict:
+        # Rows may still sit in the pending appends; don't concatenate for one row
+        for df in [entry[0], *entry[2]]:
+            if pos < len(df):
+                return df.iloc[pos].to_dict()
+            pos -= len(df)
+        raise IndexError(pos)
+
+    def _discard(self, table: str):
+        entry = self._entries.pop(table, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _clear(self):
+        self._entries.clear()
+        self._bytes = 0
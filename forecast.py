@@ -0,0 +1,121 @@
+"""Consumption forecasts and economic order quantities for the DSS.
+
+Daily usage per Stock reference is smoothed exponentially.  The rates live
+in the simulation state (``state["consumption"]``) and each simulated day
+folds its usage in with one vector operation over all references, so
+forecasting never rescans history.  Orders are sized with the EOQ formula,
+using the daily storage cost as the holding cost, and then trimmed to the
+budget, most urgent first.
+"""
+from __future__ import annotations
+
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+SMOOTHING = 0.3  # weight of the newest day in the smoothed daily usage
+ORDER_COST = 20.0  # fixed cost assumed per purchase order (delivery, handling)
+SAFETY_DAYS = 3  # below this many days of cover an item is HIGH urgency
+REVIEW_DAYS = 7  # reorder once stock covers fewer days than this
+MIN_ORDER_QTY = 10  # ordered for an out-of-stock item even with no recent usage
+
+
+def smooth(rates: np.ndarray, used: np.ndarray, in_stock: np.ndarray, alpha: float = SMOOTHING) -> np.ndarray:
+    """Fold one day of usage into the smoothed rates of every reference.
+
+    Items that were out of stock could not be sold, so their usage that day
+    says nothing about demand; their rate is left as it was.
+    """
+    return np.where(in_stock, alpha * used + (1 - alpha) * rates, rates)
+
+
+def rates_from_history(daily: pd.DataFrame, alpha: float = SMOOTHING) -> dict:
+    """Smoothed rate per reference from a day x reference matrix of units sold.
+
+    Used when the state has no rates yet (older saves).  Stock levels per
+    day are not known here, so out-of-stock days count as zero usage.
+    """
+    if daily.empty:
+        return {}
+    return {ref: float(rate) for ref, rate in daily.ewm(alpha=alpha, adjust=False).mean().iloc[-1].items()}
+
+
+def economic_order_quantity(daily_rate, order_cost: float, holding_cost: float):
+    """EOQ, sqrt(2DS/H), with D and H per day."""
+    return np.sqrt(2 * np.asarray(daily_rate, dtype=float) * order_cost / holding_cost)
+
+
+def order_plan(qty, price, rate, holding_cost: float, order_cost: float = ORDER_COST) -> dict:
+    """Reorder decision for every item at once (arrays in, arrays out).
+
+    An item ``needs`` reordering when it is out of stock, or when its stock
+    covers fewer than REVIEW_DAYS of forecast usage.  It then ``wants`` its
+    EOQ, or enough to cover REVIEW_DAYS + SAFETY_DAYS if that is more, and
+    at least MIN_ORDER_QTY when out of stock (no usage is forecast for an
+    item nobody could buy lately).
+    """
+    qty = np.asarray(qty)
+    rate = np.asarray(rate, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cover = np.where(rate > 0, qty / rate, np.where(qty > 0, np.inf, 0.0))
+    out = qty <= 0
+    needs = out | ((rate > 0) & (cover < REVIEW_DAYS))
+    eoq = economic_order_quantity(rate, order_cost, holding_cost)
+    wanted = np.ceil(np.maximum(eoq, rate * (REVIEW_DAYS + SAFETY_DAYS) - qty)).astype(int)
+    wanted = np.where(out, np.maximum(wanted, MIN_ORDER_QTY), wanted)
+    urgency = np.select(
+        [out, needs & (cover < SAFETY_DAYS), needs],
+        ["CRITICAL", "HIGH", "MEDIUM"],
+        default="OK",
+    )
+    return {"needs": needs, "cover": cover, "eoq": eoq, "wanted": wanted, "urgency": urgency}
+
+
+def fit_to_budget(wanted, price, budget) -> np.ndarray:
+    """Cut ``wanted`` quantities so their total cost fits ``budget``, earlier items first.
+
+    With 2-D ``wanted`` and ``price`` each row is cut to its own ``budget``.
+    """
+    wanted = np.asarray(wanted)
+    price = np.asarray(price, dtype=float)
+    cost = wanted * price
+    budget = np.maximum(np.asarray(budget, dtype=float), 0.0)[..., None]
+    remaining = np.clip(budget - (np.cumsum(cost, axis=-1) - cost), 0, None)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        affordable = np.where(price > 0, np.floor(remaining / price), wanted)
+    return np.minimum(wanted, affordable).astype(int)
+
+
+def recommend_orders(stock_df: pd.DataFrame, rates: dict, budget: float, holding_cost: float,
+                     order_cost: float = ORDER_COST) -> pd.DataFrame:
+    """Purchase recommendations for every item about to run short, most urgent first.
+
+    See ``order_plan`` for when and how much; quantities are then cut, in
+    order of days of cover, so the total stays within ``budget``, and
+    ``budget_limited`` marks the items that were cut.
+    """
+    qty = pd.to_numeric(stock_df["Quantity"], errors="coerce").fillna(0).astype(int).to_numpy()
+    price = pd.to_numeric(stock_df["Price"], errors="coerce").fillna(0.0).to_numpy()
+    rate = stock_df["Reference"].map(rates).fillna(0.0).astype(float).to_numpy()
+    plan = order_plan(qty, price, rate, holding_cost, order_cost)
+
+    recs = pd.DataFrame({
+        "reference": stock_df["Reference"].fillna("").to_numpy(),
+        "name": stock_df["Name"].fillna("").to_numpy(),
+        "type": stock_df["Type"].fillna("").to_numpy(),
+        "current_qty": qty,
+        "unit_price": price,
+        "daily_usage": rate.round(2),
+        "days_of_cover": plan["cover"].round(1),
+        "eoq": np.ceil(plan["eoq"]).astype(int),
+        "wanted": plan["wanted"],
+        "urgency": plan["urgency"],
+    })[plan["needs"]].sort_values("days_of_cover", kind="stable")
+
+    # Spend the budget on the items that run out first
+    recs["recommended_qty"] = fit_to_budget(recs["wanted"].to_numpy(), recs["unit_price"].to_numpy(), budget)
+    recs["budget_limited"] = recs["recommended_qty"] < recs["wanted"]
+    recs["total_cost"] = recs["recommended_qty"] * recs["unit_price"]
+    return recs.drop(columns="wanted").reset_index(drop=True)
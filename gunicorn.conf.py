@@ -0,0 +1,32 @@
+"""Gunicorn settings for serving the app in production.
+
+    flask --app app serve --workers 4 --threads 4
+    gunicorn app:app                 (reads this file from the working directory)
+
+Every worker is a separate process that imports the app after the fork (no
+preload), so connections, caches, PDF pools and background threads are
+never shared between processes.  Workers coordinate through the same lock
+files, transaction intent file and SQLite locking that already keep
+separately started app processes consistent.  Each worker warms its cache
+before serving (see ``warmup`` in app.py).
+"""
+import os
+
+
+bind = os.environ.get("CLINIC_BIND", "127.0.0.1:8000")
+# One worker per core by default; threads let a worker overlap I/O and lock waits.
+# The workbook is locked as a whole and every worker would reparse it after
+# each write, so with the excel backend a single worker is the default
+excel = os.environ.get("CLINIC_STORAGE", "sqlite").lower() == "excel"
+workers = int(os.environ.get("CLINIC_WORKERS", 1 if excel else os.cpu_count() or 1))
+threads = int(os.environ.get("CLINIC_THREADS", "4"))
+worker_class = "gthread"
+# Warmup and the first parse of a large workbook happen before a worker serves
+timeout = int(os.environ.get("CLINIC_WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+accesslog = "-"
+
+# Workers already spread requests over the cores, so each needs only one
+# PDF process rather than the default of up to four
+os.environ.setdefault("PDF_WORKERS", "1")
+os.environ.setdefault("CLINIC_WARMUP", "1")
@@ -1,9 +1,10 @@
 """Initialize the veterinary clinic simulation with starter data."""
 import pandas as pd
 from datetime import datetime
-import os
+from storage import open_storage
 
 EXCEL_FILENAME = "animals.xlsx"
+DATABASE_FILENAME = "clinic.db"
 
 # Initial stock data
 initial_stock = [
@@ -21,10 +22,10 @@ initial_stock = [
 stock_df = pd.DataFrame(initial_stock)
 stock_df["Timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-# Create Excel with Stock sheet
-with pd.ExcelWriter(EXCEL_FILENAME, engine="openpyxl") as writer:
-    stock_df.to_excel(writer, sheet_name="Stock", index=False)
+# Write the starter stock through the configured storage backend
+storage = open_storage(sqlite_path=DATABASE_FILENAME, excel_path=EXCEL_FILENAME)
+storage.reset(stock_df)
 
 print("✅ Initial stock data created successfully!")
 print(f"📦 Created {len(initial_stock)} stock items")
-print(f"💾 Saved to {EXCEL_FILENAME}")
+print(f"💾 Saved to {storage.path} ({storage.name} backend)")
@@ -0,0 +1,144 @@
+"""ReportLab rendering of invoice PDFs.
+
+Kept separate from app.py so PDF worker processes only import ReportLab,
+not Flask and the storage layer.  The paragraph and table styles are the
+same for every invoice, so they are built once per process (on first use)
+rather than on every render.  ReportLab itself is imported by the first
+render too, so importing this module (and app.py) doesn't pay for it.
+"""
+from functools import lru_cache
+
+
+INCH = 72.0  # points, as reportlab.lib.units.inch
+INFO_COL_WIDTHS = [2 * INCH, 4 * INCH]
+ITEMS_COL_WIDTHS = [3 * INCH, 1 * INCH, 1.5 * INCH, 1.5 * INCH]
+TOTAL_COL_WIDTHS = [5.5 * INCH, 1.5 * INCH]
+
+
+@lru_cache(maxsize=1)
+def invoice_styles() -> dict:
+    """Title style and table styles shared by every invoice in this process."""
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import TableStyle
+
+    styles = getSampleStyleSheet()
+    return {
+        "title": ParagraphStyle(
+            "CustomTitle",
+            parent=styles["Heading1"],
+            fontSize=24,
+            textColor=colors.HexColor("#1a237e"),
+            spaceAfter=30,
+            alignment=TA_CENTER,
+        ),
+        "info": TableStyle(
+            [
+                ("FONTNAME", (0, 0), (0, -1), "Helvetica-Bold"),
+                ("FONTSIZE", (0, 0), (-1, -1), 11),
+                ("TEXTCOLOR", (0, 0), (0, -1), colors.HexColor("#424242")),
+                ("ALIGN", (0, 0), (0, -1), "RIGHT"),
+                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+                ("BOTTOMPADDING", (0, 0), (-1, -1), 8),
+            ]
+        ),
+        "items": TableStyle(
+            [
+                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#1a237e")),
+                ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+                ("FONTSIZE", (0, 0), (-1, 0), 12),
+                ("ALIGN", (1, 0), (-1, -1), "CENTER"),
+                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+                ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
+                ("TOPPADDING", (0, 0), (-1, 0), 12),
+                ("GRID", (0, 0), (-1, -1), 1, colors.HexColor("#e0e0e0")),
+                ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#f5f5f5")]),
+                ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
+                ("FONTSIZE", (0, 1), (-1, -1), 10),
+            ]
+        ),
+        "total": TableStyle(
+            [
+                ("FONTNAME", (0, 0), (-1, -1), "Helvetica-Bold"),
+                ("FONTSIZE", (0, 0), (-1, -1), 14),
+                ("ALIGN", (0, 0), (0, 0), "RIGHT"),
+                ("ALIGN", (1, 0), (1, 0), "CENTER"),
+                ("TEXTCOLOR", (0, 0), (-1, -1), colors.HexColor("#1a237e")),
+                ("BACKGROUND", (1, 0), (1, 0), colors.HexColor("#e3f2fd")),
+                ("BOX", (1, 0), (1, 0), 2, colors.HexColor("#1a237e")),
+                ("TOPPADDING", (0, 0), (-1, -1), 10),
+                ("BOTTOMPADDING", (0, 0), (-1, -1), 10),
+            ]
+        ),
+    }
+
+
+def invoice_elements(invoice_data: dict) -> list:
+    """Flowables for one invoice page."""
+    from reportlab.platypus import Table, Paragraph, Spacer
+
+    styles = invoice_styles()
+    elements = []
+
+    # Title
+    elements.append(Paragraph("VETERINARY CLINIC INVOICE", styles["title"]))
+    elements.append(Spacer(1, 0.2 * INCH))
+
+    # Invoice details
+    info_data = [
+        ["Invoice Number:", invoice_data["invoice_number"]],
+        ["Date:", invoice_data["timestamp"]],
+        ["Owner Name:", invoice_data["owner_name"]],
+        ["Payment Method:", invoice_data["payment_method"]],
+    ]
+    elements.append(Table(info_data, colWidths=INFO_COL_WIDTHS, style=styles["info"]))
+    elements.append(Spacer(1, 0.4 * INCH))
+
+    # Items table
+    items_data = [["Item/Service", "Quantity", "Unit Price", "Total"]]
+    for item in invoice_data["items"]:
+        items_data.append(
+            [
+                item["name"],
+                str(item["quantity"]),
+                f"${float(item['unit_price']):.2f}",
+                f"${float(item['total']):.2f}",
+            ]
+        )
+    elements.append(Table(items_data, colWidths=ITEMS_COL_WIDTHS, style=styles["items"]))
+    elements.append(Spacer(1, 0.3 * INCH))
+
+    # Total
+    total_data = [["TOTAL:", f"${float(invoice_data['total']):.2f}"]]
+    elements.append(Table(total_data, colWidths=TOTAL_COL_WIDTHS, style=styles["total"]))
+    return elements
+
+
+def render_invoice_pdf(invoice_data: dict, pdf_path: str) -> str:
+    """Render one invoice to ``pdf_path`` and return the path."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate
+
+    SimpleDocTemplate(pdf_path, pagesize=letter).build(invoice_elements(invoice_data))
+    return pdf_path
+
+
+def render_invoices(jobs: list) -> list:
+    """Render many invoices to separate files; ``jobs`` is ``[(invoice_data, pdf_path), ...]``."""
+    return [render_invoice_pdf(invoice_data, pdf_path) for invoice_data, pdf_path in jobs]
+
+
+def render_invoices_combined(invoices: list, pdf_path: str) -> str:
+    """Render many invoices into one PDF, one invoice per page."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, PageBreak
+
+    elements = []
+    for n, invoice_data in enumerate(invoices):
+        if n:
+            elements.append(PageBreak())
+        elements.extend(invoice_elements(invoice_data))
+    SimpleDocTemplate(pdf_path, pagesize=letter).build(elements)
+    return pdf_path
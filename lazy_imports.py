@@ -0,0 +1,42 @@
+"""Heavy dependencies, imported on first use rather than at startup.
+
+pandas and NumPy take longer to import than Flask and the whole app
+together, and most of the app only needs them once a table is read.
+``lazy_import`` returns a stand-in module whose first attribute access runs
+the real import, so ``pd = lazy_import("pandas")`` reads like a normal
+import but costs nothing until a request touches ``pd``.  Modules using it
+put ``from __future__ import annotations`` first, so ``pd.DataFrame``
+annotations don't trigger the import either.
+
+The first access goes through ``importlib.import_module`` under a lock, so
+threads that reach it together (gthread workers, say) all wait for one
+complete import; importlib's LazyLoader offers no such guarantee before
+Python 3.12.
+"""
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+
+_lock = threading.RLock()
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, attr):
+        # Only called for attributes not copied in yet
+        with _lock:
+            module = importlib.import_module(self.__name__)
+            self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str):
+    """The module ``name``, imported for real on first attribute access."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    return _LazyModule(name)
@@ -0,0 +1,196 @@
+"""Shared/exclusive locks per resource, across threads and processes.
+
+Each resource (a table, the simulation state, ...) gets its own lock, so
+readers never wait for each other and a writer only blocks the resources it
+touches.  Within a process a reader-writer lock arbitrates between threads
+(writers are preferred, so a stream of dashboard polls cannot starve a
+simulation run); across processes an flock on ``<lock_dir>/<resource>.lock``
+does the same for several app workers sharing one data store.  Windows has
+no shared file locks, so there the file lock is always exclusive.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """Advisory lock on a file, shared or exclusive, held by this process."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def acquire(self, shared: bool = False):
+        # A descriptor inherited across fork() shares the lock with the
+        # parent, so each process opens its own
+        if self._fd is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            while True:
+                try:
+                    msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10 seconds; keep waiting
+                    continue
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+
+
+class ResourceLock:
+    """Reader-writer lock for one resource, optionally backed by a file lock."""
+
+    def __init__(self, name: str, path: str = None):
+        self.name = name
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        self._file = FileLock(path) if path else None
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def acquire_read(self):
+        start = time.perf_counter()
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+            if self._readers == 1 and self._file:
+                # Other threads of this process share our file lock
+                self._file.acquire(shared=True)
+            self._waited(time.perf_counter() - start, "read")
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                if self._file:
+                    self._file.release()
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        start = time.perf_counter()
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+            if self._file:
+                self._file.acquire(shared=False)
+            self._waited(time.perf_counter() - start, "write")
+
+    def release_write(self):
+        with self._cond:
+            if self._file:
+                self._file.release()
+            self._writer = False
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "acquisitions": self.acquisitions,
+                "contended": self.contended,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "max_wait_seconds": round(self.max_wait_seconds, 6),
+                "readers": self._readers,
+                "writer": self._writer,
+            }
+
+    def _waited(self, seconds: float, mode: str):
+        # Called with self._cond held
+        metrics.observe("lock_wait", seconds, lock=self.name, mode=mode)
+        self.acquisitions += 1
+        self.wait_seconds += seconds
+        if seconds > 0.001:
+            self.contended += 1
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+
+class LockManager:
+    """Hands out read and write locks on named resources.
+
+    ``aliases`` maps resource names onto the lock that actually guards them,
+    for stores where several tables live in one file.  Locks are always
+    taken in sorted order, so acquiring several at once cannot deadlock.
+    Locks are not reentrant: don't take a lock you already hold.
+    """
+
+    def __init__(self, lock_dir: str = None, aliases: dict = None):
+        self.lock_dir = lock_dir
+        self.aliases = aliases or {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def get(self, name: str) -> ResourceLock:
+        name = self.aliases.get(name, name)
+        with self._guard:
+            lock = self._locks.get(name)
+            if lock is None:
+                path = os.path.join(self.lock_dir, f"{name}.lock") if self.lock_dir else None
+                lock = self._locks[name] = ResourceLock(name, path)
+            return lock
+
+    def read(self, *names):
+        """Context manager holding shared locks on ``names``."""
+        return self.acquire(read=names)
+
+    def write(self, *names):
+        """Context manager holding exclusive locks on ``names``."""
+        return self.acquire(write=names)
+
+    @contextmanager
+    def acquire(self, read=(), write=()):
+        """Hold shared locks on ``read`` and exclusive locks on ``write``."""
+        modes = {}
+        for name in read:
+            modes[self.get(name).name] = "read"
+        for name in write:
+            modes[self.get(name).name] = "write"
+        held = []
+        try:
+            for name in sorted(modes):
+                lock = self.get(name)
+                if modes[name] == "write":
+                    lock.acquire_write()
+                else:
+                    lock.acquire_read()
+                held.append((lock, modes[name]))
+            yield
+        finally:
+            for lock, mode in reversed(held):
+                if mode == "write":
+                    lock.release_write()
+                else:
+                    lock.release_read()
+
+    def stats(self) -> dict:
+        with self._guard:
+            locks = list(self._locks.values())
+        return {lock.name: lock.stats() for lock in locks}
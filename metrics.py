@@ -0,0 +1,173 @@
+"""Timing histograms for the app's hot paths, in Prometheus text format.
+
+Storage reads and writes, lock waits and PDF renders are timed where they
+happen and tagged with the Flask endpoint of the request that caused them
+(``none`` for background threads).  CLINIC_METRICS=1 collects histograms
+for ``/metrics``; CLINIC_SERVER_TIMING=1 also sums each request's timings
+into a Server-Timing response header (nested operations overlap, e.g. a
+commit includes its workbook rewrite).  Both are off by default, and then a
+timer is a single flag check.  Each app process keeps its own histograms.
+"""
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+
+# Upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# kind -> (metric name, help text)
+HISTOGRAMS = {
+    "request": ("clinic_request_seconds", "Request latency by route, method and status."),
+    "storage": ("clinic_storage_seconds", "Storage reads and writes by backend and operation."),
+    "lock_wait": ("clinic_lock_wait_seconds", "Time spent waiting to acquire a lock."),
+    "pdf_render": ("clinic_pdf_render_seconds", "Invoice PDF renders (cache misses)."),
+}
+
+
+def _flag(name: str) -> bool:
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+class _Timer:
+    __slots__ = ("metrics", "kind", "labels", "start")
+
+    def __init__(self, metrics, kind: str, labels: dict):
+        self.metrics = metrics
+        self.kind = kind
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.kind, time.perf_counter() - self.start, **self.labels)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Histograms per kind and label set, plus the current request's timings."""
+
+    def __init__(self, enabled: bool = False, server_timing: bool = False):
+        self.export = enabled
+        self.server_timing = server_timing
+        self.enabled = enabled or server_timing
+        self._series = {}  # (kind, sorted label items) -> [bucket counts..., sum]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls) -> "Metrics":
+        return cls(enabled=_flag("CLINIC_METRICS"), server_timing=_flag("CLINIC_SERVER_TIMING"))
+
+    def begin_request(self, route: str):
+        """Tag what this thread times from now on with ``route``."""
+        if self.enabled:
+            self._local.route = route
+            self._local.start = time.perf_counter()
+            self._local.timings = [] if self.server_timing else None
+
+    def end_request(self, method: str, status: int) -> list:
+        """Record the request's latency; returns its ``(name, seconds)`` timings for Server-Timing."""
+        if not self.enabled or getattr(self._local, "route", None) is None:
+            return []
+        elapsed = time.perf_counter() - self._local.start
+        self.observe("request", elapsed, method=method, status=status)
+        timings = self._local.timings
+        self._local.route = None
+        self._local.timings = None
+        return [] if timings is None else timings + [("total", elapsed)]
+
+    def observe(self, kind: str, seconds: float, **labels):
+        if not self.enabled:
+            return
+        route = getattr(self._local, "route", None)
+        key = (kind, tuple(sorted({**labels, "route": route or "none"}.items())))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+            series[bisect_left(BUCKETS, seconds)] += 1
+            series[-1] += seconds
+        timings = getattr(self._local, "timings", None)
+        if timings is not None and kind != "request":
+            name = "-".join([kind] + [str(v) for k, v in sorted(labels.items()) if k != "backend"])
+            timings.append((re.sub(r"[^\w.-]", "_", name), seconds))
+
+    def timer(self, kind: str, **labels):
+        """Context manager timing its block as one observation of ``kind``."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, kind, labels)
+
+    def timed(self, kind: str, **labels):
+        """Decorator timing every call of the function as one observation of ``kind``."""
+        def decorate(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with _Timer(self, kind, labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def render(self) -> str:
+        """All histograms in the Prometheus text exposition format."""
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        lines = []
+        for kind, (name, help_text) in HISTOGRAMS.items():
+            keys = sorted(key for key in series if key[0] == kind)
+            if not keys:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for key in keys:
+                values = series[key]
+                labels = ",".join(f'{k}="{_escape(v)}"' for k, v in key[1])
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), values[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {values[-1]:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def server_timing_header(timings: list) -> str:
+    """Server-Timing value summing ``(name, seconds)`` timings per name."""
+    totals = {}
+    for name, seconds in timings:
+        total, count = totals.get(name, (0.0, 0))
+        totals[name] = (total + seconds, count + 1)
+    return ", ".join(
+        f'{name};dur={total * 1000:.2f}' + (f';desc="{count}x"' if count > 1 else "")
+        for name, (total, count) in totals.items()
+    )
+
+
+# The process-wide registry, configured from the environment
+metrics = Metrics.from_env()
@@ -0,0 +1,130 @@
+"""Content-addressed on-disk cache of rendered invoice PDFs.
+
+Files are named ``<invoice number>-<content hash>.pdf``: the hash covers
+everything printed on the invoice, so an edited invoice never serves a stale
+PDF, and one directory listing tells which invoices currently have a PDF.
+The least recently used files are evicted once the directory grows past
+``max_bytes``.
+"""
+import hashlib
+import json
+import os
+import threading
+
+from metrics import metrics
+
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get("PDF_CACHE_MB", "100")) * 1024 * 1024)
+
+
+def invoice_digest(invoice_data: dict) -> str:
+    """Hash of the fields that end up in the rendered PDF."""
+    content = {
+        "invoice_number": str(invoice_data["invoice_number"]),
+        "timestamp": str(invoice_data["timestamp"]),
+        "owner_name": invoice_data["owner_name"],
+        "payment_method": invoice_data["payment_method"],
+        "total": round(float(invoice_data["total"]), 2),
+        "items": [
+            [li["name"], int(li["quantity"]), round(float(li["unit_price"]), 2), round(float(li["total"]), 2)]
+            for li in invoice_data["items"]
+        ],
+    }
+    encoded = json.dumps(content, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+class PdfCache:
+    """Renders invoice PDFs on first request and keeps them, LRU-bounded."""
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._bytes = None  # computed on first use
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path_for(self, invoice_data: dict) -> str:
+        digest = invoice_digest(invoice_data)
+        return os.path.join(self.directory, f"{invoice_data['invoice_number']}-{digest}.pdf")
+
+    def get_or_render(self, invoice_data: dict, render) -> str:
+        """Return the cached PDF path, calling ``render(invoice_data, path)`` on a miss."""
+        path = self.path_for(invoice_data)
+        if os.path.exists(path):
+            with self._lock:
+                self.hits += 1
+            # Bump the mtime: it is the recency used for eviction
+            os.utime(path)
+            return path
+        with self._lock:
+            self.misses += 1
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with metrics.timer("pdf_render"):
+                render(invoice_data, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._added(os.path.getsize(path), keep=path)
+        return path
+
+    def cached_numbers(self) -> set:
+        """Invoice numbers with a PDF in the cache, from one directory listing."""
+        numbers = set()
+        for entry in self._scan():
+            numbers.add(entry.name.rsplit("-", 1)[0])
+        return numbers
+
+    def clear(self):
+        for entry in self._scan():
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        with self._lock:
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _scan(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [e for e in os.scandir(self.directory) if e.is_file() and e.name.endswith(".pdf")]
+
+    def _added(self, size: int, keep: str):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(e.stat().st_size for e in self._scan())
+            else:
+                self._bytes += size
+            if self._bytes <= self.max_bytes:
+                return
+            # Over budget: drop the least recently used files (oldest mtime first)
+            entries = sorted(self._scan(), key=lambda e: e.stat().st_mtime)
+            total = sum(e.stat().st_size for e in entries)
+            for entry in entries:
+                if total <= self.max_bytes:
+                    break
+                if entry.path == keep:
+                    continue
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+            self._bytes = total
@@ -0,0 +1,52 @@
+"""Invoice PDF rendering on a process pool.
+
+ReportLab is CPU-bound and holds the GIL, so rendering in a request thread
+stalls every other request.  ``PdfJobQueue.render`` hands the work to a
+worker process and waits for it, leaving the web process free.
+"""
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from invoice_pdf import render_invoice_pdf
+
+
+def default_workers() -> int:
+    """PDF_WORKERS env var, else up to 4 processes (0 renders inline)."""
+    value = os.environ.get("PDF_WORKERS")
+    if value is not None:
+        return max(0, int(value))
+    return min(4, os.cpu_count() or 1)
+
+
+class PdfJobQueue:
+    """Renders invoice PDFs in a lazily started pool of worker processes."""
+
+    def __init__(self, workers: int = None):
+        self.workers = default_workers() if workers is None else workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                atexit.register(self.shutdown)
+            return self._pool
+
+    def submit(self, invoice_data: dict, pdf_path: str):
+        """Queue an invoice for rendering to ``pdf_path``; returns a Future."""
+        return self._executor().submit(render_invoice_pdf, invoice_data, pdf_path)
+
+    def render(self, invoice_data: dict, pdf_path: str, timeout: float = 60) -> str:
+        """Render in a worker process and wait; raises if rendering failed."""
+        if self.workers == 0:
+            return render_invoice_pdf(invoice_data, pdf_path)
+        return self.submit(invoice_data, pdf_path).result(timeout=timeout)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,143 @@
+"""Opt-in profiling of individual requests.
+
+A profiled request runs under cProfile while a sampler thread records its
+call stack every few milliseconds.  Two files are saved per request in the
+profiles directory: ``<stamp>-<route>-<ms>ms.prof`` (pstats, for snakeviz or
+``python -m pstats``) and ``.collapsed`` (one ``frame;frame;... count``
+line per stack, for flamegraph.pl or speedscope).  Only the newest ``keep``
+profiles are kept.
+
+Requests are profiled when they carry ``?profile=<CLINIC_PROFILE_KEY>``, or
+at random with probability CLINIC_PROFILE_RATE.  Sampled profiles are only
+saved if the request took at least CLINIC_PROFILE_MIN_MS, so a low rate
+catches real slow requests without keeping the fast ones.  One request is
+profiled at a time; with neither setting nothing is ever profiled.
+"""
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+DEFAULT_KEEP = 50
+
+
+class _Sampler(threading.Thread):
+    """Counts the call stacks of one thread, sampled at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class _Run:
+    def __init__(self, sampled: bool, interval: float):
+        self.sampled = sampled
+        self.start = time.perf_counter()
+        self.sampler = _Sampler(threading.get_ident(), interval)
+        self.sampler.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def finish(self) -> float:
+        self.profile.disable()
+        self.sampler.stop()
+        return (time.perf_counter() - self.start) * 1000
+
+
+class Profiler:
+    """Decides which requests to profile and writes their profiles, rotated."""
+
+    def __init__(self, directory: str, key: str = None, rate: float = 0.0, min_ms: float = 0.0,
+                 keep: int = DEFAULT_KEEP, interval: float = SAMPLE_INTERVAL):
+        self.directory = directory
+        self.key = key
+        self.rate = rate
+        self.min_ms = min_ms
+        self.keep = keep
+        self.interval = interval
+        self._busy = threading.Lock()
+
+    @classmethod
+    def from_env(cls, directory: str) -> "Profiler":
+        return cls(
+            os.environ.get("CLINIC_PROFILE_DIR", directory),
+            key=os.environ.get("CLINIC_PROFILE_KEY") or None,
+            rate=float(os.environ.get("CLINIC_PROFILE_RATE", "0")),
+            min_ms=float(os.environ.get("CLINIC_PROFILE_MIN_MS", "0")),
+            keep=int(os.environ.get("CLINIC_PROFILE_KEEP", DEFAULT_KEEP)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.key) or self.rate > 0
+
+    def start(self, token: str = None):
+        """Start profiling this thread's request if asked for (or sampled); returns a run or None."""
+        requested = bool(self.key and token and hmac.compare_digest(token.encode(), self.key.encode()))
+        if not requested and not (self.rate > 0 and random.random() < self.rate):
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        try:
+            return _Run(sampled=not requested, interval=self.interval)
+        except Exception:
+            self._busy.release()
+            raise
+
+    def stop(self, run: _Run, name: str) -> str:
+        """Stop ``run`` and save it; returns the path without extension, or None if not kept."""
+        try:
+            elapsed_ms = run.finish()
+        finally:
+            self._busy.release()
+        if run.sampled and elapsed_ms < self.min_ms:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        route = re.sub(r"[^\w.-]", "_", name)
+        base = os.path.join(self.directory, f"{stamp}-{route}-{elapsed_ms:.0f}ms")
+        run.profile.dump_stats(base + ".prof")
+        with open(base + ".collapsed", "w") as f:
+            for stack, count in run.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self._rotate()
+        return base
+
+    def _rotate(self):
+        """Delete all but the newest ``keep`` profiles."""
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if n.endswith(".prof"))
+        except OSError:
+            return
+        for name in names[:max(0, len(names) - self.keep)]:
+            for ext in (".prof", ".collapsed"):
+                try:
+                    os.remove(os.path.join(self.directory, name[:-len(".prof")] + ext))
+                except OSError:
+                    pass
@@ -0,0 +1,104 @@
+"""Vectorized sales figures from the InvoiceLines table.
+
+Each invoice line records the Stock reference it sold, so units and revenue
+per product are a single group-by; nothing parses the Items summary string.
+Lines without a reference (the consultation fee, lines recorded before the
+column existed and not yet backfilled) are grouped by name.
+"""
+from __future__ import annotations
+
+from lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+
+def _lines(lines_df: pd.DataFrame, invoices_df: pd.DataFrame = None, since: str = None, until: str = None) -> pd.DataFrame:
+    """Typed lines with a ``product`` key, plus a ``day`` if invoices are given."""
+    if "Reference" in lines_df.columns:
+        reference = lines_df["Reference"].astype("string").str.strip().replace("", pd.NA)
+    else:
+        reference = pd.Series(pd.NA, index=lines_df.index, dtype="string")
+    name = lines_df["Name"].astype("string").fillna("")
+    lines = pd.DataFrame({
+        "invoice": lines_df["Invoice Number"].astype(str),
+        "reference": reference.fillna(""),
+        "name": name,
+        "product": reference.fillna(name),
+        "units": pd.to_numeric(lines_df["Quantity"], errors="coerce").fillna(0).astype(int),
+        "revenue": pd.to_numeric(lines_df["Total"], errors="coerce").fillna(0.0),
+    })
+    if invoices_df is None:
+        return lines
+    days = pd.to_datetime(invoices_df["Timestamp"], errors="coerce").dt.normalize()
+    day_by_invoice = pd.Series(days.to_numpy(), index=invoices_df["Invoice Number"].astype(str))
+    lines["day"] = lines["invoice"].map(day_by_invoice[~day_by_invoice.index.duplicated()])
+    mask = lines["day"].notna()
+    if since:
+        mask &= lines["day"] >= pd.Timestamp(since)
+    if until:
+        mask &= lines["day"] <= pd.Timestamp(until)
+    return lines[mask]
+
+
+def product_sales(lines_df: pd.DataFrame, invoices_df: pd.DataFrame = None, stock_df: pd.DataFrame = None,
+                  since: str = None, until: str = None) -> pd.DataFrame:
+    """Units sold and revenue per product, highest revenue first.
+
+    Returns ``reference`` (empty for services), ``name``, ``units``,
+    ``revenue``, ``invoices`` (how many invoices sold it) and
+    ``avg_unit_price``.  ``since``/``until`` (YYYY-MM-DD, inclusive) need
+    ``invoices_df`` for the dates.  With ``stock_df`` there are also
+    ``unit_cost`` (current Stock price), ``cost`` and ``margin``; services
+    have no cost.
+    """
+    if (since or until) and invoices_df is None:
+        raise ValueError("filtering by date needs invoices_df")
+    lines = _lines(lines_df, invoices_df, since, until)
+    sales = lines.groupby("product", sort=False).agg(
+        reference=("reference", "last"),
+        name=("name", "last"),
+        units=("units", "sum"),
+        revenue=("revenue", "sum"),
+        invoices=("invoice", "nunique"),
+    ).reset_index(drop=True)
+    sales["avg_unit_price"] = (sales["revenue"] / sales["units"].where(sales["units"] > 0)).fillna(0.0)
+    if stock_df is not None:
+        price = pd.to_numeric(stock_df["Price"], errors="coerce").fillna(0.0)
+        unit_cost = pd.Series(price.to_numpy(), index=stock_df["Reference"].astype(str))
+        sales["unit_cost"] = sales["reference"].map(unit_cost[~unit_cost.index.duplicated()]).fillna(0.0)
+        sales["cost"] = sales["unit_cost"] * sales["units"]
+        sales["margin"] = sales["revenue"] - sales["cost"]
+    return sales.sort_values("revenue", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def daily_units(lines_df: pd.DataFrame, invoices_df: pd.DataFrame, since: str = None, until: str = None) -> pd.DataFrame:
+    """Units sold per day (rows) and Stock reference (columns).
+
+    Every calendar day from the first to the last sale is present, with 0
+    on days nothing was sold.  Services are left out.
+    """
+    lines = _lines(lines_df, invoices_df, since, until)
+    lines = lines[lines["reference"] != ""]
+    if lines.empty:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="day"))
+    table = lines.pivot_table(index="day", columns="reference", values="units", aggfunc="sum", fill_value=0)
+    table = table.asfreq("D", fill_value=0)
+    table.index.name = "day"
+    table.columns.name = None
+    return table.astype(int)
+
+
+def reference_backfill(lines_df: pd.DataFrame, stock_df: pd.DataFrame) -> tuple:
+    """Stock reference for each item name on lines that have none.
+
+    Returns ``({name: reference}, ambiguous)``: names matching exactly one
+    Stock item, and the sorted names shared by several Stock items, which
+    are left for someone to sort out by hand.
+    """
+    lines = _lines(lines_df)
+    missing = set(lines.loc[lines["reference"] == "", "name"])
+    names = stock_df["Name"].astype(str)
+    unique = ~names.duplicated(keep=False)
+    by_name = dict(zip(names[unique], stock_df.loc[unique, "Reference"].astype(str)))
+    ambiguous = sorted(missing & set(names[~unique]))
+    return {name: by_name[name] for name in sorted(missing) if name in by_name}, ambiguous
@@ -0,0 +1,506 @@
+"""The clinic simulation as a pure, seedable kernel.
+
+``Clinic`` holds a copy of the simulation state and the stock as arrays and
+advances them with its own NumPy random generator, drawing and serving the
+visits of many days, and of many trials in lockstep, as one batch of
+arrays.  It never touches storage, so the live game (app.simulate_days) is
+just the one-trial case of what-if runs.  ``run_trials`` fans chunks of
+trials out over a process pool and summarizes final budget, revenue and
+stockouts, and ``compare_policies`` does so for several purchasing policies
+on the same random draws.
+"""
+from __future__ import annotations
+
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from forecast import smooth, order_plan, fit_to_budget
+from lazy_imports import lazy_import
+from stock_analysis import URGENCY_TIERS, HIGH_BELOW, LOW_STOCK_THRESHOLD
+from storage import TABLE_COLUMNS
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+# Visit generation parameters
+MIN_VISITS_PER_DAY = 3
+MAX_VISITS_PER_DAY = 8
+ANIMAL_TYPES = ["Dog", "Cat", "Rabbit", "Bird", "Hamster"]
+PAYMENT_METHODS = ["Cash", "Card", "Insurance"]
+OWNER_NAMES = ["John Smith", "Mary Johnson", "David Lee", "Sarah Wilson", "Mike Brown", "Emma Davis"]
+# (stock type, chance per visit, max units used, sell price multiplier)
+VISIT_CONSUMPTION = [
+    ("Vaccine", 0.5, 1, 2.0),
+    ("Medicine", 0.4, 3, 1.8),
+    ("Accessory", 0.3, 2, 3.0),
+]
+
+# Operational costs (rent and storage)
+RENT_PER_DAY = 100.0
+STORAGE_COST_PER_UNIT = 0.01
+
+# Totals Clinic.simulate returns per day and trial
+DAY_TOTALS = ("animals_treated", "revenue", "overhead", "purchases", "lost_sales", "storage_cost", "total_units")
+# Upper bound on days x trials x stock rows served as one batch
+BATCH_CELLS = 1_000_000
+
+# What-if trials run in lockstep chunks of this many; chunk i is seeded
+# with (seed, i), so results do not depend on the number of workers
+CHUNK_TRIALS = 100
+# Summary statistics reported per metric by run_trials
+PERCENTILES = (5, 50, 95)
+
+
+def invoice_line_rows(invoice_num, line_items: list) -> list:
+    """InvoiceLines rows for an invoice's line items."""
+    return [
+        {
+            "Invoice Number": invoice_num,
+            "Line": n,
+            "Name": li["name"],
+            "Quantity": li["quantity"],
+            "Unit Price": li["unit_price"],
+            "Total": li["total"],
+            "Reference": li.get("reference"),
+        }
+        for n, li in enumerate(line_items, start=1)
+    ]
+
+
+def _columns(frames: list, table: str) -> pd.DataFrame:
+    """One DataFrame from per-day dicts of column arrays."""
+    cols = TABLE_COLUMNS[table]
+    if not frames:
+        return pd.DataFrame(columns=cols)
+    return pd.DataFrame({col: np.concatenate([f[col] for f in frames]) for col in cols})
+
+
+class Clinic:
+    """Simulation state and stock in memory, advanced a day at a time.
+
+    ``state`` is the simulation state dict (copied); ``stock_df`` the Stock
+    table; ``rng`` a NumPy ``Generator``.  ``trials`` independent copies of
+    the clinic advance in lockstep, so stock, budget and rates are arrays
+    with one row per trial and every visit of every trial is drawn and
+    served as one batch of arrays, never one visit at a time.  With
+    ``record`` (a single trial only) the visits, invoices and invoice lines
+    are also kept as rows for storage, and the state dict follows the
+    clinic; otherwise only the totals are tracked (names, owners and so on
+    are never drawn), which is what what-if runs need.
+    """
+
+    def __init__(self, state: dict, stock_df: pd.DataFrame, rng: np.random.Generator = None,
+                 record: bool = False, trials: int = 1):
+        if record and trials != 1:
+            raise ValueError("only a single trial can be recorded")
+        self.state = copy.deepcopy(state)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.trials = trials
+        self.day = self.state["current_day"]
+        self.refs = stock_df["Reference"].to_numpy()
+        self.names = stock_df["Name"].to_numpy()
+        self.prices = pd.to_numeric(stock_df["Price"], errors="coerce").fillna(0.0).to_numpy()
+        self.start_qty = pd.to_numeric(stock_df["Quantity"], errors="coerce").fillna(0).astype(int).to_numpy()
+        self.qty = np.tile(self.start_qty, (trials, 1))
+        self.budget = np.full(trials, float(self.state["budget"]))
+        types = stock_df["Type"].to_numpy()
+        self.rows_by_type = [np.flatnonzero(types == t) for t, _, _, _ in VISIT_CONSUMPTION]
+        # Selling price of each stock row under each consumption type's markup
+        markups = np.array([markup for _, _, _, markup in VISIT_CONSUMPTION])
+        self.sell_prices = np.round(markups[:, None] * self.prices[None, :], 2)
+        known_rates = self.state.get("consumption", {}).get("rates", {})
+        rates = np.array([known_rates.get(ref, 0.0) for ref in self.refs], dtype=float)
+        self.rates = np.tile(rates, (trials, 1))
+        try:
+            self.base_date = datetime.fromisoformat(self.state["start_date"]).date()
+        except Exception:
+            self.base_date = datetime.now().date()
+        self.record = record
+        self._rows = {"Animals": [], "Invoices": [], "InvoiceLines": []}
+        self._events = []
+
+    def buy(self, quantities: np.ndarray) -> np.ndarray:
+        """Add ``quantities`` (trials x stock rows) at cost price; returns the cost per trial."""
+        cost = (quantities * self.prices).sum(axis=-1)
+        self.qty += quantities
+        self.budget -= cost
+        return cost
+
+    def simulate(self, days: int, policy=None) -> dict:
+        """Simulate ``days`` days; returns a days x trials array per total (see DAY_TOTALS).
+
+        Visits do not depend on stock, so they are drawn a block of days at
+        a time.  Without a policy nothing is bought along the way and the
+        whole block is served at once; ``policy(clinic)`` has to see each
+        morning's stock and returns the quantities to buy, so then the days
+        are served one at a time.  Policies see the same visits either way.
+        """
+        # Keep the days x trials x stock usage matrix of one block bounded
+        block = max(1, BATCH_CELLS // (self.trials * max(len(self.prices), 1)))
+        parts = []
+        for start in range(0, days, block):
+            draw = self._draw(min(block, days - start))
+            if policy is None:
+                parts.append(self._serve(draw, 0, len(draw["counts"])))
+                continue
+            for d in range(len(draw["counts"])):
+                spent = self.buy(policy(self))
+                part = self._serve(draw, d, d + 1)
+                part["purchases"] = spent[None, :]
+                parts.append(part)
+        if not parts:
+            return {key: np.zeros((0, self.trials)) for key in DAY_TOTALS}
+        totals = {key: np.concatenate([part[key] for part in parts]) for key in DAY_TOTALS}
+
+        state = self.state
+        state["current_day"] = self.day
+        if self.trials == 1:
+            state["budget"] = float(self.budget[0])
+            state["total_animals_treated"] += int(totals["animals_treated"].sum())
+            events = list(self._events)
+            events.append({"type": "cost", "name": "Clinic Rent", "cost": RENT_PER_DAY})
+            storage_cost = float(totals["storage_cost"][-1, 0])
+            if storage_cost > 0:
+                events.append({"type": "cost", "name": "Storage Cost", "cost": storage_cost,
+                               "units": int(totals["total_units"][-1, 0])})
+            state["daily_events"] = events
+            state["consumption"] = {"rates": {ref: round(float(rate), 4) for ref, rate in zip(self.refs, self.rates[0])}}
+        return totals
+
+    def run_days(self, days: int, policy=None) -> list:
+        """Simulate ``days`` days of a single trial and return a summary per day.
+
+        ``lost_sales`` counts items visits needed that were out of stock;
+        the last day also carries the events log.
+        """
+        first_day = self.day
+        totals = self.simulate(days, policy)
+        summaries = [
+            {
+                "day": first_day + d,
+                "animals_treated": int(totals["animals_treated"][d, 0]),
+                "revenue": round(float(totals["revenue"][d, 0]), 2),
+                "overhead": float(totals["overhead"][d, 0]),
+                "purchases": round(float(totals["purchases"][d, 0]), 2),
+                "lost_sales": int(totals["lost_sales"][d, 0]),
+            }
+            for d in range(days)
+        ]
+        if summaries:
+            summaries[-1]["events"] = self.state["daily_events"]
+        return summaries
+
+    def _draw(self, days: int) -> dict:
+        """The visits of the next ``days`` days of every trial, day by day, then trial by trial.
+
+        One pick per visit and consumption type: whether the visit wants
+        one, which stock row and how many units; only wanted picks are kept,
+        sorted by visit.
+        """
+        rng = self.rng
+        counts = rng.integers(MIN_VISITS_PER_DAY, MAX_VISITS_PER_DAY + 1, (days, self.trials))
+        n = int(counts.sum())
+        fees = np.round(rng.uniform(30, 80, n), 2)
+        visits, types, skus, units = [], [], [], []
+        for k, ((_, chance, max_units, _), rows) in enumerate(zip(VISIT_CONSUMPTION, self.rows_by_type)):
+            wants = rng.random(n) < chance
+            if not len(rows):
+                continue
+            sku = rows[rng.integers(0, len(rows), n)]
+            amount = rng.integers(1, max_units + 1, n)
+            visits.append(np.flatnonzero(wants))
+            types.append(np.full(wants.sum(), k))
+            skus.append(sku[wants])
+            units.append(amount[wants])
+        visits, types, skus, units = (
+            np.concatenate(a) if a else np.zeros(0, dtype=int) for a in (visits, types, skus, units)
+        )
+        by_visit = np.argsort(visits, kind="stable")
+        visits = visits[by_visit]
+        # Where each day starts among the visits and among the picks
+        visit_start = np.concatenate([[0], np.cumsum(counts.sum(axis=1))])
+        return {
+            "counts": counts,
+            "fees": fees,
+            "visits": visits,
+            "types": types[by_visit],
+            "skus": skus[by_visit],
+            "units": units[by_visit],
+            "visit_start": visit_start,
+            "pick_start": np.searchsorted(visits, visit_start),
+        }
+
+    def _serve(self, draw: dict, d0: int, d1: int) -> dict:
+        """Serve days ``d0``..``d1`` (exclusive) of a draw from the stock on hand."""
+        trials = self.trials
+        days = d1 - d0
+        m = self.qty.shape[1]
+        counts = draw["counts"][d0:d1]
+        v0, v1 = draw["visit_start"][d0], draw["visit_start"][d1]
+        p0, p1 = draw["pick_start"][d0], draw["pick_start"][d1]
+        fees = draw["fees"][v0:v1]
+        visits = draw["visits"][p0:p1] - v0
+        types, skus, units = (draw[key][p0:p1] for key in ("types", "skus", "units"))
+        # Day (from d0) and trial of every visit, as one index
+        cell = np.repeat(np.arange(days * trials), counts.ravel())
+        n = len(cell)
+
+        # Visits are served in order until a row runs out: each pick gets
+        # what is left after the picks of earlier visits for the same row of
+        # the same trial (a cumulative sum per row), clipped at zero
+        key = (cell[visits] % trials) * m + skus
+        order = np.lexsort((visits, key))
+        sorted_units, sorted_keys = units[order], key[order]
+        before = np.cumsum(sorted_units) - sorted_units
+        group_start = np.ones(len(order), dtype=bool)
+        group_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        before -= np.maximum.accumulate(np.where(group_start, before, 0))
+        served = np.empty_like(units)
+        served[order] = np.clip(np.minimum(sorted_units, self.qty.ravel()[sorted_keys] - before), 0, None)
+
+        prices = self.sell_prices[types, skus]
+        line_totals = np.round(prices * served, 2)
+        visit_totals = np.round(fees + np.bincount(visits, weights=line_totals, minlength=n), 2)
+        shape = (days, trials)
+        revenue = np.bincount(cell, weights=visit_totals, minlength=days * trials).reshape(shape)
+        lost = np.bincount(cell[visits[served == 0]], minlength=days * trials).reshape(shape)
+        usage = np.bincount(cell[visits] * m + skus, weights=served, minlength=days * trials * m)
+        usage = usage.reshape(days, trials, m).astype(int)
+
+        if self.record:
+            self._record(self.day, counts[:, 0], cell, fees, visits, types, skus, served, prices, line_totals, visit_totals)
+
+        total_units = np.empty(shape, dtype=int)
+        overhead = np.empty(shape)
+        storage_cost = np.empty(shape)
+        for d in range(days):
+            opening = self.qty
+            self.qty = opening - usage[d]
+            # Today's usage of every item, folded into the consumption forecast
+            self.rates = smooth(self.rates, usage[d], opening > 0)
+            total_units[d] = self.qty.sum(axis=1)
+            storage_cost[d] = np.round(STORAGE_COST_PER_UNIT * total_units[d], 2)
+            overhead[d] = np.round(RENT_PER_DAY + storage_cost[d], 2)
+            self.budget += revenue[d]
+            self.budget -= overhead[d]
+        self.day += days
+        return {
+            "animals_treated": counts,
+            "revenue": revenue,
+            "overhead": overhead,
+            "purchases": np.zeros(shape),
+            "lost_sales": lost,
+            "storage_cost": storage_cost,
+            "total_units": total_units,
+        }
+
+    def _record(self, first_day, counts, visit_day, fees, visits, types, skus, served, prices, line_totals, visit_totals):
+        """Draw the visits' descriptive details and keep a batch's rows for storage."""
+        rng = self.rng
+        n = len(visit_day)
+        animal_types = np.array(ANIMAL_TYPES, dtype=object)[rng.integers(0, len(ANIMAL_TYPES), n)]
+        name_numbers = rng.integers(100, 1000, n)
+        owners = np.array(OWNER_NAMES, dtype=object)[rng.integers(0, len(OWNER_NAMES), n)]
+        ages = rng.integers(1, 16, n)
+        sexes = np.array(["Male", "Female"], dtype=object)[rng.integers(0, 2, n)]
+        phones = rng.integers(1000, 10000, n)
+        suffixes = rng.integers(100, 1000, n)
+        payments = np.array(PAYMENT_METHODS, dtype=object)[rng.integers(0, len(PAYMENT_METHODS), n)]
+
+        now = datetime.now().time()
+        day_stamps = np.array([
+            datetime.combine(self.base_date + timedelta(days=first_day + d - 1), now).strftime("%Y-%m-%d %H:%M:%S")
+            for d in range(len(counts))
+        ], dtype=object)
+        timestamps = day_stamps[visit_day]
+        day_numbers = first_day + visit_day
+        visit_no = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+        animal_names = np.array([f"{t} #{num}" for t, num in zip(animal_types, name_numbers)], dtype=object)
+        # Day and visit number make this unique (storage rejects duplicates);
+        # the random suffix only keeps numbers from looking sequential
+        invoice_nums = np.array(
+            [f"{day}{i:02d}{suffix}" for day, i, suffix in zip(day_numbers, visit_no, suffixes)], dtype=object
+        )
+
+        # Consultation fee on line 1, then the items actually sold, in type order
+        sold = np.flatnonzero(served > 0)
+        sold = sold[np.lexsort((types[sold], visits[sold]))]
+        sold_visits = visits[sold]
+        first_of_visit = np.r_[True, sold_visits[1:] != sold_visits[:-1]] if len(sold) else np.zeros(0, dtype=bool)
+        position = np.arange(len(sold))
+        item_line = position - np.maximum.accumulate(np.where(first_of_visit, position, 0)) + 2
+        line_visit = np.concatenate([np.arange(n), sold_visits])
+        line_no = np.concatenate([np.ones(n, dtype=int), item_line])
+        line_order = np.lexsort((line_no, line_visit))
+        line_visit, line_no = line_visit[line_order], line_no[line_order]
+        line_names = np.concatenate([np.full(n, "Consultation Fee", dtype=object), self.names[skus[sold]].astype(object)])[line_order]
+        line_refs = np.concatenate([np.full(n, None, dtype=object), self.refs[skus[sold]].astype(object)])[line_order]
+        line_qty = np.concatenate([np.ones(n, dtype=int), served[sold]])[line_order]
+        line_unit = np.concatenate([fees, prices[sold]])[line_order]
+        line_total = np.concatenate([fees, line_totals[sold]])[line_order]
+
+        items = [[] for _ in range(n)]
+        for v, name, qty in zip(line_visit, line_names, line_qty):
+            items[v].append((name, qty))
+
+        self._rows["Animals"].append({
+            "Timestamp": timestamps,
+            "Animal Name": animal_names,
+            "Animal Type": animal_types,
+            "Medical History": np.full(n, "Simulation visit", dtype=object),
+            "Age": ages,
+            "Sex": sexes,
+            "Owner Name": owners,
+            "Owner Email": np.array([f"{o.lower().replace(' ', '.')}@email.com" for o in owners], dtype=object),
+            "Owner Phone": np.array([f"+1-555-{p}" for p in phones], dtype=object),
+            "Comments": np.array([f"Day {day} visit" for day in day_numbers], dtype=object),
+        })
+        # Invoices are stored as data only; the PDF is rendered on first download
+        self._rows["Invoices"].append({
+            "Timestamp": timestamps,
+            "Invoice Number": invoice_nums,
+            "Owner Name": owners,
+            "Items": np.array(["; ".join(f"{name} (x{qty})" for name, qty in visit) for visit in items], dtype=object),
+            "Total Amount": visit_totals,
+            "Payment Method": payments,
+            "PDF Path": np.full(n, "", dtype=object),
+        })
+        self._rows["InvoiceLines"].append({
+            "Invoice Number": invoice_nums[line_visit],
+            "Line": line_no,
+            "Name": line_names,
+            "Quantity": line_qty,
+            "Unit Price": line_unit,
+            "Total": line_total,
+            "Reference": line_refs,
+        })
+        # The last day's visits, for the events log
+        self._events = [
+            {
+                "type": "visit",
+                "animal": f"{animal_names[i]} ({animal_types[i]})",
+                "items_used": [f"{name} x{qty}" for name, qty in items[i]],
+                "revenue": float(visit_totals[i]),
+            }
+            for i in np.flatnonzero(visit_day == len(counts) - 1)
+        ]
+
+    def stock_updates(self) -> list:
+        """Stock rows whose quantity changed since the start, as ``{"Reference", "Quantity"}`` (single trial)."""
+        qty = self.qty[0]
+        return [
+            {"Reference": self.refs[j], "Quantity": int(qty[j])}
+            for j in np.flatnonzero(qty != self.start_qty)
+        ]
+
+    def appends(self) -> dict:
+        """The recorded rows per table."""
+        return {table: _columns(frames, table) for table, frames in self._rows.items()}
+
+
+def _within_budget(clinic: Clinic, wanted: np.ndarray, order: np.ndarray) -> np.ndarray:
+    """``wanted`` cut to each trial's budget, buying in ``order`` (per trial) until it runs out."""
+    bought = fit_to_budget(np.take_along_axis(wanted, order, axis=1), clinic.prices[order], clinic.budget)
+    buy = np.empty_like(bought)
+    np.put_along_axis(buy, order, bought, axis=1)
+    return buy
+
+
+def threshold_policy(clinic: Clinic) -> np.ndarray:
+    """The old DSS: fixed reorder quantities by stock level, most urgent first, within budget."""
+    qty = clinic.qty
+    tiers = [qty == 0, qty < HIGH_BELOW, qty < LOW_STOCK_THRESHOLD]
+    wanted = np.select(tiers, [reorder for _, reorder in URGENCY_TIERS], default=0)
+    rank = np.select(tiers, range(len(tiers)), default=len(tiers))
+    return _within_budget(clinic, wanted, np.argsort(rank, axis=1, kind="stable"))
+
+
+def forecast_policy(clinic: Clinic) -> np.ndarray:
+    """The forecasting DSS: EOQ for items short of cover, fewest days of cover first, within budget."""
+    plan = order_plan(clinic.qty, clinic.prices, clinic.rates, holding_cost=STORAGE_COST_PER_UNIT)
+    wanted = np.where(plan["needs"], plan["wanted"], 0)
+    return _within_budget(clinic, wanted, np.argsort(plan["cover"], axis=1, kind="stable"))
+
+
+# Purchasing policies for what-if runs; "none" never restocks
+POLICIES = {
+    "none": None,
+    "threshold": threshold_policy,
+    "forecast": forecast_policy,
+}
+
+
+def _run_chunk(state, stock_df, policy, days, seed, chunk, size) -> tuple:
+    """Chunk ``chunk`` of a what-if run: per trial, ``(final budget, stock value, revenue,
+    stockout days, lost sales)``.
+
+    Stock value is what the remaining stock cost; money spent on stock that
+    is still on the shelf is not lost.
+    """
+    clinic = Clinic(state, stock_df, rng=np.random.default_rng([seed, chunk]), trials=size)
+    totals = clinic.simulate(days, POLICIES[policy])
+    lost_sales = totals["lost_sales"]
+    return (clinic.budget, (clinic.qty * clinic.prices).sum(axis=1), totals["revenue"].sum(axis=0),
+            (lost_sales > 0).sum(axis=0), lost_sales.sum(axis=0))
+
+
+def default_workers() -> int:
+    """SIM_WORKERS env var, else one process per CPU (0 runs inline)."""
+    value = os.environ.get("SIM_WORKERS")
+    if value is not None:
+        return max(0, int(value))
+    return os.cpu_count() or 1
+
+
+def _summary(values: np.ndarray) -> dict:
+    summary = {"mean": round(float(values.mean()), 2), "std": round(float(values.std()), 2)}
+    for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{p}"] = round(float(value), 2)
+    summary["min"] = round(float(values.min()), 2)
+    summary["max"] = round(float(values.max()), 2)
+    return summary
+
+
+def run_trials(state: dict, stock_df: pd.DataFrame, policy: str = "forecast", days: int = 30,
+               trials: int = 1000, seed: int = 0, workers: int = None) -> dict:
+    """Simulate ``trials`` independent ``days``-day runs from the same start.
+
+    Trials run in chunks of CHUNK_TRIALS seeded from ``seed``, so results
+    are reproducible and two policies run with the same ``seed`` see the
+    same visits.  Returns summary statistics per metric (final budget,
+    value of the stock left, revenue, days with lost sales, lost sales)
+    plus the share of runs ending in debt.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy {policy!r} (expected one of {', '.join(POLICIES)})")
+    workers = default_workers() if workers is None else workers
+    chunks = [(i, min(CHUNK_TRIALS, trials - start)) for i, start in enumerate(range(0, trials, CHUNK_TRIALS))]
+    if workers == 0 or len(chunks) < 2:
+        results = [_run_chunk(state, stock_df, policy, days, seed, i, size) for i, size in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            futures = [pool.submit(_run_chunk, state, stock_df, policy, days, seed, i, size) for i, size in chunks]
+            results = [f.result() for f in futures]
+    final_budget, stock_value, revenue, stockout_days, lost_sales = (
+        np.concatenate(col).astype(float) for col in zip(*results)
+    )
+    return {
+        "policy": policy,
+        "days": days,
+        "trials": trials,
+        "final_budget": _summary(final_budget),
+        "stock_value": _summary(stock_value),
+        "revenue": _summary(revenue),
+        "stockout_days": _summary(stockout_days),
+        "lost_sales": _summary(lost_sales),
+        "p_in_debt": round(float((final_budget < 0).mean()), 4),
+    }
+
+
+def compare_policies(state: dict, stock_df: pd.DataFrame, policies=tuple(POLICIES), days: int = 30,
+                     trials: int = 1000, seed: int = 0, workers: int = None) -> list:
+    """``run_trials`` for each policy on the same seeds."""
+    return [run_trials(state, stock_df, policy, days, trials, seed, workers) for policy in policies]
@@ -0,0 +1,275 @@
+"""Columnar snapshots of the history tables, in Parquet or Feather files.
+
+Animals and Invoices only ever grow, and reporting queries only need a few
+of their columns, so parsing whole tables out of the workbook (or SQLite)
+for them is wasted work.  ``SnapshotStore.export`` writes each table as one
+file per day or month under ``<root>/<table>/``; ``read`` loads just the
+columns and partitions asked for.  Exports are incremental: the manifest
+records how many rows of each table were exported and what the last one
+was, so when a table has only grown since, just the new rows are read and
+only the partitions they fall in are rewritten (in practice the latest
+one).  Anything else, such as a reset, falls back to a full comparison,
+which still rewrites only the partitions whose rows changed.  Both formats
+need pyarrow, which is optional.
+"""
+from __future__ import annotations
+
+import importlib.util
+import json
+import os
+
+from lazy_imports import lazy_import
+from storage import ANIMALS_TABLE, INVOICES_TABLE, TABLE_COLUMNS, COLUMN_TYPES
+
+pd = lazy_import("pandas")
+
+# pandas' Parquet/Feather engine; only looked up here, pandas imports it when used
+HAVE_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+SNAPSHOT_TABLES = (ANIMALS_TABLE, INVOICES_TABLE)
+FORMATS = {"parquet": ".parquet", "feather": ".feather"}
+# Partition key per Timestamp, as a strftime format
+PARTITIONS = {"day": "%Y-%m-%d", "month": "%Y-%m"}
+UNDATED = "undated"
+MANIFEST_FILENAME = "manifest.json"
+
+
+class SnapshotUnavailable(RuntimeError):
+    """pyarrow is not installed, so no columnar files can be read or written."""
+
+
+def _require_pyarrow():
+    if not HAVE_PYARROW:
+        raise SnapshotUnavailable("Parquet/Feather snapshots need pyarrow (pip install pyarrow)")
+
+
+def _typed(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    """One type per column (spreadsheets mix numbers and text freely)."""
+    out = {}
+    for col in TABLE_COLUMNS[table]:
+        values = df[col] if col in df.columns else pd.Series(index=df.index, dtype=object)
+        if col in COLUMN_TYPES:
+            out[col] = pd.to_numeric(values, errors="coerce")
+        else:
+            out[col] = values.astype("string")
+    return pd.DataFrame(out, index=df.index)
+
+
+def _partition_keys(timestamps: pd.Series, partition: str) -> pd.Series:
+    days = pd.to_datetime(timestamps, errors="coerce")
+    return days.dt.strftime(PARTITIONS[partition]).fillna(UNDATED)
+
+
+class SnapshotStore:
+    """Partitioned columnar copies of Animals and Invoices under ``root``."""
+
+    def __init__(self, root: str, fmt: str = "parquet", partition: str = "month"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown snapshot format {fmt!r} (expected one of {', '.join(FORMATS)})")
+        if partition not in PARTITIONS:
+            raise ValueError(f"Unknown partition {partition!r} (expected one of {', '.join(PARTITIONS)})")
+        self.root = root
+        self.fmt = fmt
+        self.partition = partition
+        self.manifest_path = os.path.join(root, MANIFEST_FILENAME)
+
+    def manifest(self) -> dict:
+        """The manifest of the files on disk (empty if there are none yet)."""
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {"tables": {}}
+        if manifest.get("format") != self.fmt or manifest.get("partition") != self.partition:
+            # Written with other settings; nothing in it can be reused
+            return {"tables": {}}
+        return manifest
+
+    def is_current(self, storage, tables=SNAPSHOT_TABLES) -> bool:
+        """True if the snapshot holds ``tables`` as storage has them now (writes to other tables don't count)."""
+        exported = self.manifest()["tables"]
+        return all(_exported_version(exported.get(table, {})) == _version(storage, table) for table in tables)
+
+    def export(self, storage, tables=SNAPSHOT_TABLES, full: bool = False) -> dict:
+        """Bring the snapshot up to date with ``storage``.
+
+        Returns ``{table: {"written": n, "unchanged": n, "removed": n}}``.
+        ``full`` rewrites every partition.  Callers hold read locks on the
+        tables and keep other exporters out.
+        """
+        _require_pyarrow()
+        manifest = {} if full else self.manifest()
+        old_tables = manifest.get("tables", {})
+        new_tables = {}
+        summary = {}
+        for table in tables:
+            old_entry = old_tables.get(table, {})
+            os.makedirs(os.path.join(self.root, table), exist_ok=True)
+            appended = None if full else self._appended(storage, table, old_entry)
+            if appended is None:
+                new_tables[table], summary[table] = self._export_all(_typed(storage.read_table(table), table),
+                                                                     table, old_entry)
+            else:
+                new_tables[table], summary[table] = self._export_appended(appended, table, old_entry)
+        for table, entry in old_tables.items():
+            new_tables.setdefault(table, entry)
+        self._save_manifest({
+            "format": self.fmt,
+            "partition": self.partition,
+            "tables": new_tables,
+        })
+        return summary
+
+    def _appended(self, storage, table: str, entry: dict):
+        """Rows added to ``table`` since ``entry`` was exported, or None if it changed otherwise."""
+        exported = entry.get("rows")
+        if exported is None or "last" not in entry:
+            return None
+        if not exported:
+            return _typed(storage.read_rows(table, 0), table)
+        # Read from the last exported row on: it must still be there, unchanged
+        rows = _typed(storage.read_rows(table, exported - 1), table)
+        if rows.empty or _last_row(rows.iloc[:1], table) != entry["last"]:
+            return None
+        return rows.iloc[1:].reset_index(drop=True)
+
+    def _export_all(self, df: pd.DataFrame, table: str, old_entry: dict):
+        """Compare every partition of ``df`` with the manifest and rewrite the changed ones."""
+        keys = _partition_keys(df["Timestamp"], self.partition)
+        old = old_entry.get("partitions", {})
+        parts = {}
+        counts = {"written": 0, "unchanged": 0, "removed": 0}
+        for key, part in df.groupby(keys, sort=True):
+            entry = self._entry(table, key, part)
+            if old.get(key) == entry and os.path.exists(os.path.join(self.root, entry["file"])):
+                counts["unchanged"] += 1
+            else:
+                self._write(part.reset_index(drop=True), entry["file"])
+                counts["written"] += 1
+            parts[key] = entry
+        for key, entry in old.items():
+            if key not in parts:
+                try:
+                    os.remove(os.path.join(self.root, entry["file"]))
+                except OSError:
+                    pass
+                counts["removed"] += 1
+        return self._table_entry(table, parts, len(df), _last_row(df, table)), counts
+
+    def _export_appended(self, new_rows: pd.DataFrame, table: str, old_entry: dict):
+        """Add ``new_rows`` to the partitions they fall in, leaving the others alone."""
+        parts = dict(old_entry.get("partitions", {}))
+        written = 0
+        if not new_rows.empty:
+            keys = _partition_keys(new_rows["Timestamp"], self.partition)
+            for key, rows in new_rows.groupby(keys, sort=True):
+                old = parts.get(key)
+                if old and os.path.exists(os.path.join(self.root, old["file"])):
+                    rows = pd.concat([self._read(old["file"], TABLE_COLUMNS[table]), rows], ignore_index=True)
+                part = rows.reset_index(drop=True)
+                parts[key] = self._entry(table, key, part)
+                self._write(part, parts[key]["file"])
+                written += 1
+        rows = old_entry["rows"] + len(new_rows)
+        last = _last_row(new_rows, table) if not new_rows.empty else old_entry["last"]
+        counts = {"written": written, "unchanged": len(parts) - written, "removed": 0}
+        return self._table_entry(table, parts, rows, last), counts
+
+    def _entry(self, table: str, key: str, part: pd.DataFrame) -> dict:
+        return {
+            "file": f"{table}/{self.partition}={key}{FORMATS[self.fmt]}",
+            "rows": len(part),
+            "hash": str(int(pd.util.hash_pandas_object(part, index=False).sum())),
+        }
+
+    @staticmethod
+    def _table_entry(table: str, parts: dict, rows: int, last) -> dict:
+        return {"columns": TABLE_COLUMNS[table], "partitions": parts, "rows": rows, "last": last}
+
+    def read(self, table: str, columns: list = None, since: str = None, until: str = None) -> pd.DataFrame:
+        """Load ``columns`` of ``table`` (all by default), optionally only rows
+        timestamped between ``since`` and ``until`` (YYYY-MM-DD, inclusive).
+
+        Whole partitions outside the range are never opened.
+        """
+        _require_pyarrow()
+        columns = list(columns or TABLE_COLUMNS[table])
+        # Timestamp is needed to trim the edge partitions
+        load = columns if not (since or until) or "Timestamp" in columns else columns + ["Timestamp"]
+        partitions = self.manifest()["tables"].get(table, {}).get("partitions", {})
+        frames = []
+        for key in sorted(partitions):
+            if (since or until) and (key == UNDATED or not _overlaps(key, since, until)):
+                continue
+            frames.append(self._read(partitions[key]["file"], load))
+        if not frames:
+            return _typed(pd.DataFrame(columns=TABLE_COLUMNS[table]), table)[columns]
+        df = pd.concat(frames, ignore_index=True)
+        if since or until:
+            days = pd.to_datetime(df["Timestamp"], errors="coerce").dt.strftime("%Y-%m-%d")
+            mask = days.notna()
+            if since:
+                mask &= days >= since
+            if until:
+                mask &= days <= until
+            df = df[mask].reset_index(drop=True)
+        return df[columns]
+
+    def _write(self, df: pd.DataFrame, name: str):
+        path = os.path.join(self.root, name)
+        # Readers never see a partially written partition
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        if self.fmt == "parquet":
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.to_feather(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _read(self, name: str, columns: list) -> pd.DataFrame:
+        path = os.path.join(self.root, name)
+        if self.fmt == "parquet":
+            return pd.read_parquet(path, columns=columns)
+        return pd.read_feather(path, columns=columns)
+
+    def _save_manifest(self, manifest: dict):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+
+def _overlaps(key: str, since: str, until: str) -> bool:
+    # A "2024-03" partition covers every day starting with that prefix
+    if since and key < since[:len(key)]:
+        return False
+    if until and key > until[:len(key)]:
+        return False
+    return True
+
+
+def _last_row(df: pd.DataFrame, table: str):
+    """The last row of a typed table in JSON form, to recognise it later (None if empty).
+
+    Numbers are compared as floats: the same value may be int64 in a slice
+    and float64 in the whole column.
+    """
+    if df.empty:
+        return None
+    row = df.iloc[-1]
+    return [
+        None if pd.isna(row[col]) else float(row[col]) if col in COLUMN_TYPES else str(row[col])
+        for col in TABLE_COLUMNS[table]
+    ]
+
+
+def _version(storage, table: str) -> tuple:
+    """(row count, last row) of ``table``; the history tables only ever grow, so this changes with them."""
+    rows = storage.row_count(table)
+    last = _last_row(_typed(storage.read_rows(table, rows - 1), table), table) if rows else None
+    return rows, last
+
+
+def _exported_version(entry: dict) -> tuple:
+    return entry.get("rows"), entry.get("last")
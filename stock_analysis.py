@@ -0,0 +1,48 @@
+"""Vectorized stock-level classification for the stock page.
+
+The DSS sizes orders from forecast usage (forecast.py) instead; these
+levels remain the stock page's urgency labels, the dashboard's low-stock
+cutoff and the rule of the old ``threshold`` policy in what-if runs.
+"""
+from __future__ import annotations
+
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+# Urgency tiers, most urgent first: (label, reorder quantity).  CRITICAL
+# means out of stock, HIGH below 5 units, MEDIUM below 10.  The quantities
+# are only used by simulation.threshold_policy, the fixed rule the DSS had
+# before forecasts.
+URGENCY_TIERS = [
+    ("CRITICAL", 50),
+    ("HIGH", 30),
+    ("MEDIUM", 20),
+]
+HIGH_BELOW = 5
+LOW_STOCK_THRESHOLD = 10
+
+
+def analyze_stock(stock_df: pd.DataFrame) -> pd.DataFrame:
+    """Classify every stock row at once.
+
+    Returns one row per item with ``timestamp``, ``reference``, ``name``,
+    ``type``, ``quantity`` (int), ``price`` (float) and ``urgency``.
+    """
+    qty = pd.to_numeric(stock_df["Quantity"], errors="coerce").fillna(0).astype(int)
+    price = pd.to_numeric(stock_df["Price"], errors="coerce").fillna(0.0).astype(float)
+
+    tiers = [qty == 0, qty < HIGH_BELOW, qty < LOW_STOCK_THRESHOLD]
+    urgency = np.select(tiers, [label for label, _ in URGENCY_TIERS], default="OK")
+
+    return pd.DataFrame({
+        "timestamp": stock_df["Timestamp"].fillna("").to_numpy(),
+        "reference": stock_df["Reference"].fillna("").to_numpy(),
+        "name": stock_df["Name"].fillna("").to_numpy(),
+        "type": stock_df["Type"].fillna("").to_numpy(),
+        "quantity": qty.to_numpy(),
+        "price": price.to_numpy(),
+        "urgency": urgency,
+    })
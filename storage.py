@@ -0,0 +1,981 @@
+"""Storage backends for the clinic tables (Animals, Stock, Invoices).
+
+``SQLiteBackend`` is the system of record: indexed tables in WAL mode with
+row-level inserts and updates.  ``ExcelBackend`` keeps the original layout
+(one sheet per table in a single workbook) and doubles as the target of the
+on-demand Excel export.
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from cache import TableCache, apply_row_update
+from lazy_imports import lazy_import
+from metrics import metrics
+
+pd = lazy_import("pandas")
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background compactions (0 disables them)
+COMPACT_INTERVAL = float(os.environ.get("CLINIC_COMPACT_SECONDS", "30"))
+
+
+ANIMALS_TABLE = "Animals"
+STOCK_TABLE = "Stock"
+INVOICES_TABLE = "Invoices"
+INVOICE_LINES_TABLE = "InvoiceLines"
+# Workbook sheet recording which journal the workbook already contains
+META_SHEET = "_meta"
+
+TABLE_COLUMNS = {
+    ANIMALS_TABLE: [
+        "Timestamp",
+        "Animal Name",
+        "Animal Type",
+        "Medical History",
+        "Age",
+        "Sex",
+        "Owner Name",
+        "Owner Email",
+        "Owner Phone",
+        "Comments",
+    ],
+    STOCK_TABLE: [
+        "Timestamp",
+        "Reference",
+        "Name",
+        "Quantity",
+        "Price",
+        "Type",
+    ],
+    INVOICES_TABLE: [
+        "Timestamp",
+        "Invoice Number",
+        "Owner Name",
+        "Items",
+        "Total Amount",
+        "Payment Method",
+        "PDF Path",
+    ],
+    # One row per invoice line; enough to re-render the PDF on demand.
+    # Reference is the Stock item sold (empty for services like the consultation)
+    INVOICE_LINES_TABLE: [
+        "Invoice Number",
+        "Line",
+        "Name",
+        "Quantity",
+        "Unit Price",
+        "Total",
+        "Reference",
+    ],
+}
+
+# SQL column types; anything not listed is stored as TEXT
+COLUMN_TYPES = {
+    "Age": "INTEGER",
+    "Quantity": "INTEGER",
+    "Price": "REAL",
+    "Total Amount": "REAL",
+    "Line": "INTEGER",
+    "Unit Price": "REAL",
+    "Total": "REAL",
+}
+
+# Unique keys, besides Stock.Reference which is UNIQUE in the table itself
+UNIQUE_INDEXES = [
+    ("idx_invoices_number_unique", INVOICES_TABLE, "Invoice Number"),
+]
+INDEXES = [
+    ("idx_animals_type", ANIMALS_TABLE, "Animal Type"),
+    ("idx_animals_timestamp", ANIMALS_TABLE, "Timestamp"),
+    ("idx_stock_type", STOCK_TABLE, "Type"),
+    ("idx_invoices_timestamp", INVOICES_TABLE, "Timestamp"),
+    ("idx_invoice_lines_number", INVOICE_LINES_TABLE, "Invoice Number"),
+    ("idx_invoice_lines_reference", INVOICE_LINES_TABLE, "Reference"),
+]
+
+
+class DuplicateKeyError(ValueError):
+    """A write would give two rows the same unique key."""
+
+
+# Sort keys accepted by ``iter_invoices`` and the column each one orders by
+INVOICE_SORT_COLUMNS = {
+    "date": "Timestamp",
+    "number": "Invoice Number",
+    "owner": "Owner Name",
+    "total": "Total Amount",
+}
+
+
+def _next_day(day: str) -> str:
+    return (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def _invoice_mask(df: pd.DataFrame, filters: dict) -> pd.Series:
+    """Rows of an Invoices frame matching ``filters`` (see ``iter_invoices``)."""
+    mask = pd.Series(True, index=df.index)
+    timestamps = df["Timestamp"].astype(str)
+    if filters.get("start"):
+        mask &= timestamps >= filters["start"]
+    if filters.get("end"):
+        mask &= timestamps < _next_day(filters["end"])
+    if filters.get("owner"):
+        mask &= df["Owner Name"].astype(str).str.contains(filters["owner"], case=False, regex=False)
+    if filters.get("payment"):
+        mask &= df["Payment Method"] == filters["payment"]
+    return mask
+
+
+def empty_table(table: str) -> pd.DataFrame:
+    """Return an empty DataFrame with the columns of ``table``."""
+    return pd.DataFrame(columns=TABLE_COLUMNS[table])
+
+
+def _conform(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    """Add columns introduced after the data was written (as empty values), drop retired ones."""
+    current = [c for c in df.columns if c in TABLE_COLUMNS[table]]
+    missing = [c for c in TABLE_COLUMNS[table] if c not in df.columns]
+    if missing or len(current) < len(df.columns):
+        df = df.reindex(columns=current + missing)
+    return df
+
+
+def _as_rows(rows) -> list:
+    """Accept either a list of row dicts or a DataFrame."""
+    if isinstance(rows, pd.DataFrame):
+        return rows.to_dict("records")
+    return rows or []
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _clean(value):
+    """Convert pandas/NumPy scalars into plain Python values for sqlite3."""
+    if value is None:
+        return None
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+class ExcelBackend:
+    """All tables stored as sheets of one workbook (the original layout).
+
+    Rewriting an xlsx file costs time proportional to everything in it, so
+    every change (new rows, row updates, stock changes) is first appended to
+    a JSON-lines journal next to the workbook and fsynced; that is the
+    commit.  Reads merge the journal in.  ``compact`` folds the journal into
+    a new workbook written to a temp file, fsynced and renamed over the old
+    one, so a crash leaves either the old or the new workbook, never half of
+    one.  The workbook records which journal it absorbed and how many bytes
+    of it (a ``_meta`` sheet), so a crash between the rename and deleting
+    the journal does not replay it twice, and writes appended to that
+    journal afterwards are still replayed.
+    """
+
+    name = "excel"
+    # Every table lives in the one workbook, so they are locked together
+    lock_aliases = {table: "Workbook" for table in TABLE_COLUMNS}
+
+    def __init__(self, path: str, cache: bool = True):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self._lock = threading.RLock()
+        self.cache = TableCache(path, self.journal_path) if cache else None
+
+    @metrics.timed("storage", backend="excel", op="read_table")
+    def read_table(self, table: str) -> pd.DataFrame:
+        """Return one table as a DataFrame (empty if the sheet is missing)."""
+        if self.cache is None:
+            return self._parse(table)
+        return self.cache.get(table, lambda: self._parse(table))
+
+    @metrics.timed("storage", backend="excel", op="read_all")
+    def read_all(self) -> dict:
+        """Return every table, parsing the workbook only once."""
+        if self.cache is None:
+            return self._parse_all()
+        return self.cache.get_many(list(TABLE_COLUMNS), self._parse_all)
+
+    def _parse(self, table: str) -> pd.DataFrame:
+        return self._parse_all([table])[table]
+
+    def _parse_all(self, tables: list = None) -> dict:
+        tables = tables or list(TABLE_COLUMNS)
+        with self._lock:
+            sheets, folded = self._read_workbook(tables)
+            rows, updates = self._journal_entries(folded)
+            return {
+                t: _with_rows(_conform(sheets.get(t, empty_table(t)), t), t, rows.get(t), updates.get(t))
+                for t in tables
+            }
+
+    @metrics.timed("storage", backend="excel", op="parse_workbook")
+    def _read_workbook(self, tables: list):
+        """Sheets of ``tables`` present in the workbook, and the journal it absorbed.
+
+        The journal is ``(id, bytes)``; bytes is None for workbooks written
+        before it was recorded, which absorbed the whole journal.
+
+        A workbook that exists but cannot be read raises: treating it as
+        empty would silently drop every row on the next compaction.
+        """
+        if not os.path.exists(self.path):
+            return {}, None
+        with pd.ExcelFile(self.path, engine="openpyxl") as xl:
+            sheets = {t: xl.parse(t) for t in tables if t in xl.sheet_names}
+            folded = None
+            if META_SHEET in xl.sheet_names:
+                meta = xl.parse(META_SHEET)
+                if not meta.empty and "journal" in meta.columns:
+                    size = meta["journal_bytes"].iloc[0] if "journal_bytes" in meta.columns else None
+                    folded = (str(meta["journal"].iloc[0]), None if pd.isna(size) else int(size))
+        return sheets, folded
+
+    def _journal_entries(self, folded: tuple = None):
+        """Rows appended and row updates since the last compaction, by table."""
+        rows, updates = {}, {}
+        if not os.path.exists(self.journal_path):
+            return rows, updates
+        with open(self.journal_path, "rb") as f:
+            for line in iter(f.readline, b""):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn last line from an interrupted append
+                    continue
+                if "journal" in entry:
+                    if folded and entry["journal"] == folded[0]:
+                        # Already part of the workbook up to the recorded size;
+                        # the compaction that absorbed it stopped before
+                        # deleting it, and later writes went on appending
+                        if folded[1] is None:
+                            return {}, {}
+                        f.seek(folded[1])
+                elif "row" in entry:
+                    rows.setdefault(entry["table"], []).append(entry["row"])
+                else:
+                    updates.setdefault(entry["table"], []).append(
+                        (entry["key_col"], entry["key"], entry["set"], entry.get("blank"))
+                    )
+        return rows, updates
+
+    def _lookup(self, table: str, key_col: str, key) -> list:
+        """Rows whose ``key_col`` equals ``key``, through the cache's hash index."""
+        if self.cache is None:
+            df = self._parse(table)
+            return df[df[key_col].astype(str) == str(key)].to_dict("records")
+        return self.cache.lookup(table, key_col, key, lambda: self._parse(table))
+
+    @metrics.timed("storage", backend="excel", op="get_stock_item")
+    def get_stock_item(self, reference: str):
+        """Return the Stock row for ``reference`` as a dict, or None."""
+        rows = self._lookup(STOCK_TABLE, "Reference", reference)
+        return rows[0] if rows else None
+
+    @metrics.timed("storage", backend="excel", op="get_invoice")
+    def get_invoice(self, invoice_num):
+        """Return ``(invoice row, line rows)`` for an invoice number, or None."""
+        rows = self._lookup(INVOICES_TABLE, "Invoice Number", invoice_num)
+        if not rows:
+            return None
+        lines = self._lookup(INVOICE_LINES_TABLE, "Invoice Number", invoice_num)
+        return rows[0], sorted(lines, key=lambda line: line["Line"])
+
+    @metrics.timed("storage", backend="excel", op="row_count")
+    def row_count(self, table: str) -> int:
+        return len(self.read_table(table))
+
+    @metrics.timed("storage", backend="excel", op="read_rows")
+    def read_rows(self, table: str, start: int, stop: int = None) -> pd.DataFrame:
+        """Rows ``start`` to ``stop`` (exclusive) of ``table``, in insertion order."""
+        return self.read_table(table).iloc[start:stop].reset_index(drop=True)
+
+    @metrics.timed("storage", backend="excel", op="count_invoices")
+    def count_invoices(self, filters: dict = None) -> int:
+        """Number of invoices matching ``filters``."""
+        invoices = self.read_table(INVOICES_TABLE)
+        return int(_invoice_mask(invoices, filters or {}).sum())
+
+    @metrics.timed("storage", backend="excel", op="iter_invoices")
+    def iter_invoices(self, filters: dict = None, sort: str = "date", descending: bool = True,
+                      after=None, offset: int = 0, limit: int = None):
+        """Matching invoices in order, as an iterator of ``(row, cursor)``.
+
+        ``filters`` may hold ``start``/``end`` days (YYYY-MM-DD, inclusive),
+        an ``owner`` substring and a ``payment`` method; ``sort`` is a key of
+        INVOICE_SORT_COLUMNS.  Pass a row's ``cursor`` as ``after`` to resume
+        right after it.  The rows are selected before this returns; only
+        handing them out is lazy.
+        """
+        invoices = self.read_table(INVOICES_TABLE)
+        col = INVOICE_SORT_COLUMNS[sort]
+        # Position in the table breaks ties, like the id column in SQLite
+        invoices = invoices.assign(_pos=range(len(invoices)))
+        invoices = invoices[_invoice_mask(invoices, filters or {})]
+        if col == "Total Amount":
+            invoices = invoices.assign(_key=pd.to_numeric(invoices[col], errors="coerce"))
+        else:
+            invoices = invoices.assign(_key=invoices[col].astype(str))
+        invoices = invoices.sort_values(["_key", "_pos"], ascending=not descending, kind="stable")
+        if after is not None:
+            key, pos = after
+            if descending:
+                past = (invoices["_key"] < key) | ((invoices["_key"] == key) & (invoices["_pos"] < pos))
+            else:
+                past = (invoices["_key"] > key) | ((invoices["_key"] == key) & (invoices["_pos"] > pos))
+            invoices = invoices[past]
+        invoices = invoices.iloc[offset:offset + limit if limit is not None else None]
+        cols = TABLE_COLUMNS[INVOICES_TABLE]
+        records = invoices[cols + ["_key", "_pos"]].to_dict("records")
+        return (({c: rec[c] for c in cols}, [rec["_key"], rec["_pos"]]) for rec in records)
+
+    @metrics.timed("storage", backend="excel", op="append_rows")
+    def append_rows(self, table: str, rows: list):
+        """Append rows to ``table`` (journaled)."""
+        self.commit(appends={table: rows})
+
+    @metrics.timed("storage", backend="excel", op="update_rows")
+    def update_rows(self, table: str, key_col: str, key, values: dict, blank: str = None):
+        """Set ``values`` on the rows whose ``key_col`` equals ``key`` (journaled).
+
+        With ``blank``, only rows whose ``blank`` column is empty are changed.
+        """
+        with self._lock:
+            self._commit(updates={table: [(key_col, key, values, blank)]})
+
+    @metrics.timed("storage", backend="excel", op="upsert_stock")
+    def upsert_stock(self, row: dict):
+        """Insert or overwrite a Stock row keyed on its Reference."""
+        self.commit(stock_updates=[row])
+
+    @metrics.timed("storage", backend="excel", op="adjust_stock")
+    def adjust_stock(self, reference: str, delta: int, timestamp: str):
+        """Add ``delta`` units to a Stock row; return the updated row or None."""
+        with self._lock:
+            row = self.get_stock_item(reference)
+            if row is None:
+                return None
+            current = 0 if pd.isna(row["Quantity"]) else int(row["Quantity"])
+            values = {"Quantity": current + delta, "Timestamp": timestamp}
+            self._commit(updates={STOCK_TABLE: [("Reference", reference, values)]})
+        return {**row, **values}
+
+    @metrics.timed("storage", backend="excel", op="commit")
+    def commit(self, appends: dict = None, stock_updates: list = None):
+        """Append rows and upsert Stock rows with one journal write.
+
+        Raises DuplicateKeyError, writing nothing, if an appended invoice
+        reuses an existing Invoice Number.
+        """
+        with self._lock:
+            appends = {table: _as_rows(rows) for table, rows in (appends or {}).items()}
+            self._check_unique(appends.get(INVOICES_TABLE), INVOICES_TABLE, "Invoice Number")
+            updates = {}
+            added = set()
+            for row in stock_updates or []:
+                ref = str(row.get("Reference", "") or "").strip()
+                if ref and (ref in added or self._lookup(STOCK_TABLE, "Reference", ref)):
+                    values = {c: v for c, v in row.items() if c != "Reference" and c in TABLE_COLUMNS[STOCK_TABLE]}
+                    updates.setdefault(STOCK_TABLE, []).append(("Reference", ref, values))
+                else:
+                    appends.setdefault(STOCK_TABLE, []).append(row)
+                    added.add(ref)
+            self._commit(appends, updates)
+
+    def _check_unique(self, rows: list, table: str, key_col: str):
+        seen = set()
+        for row in rows or []:
+            key = str(row.get(key_col))
+            if key in seen or self._lookup(table, key_col, key):
+                raise DuplicateKeyError(f"{table} already has {key_col} {key}")
+            seen.add(key)
+
+    @metrics.timed("storage", backend="excel", op="replace_all")
+    def replace_all(self, tables: dict):
+        """Overwrite the workbook with the given tables."""
+        with self._lock:
+            self._write_all({t: tables.get(t, empty_table(t)) for t in TABLE_COLUMNS})
+
+    @metrics.timed("storage", backend="excel", op="compact")
+    def compact(self):
+        """Fold the journal into the workbook."""
+        with self._lock:
+            if os.path.exists(self.journal_path):
+                self._write_all(self.read_all())
+
+    def pending(self) -> int:
+        """Size in bytes of the journal not yet folded into the workbook."""
+        try:
+            return os.path.getsize(self.journal_path)
+        except OSError:
+            return 0
+
+    def reset(self, stock_df: pd.DataFrame):
+        """Start over with empty Animals/Invoices and the given Stock."""
+        self.replace_all({STOCK_TABLE: stock_df.reindex(columns=TABLE_COLUMNS[STOCK_TABLE])})
+
+    @metrics.timed("storage", backend="excel", op="export_excel")
+    def export_excel(self, path: str):
+        """Copy the workbook to ``path`` (only compacts when it is the same file)."""
+        with self._lock:
+            if not os.path.exists(self.path) or os.path.exists(self.journal_path):
+                self._write_all(self.read_all())
+            if os.path.abspath(path) != os.path.abspath(self.path):
+                shutil.copyfile(self.path, path)
+
+    def _commit(self, appends: dict = None, updates: dict = None):
+        """Append rows and row updates to the journal and fsync it.
+
+        Every change goes through here; once it returns the change is
+        durable.  The workbook itself is only rewritten by ``_write_all``.
+        """
+        lines, appended = [], {}
+        for table, rows in (appends or {}).items():
+            if not rows:
+                continue
+            cols = TABLE_COLUMNS[table]
+            clean_rows = [{c: _clean(row.get(c)) for c in cols} for row in rows]
+            lines.extend(json.dumps({"table": table, "row": row}) for row in clean_rows)
+            appended[table] = pd.DataFrame(clean_rows, columns=cols)
+        updated = {}
+        for table, changes in (updates or {}).items():
+            for key_col, key, values, *blank in changes:
+                values = {c: _clean(v) for c, v in values.items()}
+                entry = {"table": table, "key_col": key_col, "key": _clean(key), "set": values}
+                if blank and blank[0] is not None:
+                    entry["blank"] = blank[0]
+                lines.append(json.dumps(entry))
+                updated.setdefault(table, []).append((key_col, key, values, *blank))
+        if not lines:
+            return
+        before = self.cache.begin_write() if self.cache else None
+        if not os.path.exists(self.journal_path):
+            # A fresh journal starts with its id; compaction records it in the workbook
+            lines.insert(0, json.dumps({"journal": uuid.uuid4().hex}))
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+        if self.cache:
+            self.cache.finish_write(before, appended=appended, updated=updated)
+
+    def _journal_id(self):
+        if not os.path.exists(self.journal_path):
+            return None
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            try:
+                return json.loads(f.readline()).get("journal")
+            except ValueError:
+                return None
+
+    @metrics.timed("storage", backend="excel", op="write_workbook")
+    def _write_all(self, tables: dict):
+        """Write a complete workbook atomically: temp file, fsync, rename."""
+        before = self.cache.begin_write() if self.cache else None
+        # Every journaled row is part of ``tables``; remember which journal that was
+        journal_id, journal_bytes = self._journal_id(), self.pending()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                with pd.ExcelWriter(f, engine="openpyxl") as writer:
+                    for table, df in tables.items():
+                        df.to_excel(writer, sheet_name=table, index=False)
+                    pd.DataFrame({"journal": [journal_id or ""], "journal_bytes": [journal_bytes]}).to_excel(
+                        writer, sheet_name=META_SHEET, index=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        _fsync_dir(directory)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        if self.cache:
+            # Write-through: the frames we just wrote are the new cache content
+            self.cache.finish_write(before, replaced=tables)
+
+
+def _fsync_dir(directory: str):
+    """Make a rename in ``directory`` durable (a no-op where unsupported)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _with_rows(df: pd.DataFrame, table: str, rows: list, updates: list = None) -> pd.DataFrame:
+    """Replay journaled appends and updates on top of a parsed sheet."""
+    if rows:
+        new_df = pd.DataFrame(rows, columns=TABLE_COLUMNS[table])
+        df = new_df if df.empty else pd.concat([df, new_df], ignore_index=True)
+    for key_col, key, values, *blank in updates or []:
+        apply_row_update(df, key_col, key, values, *blank)
+    return df
+
+
+class SQLiteBackend:
+    """Indexed SQLite tables (WAL mode) with row-level inserts and updates."""
+
+    name = "sqlite"
+    # Tables are locked separately; SQLite keeps each write transaction atomic
+    lock_aliases = {}
+
+    def __init__(self, path: str, seed_excel: str = None):
+        self.path = path
+        self._local = threading.local()
+        # Commits land in the -wal file first, so watch both
+        self.cache = TableCache(path, path + "-wal")
+        fresh = not os.path.exists(path)
+        self._create_schema()
+        if fresh and seed_excel and os.path.exists(seed_excel):
+            # First start after switching backends: import the old workbook
+            self._seed(ExcelBackend(seed_excel, cache=False).read_all())
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, and never reuse one across a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _create_schema(self):
+        conn = self._connect()
+        with conn:
+            for table, columns in TABLE_COLUMNS.items():
+                col_defs = []
+                for col in columns:
+                    col_type = COLUMN_TYPES.get(col, "TEXT")
+                    if table == STOCK_TABLE and col == "Reference":
+                        col_type += " UNIQUE"
+                    col_defs.append(f"{_quote(col)} {col_type}")
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {_quote(table)} "
+                    f"(id INTEGER PRIMARY KEY, {', '.join(col_defs)})"
+                )
+                # Columns added after the database was created
+                existing = {r[1] for r in conn.execute(f"PRAGMA table_info({_quote(table)})")}
+                for col in columns:
+                    if col not in existing:
+                        conn.execute(
+                            f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(col)} {COLUMN_TYPES.get(col, 'TEXT')}"
+                        )
+            for index_name, table, col in INDEXES:
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {index_name} ON {_quote(table)} ({_quote(col)})"
+                )
+        for index_name, table, col in UNIQUE_INDEXES:
+            try:
+                with conn:
+                    conn.execute(
+                        f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {_quote(table)} ({_quote(col)})"
+                    )
+            except sqlite3.IntegrityError:
+                # Older data already has duplicates; index without enforcing
+                logger.warning("%s.%s has duplicate values; not enforcing uniqueness", table, col)
+                with conn:
+                    conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS {index_name}_dup ON {_quote(table)} ({_quote(col)})"
+                    )
+
+    @metrics.timed("storage", backend="sqlite", op="read_table")
+    def read_table(self, table: str) -> pd.DataFrame:
+        """Return one table as a DataFrame, in insertion order."""
+        return self.cache.get(table, lambda: self._query(table))
+
+    def _query(self, table: str) -> pd.DataFrame:
+        cols = ", ".join(_quote(c) for c in TABLE_COLUMNS[table])
+        return pd.read_sql_query(
+            f"SELECT {cols} FROM {_quote(table)} ORDER BY id", self._connect()
+        )
+
+    @metrics.timed("storage", backend="sqlite", op="read_all")
+    def read_all(self) -> dict:
+        return self.cache.get_many(
+            list(TABLE_COLUMNS), lambda: {t: self._query(t) for t in TABLE_COLUMNS}
+        )
+
+    @metrics.timed("storage", backend="sqlite", op="get_stock_item")
+    def get_stock_item(self, reference: str):
+        """Return the Stock row for ``reference`` as a dict, or None."""
+        # The cache's hash index when Stock is cached, else the UNIQUE index
+        rows = self.cache.lookup(STOCK_TABLE, "Reference", reference)
+        if rows is not None:
+            return rows[0] if rows else None
+        cols = TABLE_COLUMNS[STOCK_TABLE]
+        row = self._connect().execute(
+            f"SELECT {', '.join(_quote(c) for c in cols)} FROM Stock WHERE \"Reference\" = ?",
+            (reference,),
+        ).fetchone()
+        return dict(zip(cols, row)) if row else None
+
+    @metrics.timed("storage", backend="sqlite", op="get_invoice")
+    def get_invoice(self, invoice_num):
+        """Return ``(invoice row, line rows)`` for an invoice number, or None."""
+        rows = self.cache.lookup(INVOICES_TABLE, "Invoice Number", invoice_num)
+        lines = self.cache.lookup(INVOICE_LINES_TABLE, "Invoice Number", invoice_num)
+        if rows is not None and lines is not None:
+            if not rows:
+                return None
+            return rows[0], sorted(lines, key=lambda line: line["Line"])
+        conn = self._connect()
+        cols = TABLE_COLUMNS[INVOICES_TABLE]
+        row = conn.execute(
+            f"SELECT {', '.join(_quote(c) for c in cols)} FROM Invoices "
+            'WHERE "Invoice Number" = ? ORDER BY id LIMIT 1',
+            (str(invoice_num),),
+        ).fetchone()
+        if row is None:
+            return None
+        line_cols = TABLE_COLUMNS[INVOICE_LINES_TABLE]
+        lines = conn.execute(
+            f"SELECT {', '.join(_quote(c) for c in line_cols)} FROM InvoiceLines "
+            'WHERE "Invoice Number" = ? ORDER BY "Line"',
+            (str(invoice_num),),
+        ).fetchall()
+        return dict(zip(cols, row)), [dict(zip(line_cols, line)) for line in lines]
+
+
+    @metrics.timed("storage", backend="sqlite", op="row_count")
+    def row_count(self, table: str) -> int:
+        return self._connect().execute(f"SELECT COUNT(*) FROM {_quote(table)}").fetchone()[0]
+
+    @metrics.timed("storage", backend="sqlite", op="read_rows")
+    def read_rows(self, table: str, start: int, stop: int = None) -> pd.DataFrame:
+        """Rows ``start`` to ``stop`` (exclusive) of ``table``, in insertion order, without reading the rest."""
+        cols = ", ".join(_quote(c) for c in TABLE_COLUMNS[table])
+        limit = -1 if stop is None else max(0, stop - start)
+        return pd.read_sql_query(
+            f"SELECT {cols} FROM {_quote(table)} ORDER BY id LIMIT ? OFFSET ?", self._connect(), params=(limit, start)
+        )
+
+    @metrics.timed("storage", backend="sqlite", op="count_invoices")
+    def count_invoices(self, filters: dict = None) -> int:
+        """Number of invoices matching ``filters``."""
+        where, params = _invoice_where(filters or {})
+        sql = "SELECT COUNT(*) FROM Invoices" + (f" WHERE {' AND '.join(where)}" if where else "")
+        return self._connect().execute(sql, params).fetchone()[0]
+
+    @metrics.timed("storage", backend="sqlite", op="iter_invoices")
+    def iter_invoices(self, filters: dict = None, sort: str = "date", descending: bool = True,
+                      after=None, offset: int = 0, limit: int = None, batch_size: int = 500):
+        """Matching invoices in order, as an iterator of ``(row, cursor)``.
+
+        Same arguments as ``ExcelBackend.iter_invoices``.  The query runs
+        before this returns; rows are then fetched ``batch_size`` at a time
+        as the iterator is consumed.
+        """
+        col = _quote(INVOICE_SORT_COLUMNS[sort])
+        where, params = _invoice_where(filters or {})
+        if after is not None:
+            where.append(f"({col}, id) {'<' if descending else '>'} (?, ?)")
+            params += list(after)
+        direction = "DESC" if descending else "ASC"
+        cols = TABLE_COLUMNS[INVOICES_TABLE]
+        sql = (
+            f"SELECT id, {', '.join(_quote(c) for c in cols)} FROM Invoices"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + f" ORDER BY {col} {direction}, id {direction} LIMIT ? OFFSET ?"
+        )
+        params += [-1 if limit is None else limit, offset]
+        cursor = self._connect().execute(sql, params)
+        sort_index = cols.index(INVOICE_SORT_COLUMNS[sort]) + 1
+        return _fetch_invoices(cursor, cols, sort_index, batch_size)
+
+    @metrics.timed("storage", backend="sqlite", op="append_rows")
+    def append_rows(self, table: str, rows: list):
+        """Insert rows into ``table``."""
+        self.commit(appends={table: rows})
+
+    @metrics.timed("storage", backend="sqlite", op="upsert_stock")
+    def upsert_stock(self, row: dict):
+        """Insert or overwrite a Stock row keyed on its Reference."""
+        self.commit(stock_updates=[row])
+
+    @metrics.timed("storage", backend="sqlite", op="update_rows")
+    def update_rows(self, table: str, key_col: str, key, values: dict, blank: str = None):
+        """Set ``values`` on the rows whose ``key_col`` equals ``key``.
+
+        With ``blank``, only rows whose ``blank`` column is empty are changed.
+        """
+        values = {c: _clean(v) for c, v in values.items()}
+        assignments = ", ".join(f"{_quote(c)} = ?" for c in values)
+        where = f"{_quote(key_col)} = ?"
+        if blank is not None:
+            where += f" AND TRIM(COALESCE({_quote(blank)}, '')) = ''"
+        conn = self._connect()
+        before = self.cache.begin_write()
+        with conn:
+            conn.execute(
+                f"UPDATE {_quote(table)} SET {assignments} WHERE {where}",
+                [*values.values(), _row_value(table, {key_col: key}, key_col)],
+            )
+        self.cache.finish_write(before, updated={table: [(key_col, key, values, blank)]})
+
+    @metrics.timed("storage", backend="sqlite", op="adjust_stock")
+    def adjust_stock(self, reference: str, delta: int, timestamp: str):
+        """Add ``delta`` units to a Stock row; return the updated row or None."""
+        conn = self._connect()
+        before = self.cache.begin_write()
+        with conn:
+            row = conn.execute(
+                'UPDATE Stock SET "Quantity" = COALESCE("Quantity", 0) + ?, "Timestamp" = ? '
+                'WHERE "Reference" = ? RETURNING "Quantity"',
+                (int(delta), timestamp, reference),
+            ).fetchone()
+        if row is None:
+            self.cache.finish_write(before)
+            return None
+        values = {"Quantity": row[0], "Timestamp": timestamp}
+        self.cache.finish_write(before, updated={STOCK_TABLE: [("Reference", reference, values)]})
+        return self.get_stock_item(reference)
+
+    @metrics.timed("storage", backend="sqlite", op="commit")
+    def commit(self, appends: dict = None, stock_updates: list = None):
+        """Insert rows and upsert Stock rows in one transaction."""
+        conn = self._connect()
+        before = self.cache.begin_write()
+        appended = {}
+        updated, new_stock = [], []
+        try:
+            with conn:
+                for table, rows in (appends or {}).items():
+                    appended[table] = self._insert(conn, table, rows)
+                for row in stock_updates or []:
+                    change = self._upsert_stock(conn, row)
+                    if isinstance(change, tuple):
+                        updated.append(change)
+                    else:
+                        new_stock.append(change)
+        except sqlite3.IntegrityError as e:
+            # The whole transaction was rolled back
+            raise DuplicateKeyError(str(e)) from e
+        if new_stock:
+            frames = [df for df in (appended.get(STOCK_TABLE), pd.DataFrame(new_stock)) if df is not None]
+            appended[STOCK_TABLE] = pd.concat(frames, ignore_index=True)
+        # Write-through, so the cache's Reference index stays valid
+        self.cache.finish_write(before, appended=appended, updated={STOCK_TABLE: updated} if updated else None)
+
+    @metrics.timed("storage", backend="sqlite", op="replace_all")
+    def replace_all(self, tables: dict):
+        """Replace the content of every table."""
+        conn = self._connect()
+        before = self.cache.begin_write()
+        with conn:
+            for table in TABLE_COLUMNS:
+                conn.execute(f"DELETE FROM {_quote(table)}")
+                df = tables.get(table)
+                if df is not None and not df.empty:
+                    self._insert(conn, table, df.to_dict("records"))
+        self.cache.finish_write(before, dropped=list(TABLE_COLUMNS))
+
+    import_tables = replace_all
+
+    def _seed(self, tables: dict):
+        """Import ``tables`` unless the database already has rows.
+
+        Several workers starting on a new store may all see it as fresh; the
+        first to take the write lock imports, the others find rows and skip,
+        so none of them wipes what an earlier one has already written.
+        """
+        conn = self._connect()
+        before = self.cache.begin_write()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if any(conn.execute(f"SELECT 1 FROM {_quote(t)} LIMIT 1").fetchone() for t in TABLE_COLUMNS):
+                return
+            for table, df in tables.items():
+                if df is not None and not df.empty:
+                    self._insert(conn, table, df.to_dict("records"))
+        self.cache.finish_write(before, dropped=list(TABLE_COLUMNS))
+
+    def reset(self, stock_df: pd.DataFrame):
+        """Start over with empty Animals/Invoices and the given Stock."""
+        self.replace_all({STOCK_TABLE: stock_df})
+
+    @metrics.timed("storage", backend="sqlite", op="compact")
+    def compact(self):
+        """Checkpoint the WAL back into the main database file."""
+        before = self.cache.begin_write()
+        self._connect().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.cache.finish_write(before)
+
+    def pending(self) -> int:
+        """Size in bytes of the WAL not yet checkpointed."""
+        try:
+            return os.path.getsize(self.path + "-wal")
+        except OSError:
+            return 0
+
+    @metrics.timed("storage", backend="sqlite", op="export_excel")
+    def export_excel(self, path: str):
+        """Write every table to a workbook at ``path``."""
+        ExcelBackend(path, cache=False).replace_all(self.read_all())
+
+    def _insert(self, conn, table: str, rows: list):
+        """Insert rows; return them as a DataFrame for the cache."""
+        rows = _as_rows(rows)
+        if not rows:
+            return None
+        cols = TABLE_COLUMNS[table]
+        placeholders = ", ".join("?" for _ in cols)
+        values = [tuple(_row_value(table, row, c) for c in cols) for row in rows]
+        conn.executemany(
+            f"INSERT INTO {_quote(table)} ({', '.join(_quote(c) for c in cols)}) VALUES ({placeholders})",
+            values,
+        )
+        return pd.DataFrame(values, columns=cols)
+
+    def _upsert_stock(self, conn, row: dict):
+        """Insert or update one Stock row.
+
+        Returns the cache change: ``(key_col, key, values)`` for an update,
+        or the full new row (a dict) for an insert.
+        """
+        cols = [c for c in TABLE_COLUMNS[STOCK_TABLE] if c in row]
+        values = [_row_value(STOCK_TABLE, row, c) for c in cols]
+        ref = _row_value(STOCK_TABLE, row, "Reference")
+        exists = ref is not None and conn.execute(
+            'SELECT 1 FROM Stock WHERE "Reference" = ?', (ref,)
+        ).fetchone() is not None
+        updates = ", ".join(f"{_quote(c)} = excluded.{_quote(c)}" for c in cols if c != "Reference")
+        sql = (
+            f"INSERT INTO Stock ({', '.join(_quote(c) for c in cols)}) "
+            f"VALUES ({', '.join('?' for _ in cols)})"
+        )
+        if "Reference" in cols and updates:
+            sql += f' ON CONFLICT("Reference") DO UPDATE SET {updates}'
+        conn.execute(sql, values)
+        if exists:
+            return ("Reference", ref, {c: v for c, v in zip(cols, values) if c != "Reference"})
+        return {c: _row_value(STOCK_TABLE, row, c) for c in TABLE_COLUMNS[STOCK_TABLE]}
+
+
+def _invoice_where(filters: dict):
+    """SQL conditions and parameters for invoice ``filters``."""
+    where, params = [], []
+    if filters.get("start"):
+        where.append('"Timestamp" >= ?')
+        params.append(filters["start"])
+    if filters.get("end"):
+        where.append('"Timestamp" < ?')
+        params.append(_next_day(filters["end"]))
+    if filters.get("owner"):
+        where.append("\"Owner Name\" LIKE ? ESCAPE '\\'")
+        escaped = filters["owner"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.append(f"%{escaped}%")
+    if filters.get("payment"):
+        where.append('"Payment Method" = ?')
+        params.append(filters["payment"])
+    return where, params
+
+
+def _fetch_invoices(cursor, cols: list, sort_index: int, batch_size: int):
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        for rec in batch:
+            yield dict(zip(cols, rec[1:])), [rec[sort_index], rec[0]]
+
+
+def _row_value(table: str, row: dict, col: str):
+    value = _clean(row.get(col))
+    if col == "Reference" and isinstance(value, str):
+        # Empty references become NULL so they don't collide on the UNIQUE index
+        value = value.strip() or None
+    elif col == "Invoice Number" and value is not None:
+        value = str(value)
+    return value
+
+
+class BackgroundCompactor:
+    """Compacts a backend every ``interval`` seconds from a daemon thread.
+
+    Writes are durable once journaled (or in the WAL); folding them into the
+    main file is the slow part and runs here, off the request path.  ``lock``
+    returns a context manager held while compacting.
+    """
+
+    def __init__(self, storage, interval: float = COMPACT_INTERVAL, lock=None):
+        self.storage = storage
+        self.interval = interval
+        self.lock = lock
+        self.runs = 0
+        self._pid = None
+        self._guard = threading.Lock()
+
+    def start(self):
+        """Start the thread, once per process (it does not survive a fork)."""
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._guard:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="storage-compactor", daemon=True).start()
+
+    def run_once(self) -> bool:
+        """Compact if anything is pending; return whether it did."""
+        if not self.storage.pending():
+            return False
+        with self.lock() if self.lock else contextlib.nullcontext():
+            self.storage.compact()
+        self.runs += 1
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception:
+                # The journal is still intact; try again next time
+                logger.exception("Background compaction of %s failed", self.storage.path)
+
+
+def open_storage(backend: str = None, sqlite_path: str = "clinic.db", excel_path: str = "animals.xlsx"):
+    """Open the backend named by ``backend`` or the CLINIC_STORAGE env var.
+
+    ``sqlite`` (the default) imports ``excel_path`` the first time the
+    database is created, so existing workbooks carry over.
+    """
+    backend = (backend or os.environ.get("CLINIC_STORAGE", "sqlite")).lower()
+    if backend == "excel":
+        return ExcelBackend(excel_path)
+    if backend == "sqlite":
+        return SQLiteBackend(sqlite_path, seed_excel=excel_path)
+    raise ValueError(f"Unknown storage backend: {backend!r}")
@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import ExcelBackend, SQLiteBackend  # noqa: E402
+from transactions import TransactionManager  # noqa: E402
+
+
+def stock_row(reference="VAC001", quantity=10, price=25.0):
+    return {"Timestamp": "2024-01-01 00:00:00", "Reference": reference, "Name": f"Item {reference}",
+            "Quantity": quantity, "Price": price, "Type": "Vaccine"}
+
+
+def invoice_row(number):
+    return {"Timestamp": "2024-01-01 00:00:00", "Invoice Number": number, "Owner Name": "Mary Johnson",
+            "Items": "Rabies Vaccine (x1)", "Total Amount": 50.0, "Payment Method": "Card", "PDF Path": ""}
+
+
+def line_row(number):
+    return {"Invoice Number": number, "Line": 1, "Name": "Rabies Vaccine", "Quantity": 1,
+            "Unit Price": 50.0, "Total": 50.0, "Reference": "VAC001"}
+
+
+def invoice_numbers(storage):
+    return sorted(storage.read_table("Invoices")["Invoice Number"].astype(str))
+
+
+def open_backend(kind, directory):
+    if kind == "excel":
+        return ExcelBackend(os.path.join(str(directory), "animals.xlsx"))
+    return SQLiteBackend(os.path.join(str(directory), "clinic.db"))
+
+
+@pytest.fixture(params=["excel", "sqlite"])
+def storage(request, tmp_path):
+    backend = open_backend(request.param, tmp_path)
+    backend.commit(stock_updates=[stock_row()])
+    return backend
+
+
+class StateFile:
+    """simulation_state.json as the app keeps it, without the app."""
+
+    def __init__(self, path):
+        self.path = path
+        self.save({"budget": 1000.0, "current_day": 1, "version": 0})
+
+    def load(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, state):
+        with open(self.path, "w") as f:
+            json.dump(state, f)
+
+
+@pytest.fixture
+def state_file(tmp_path):
+    return StateFile(str(tmp_path / "simulation_state.json"))
+
+
+@pytest.fixture
+def manager(storage, state_file):
+    lock = threading.RLock()
+    return TransactionManager(storage, state_file.path, state_file.load, state_file.save, lambda tables: lock)
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """The app, imported once and run in a store of its own (it uses relative paths)."""
+    os.environ.setdefault("PDF_WORKERS", "0")
+    os.environ.setdefault("SIM_WORKERS", "0")
+    os.environ.setdefault("CLINIC_STORAGE", "sqlite")
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("store"))
+    try:
+        import app
+        yield app
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def client(app_module):
+    """A test client on a freshly reset store."""
+    client = app_module.app.test_client()
+    client.post("/simulation/reset")
+    return client
@@ -0,0 +1,52 @@
+import pytest
+
+from aggregates import DashboardAggregates
+from conftest import invoice_row, open_backend, stock_row
+
+
+def no_rebuild():
+    raise AssertionError("aggregates rebuilt")
+
+
+@pytest.mark.parametrize("kind", ["excel", "sqlite"])
+def test_compaction_keeps_the_aggregates(kind, tmp_path, monkeypatch):
+    storage = open_backend(kind, tmp_path)
+    aggregates = DashboardAggregates(str(tmp_path / "aggregates.json"), storage)
+    before = aggregates.begin_write()
+    storage.commit(appends={"Invoices": [invoice_row("INV-1")]}, stock_updates=[stock_row()])
+    aggregates.record(before, appends={"Invoices": [invoice_row("INV-1")]}, stock_rows=[stock_row()])
+    version = aggregates.version()
+
+    before = aggregates.begin_write()
+    storage.compact()
+    aggregates.restamp(before)
+
+    monkeypatch.setattr(aggregates, "_rebuild", no_rebuild)
+    assert aggregates.version() == version
+    assert aggregates.snapshot()["total_invoices"] == 1
+    # A fresh reader of the file agrees
+    assert DashboardAggregates(aggregates.path, storage).version() == version
+
+
+def test_write_behind_the_aggregates_back_is_still_rebuilt(tmp_path):
+    storage = open_backend("sqlite", tmp_path)
+    aggregates = DashboardAggregates(str(tmp_path / "aggregates.json"), storage)
+    version = aggregates.version()
+
+    storage.commit(appends={"Invoices": [invoice_row("INV-1")]})
+
+    assert aggregates.snapshot()["total_invoices"] == 1
+    assert aggregates.version() != version
+
+
+def test_background_compaction_keeps_the_dashboard_etag(client, app_module, monkeypatch):
+    client.post("/simulation/advance?days=5")
+    etag = client.get("/api/dashboard-data").headers["ETag"]
+    assert app_module.storage.pending()
+
+    assert app_module.compactor.run_once()
+
+    monkeypatch.setattr(app_module.aggregates, "_rebuild", no_rebuild)
+    assert client.get("/api/dashboard-data", headers={"If-None-Match": etag}).status_code == 304
+    client.post("/simulation/next-day")
+    assert client.get("/api/dashboard-data", headers={"If-None-Match": etag}).status_code == 200
@@ -0,0 +1,169 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from forecast import (
+    MIN_ORDER_QTY, ORDER_COST, REVIEW_DAYS, SAFETY_DAYS,
+    economic_order_quantity, fit_to_budget, order_plan, rates_from_history, recommend_orders, smooth,
+)
+from sales_analysis import daily_units
+from stock_analysis import analyze_stock
+
+HOLDING = 0.01
+
+
+def stock(rows):
+    return pd.DataFrame(rows, columns=["Timestamp", "Reference", "Name", "Quantity", "Price", "Type"])
+
+
+def test_eoq_formula():
+    assert economic_order_quantity(2.0, ORDER_COST, HOLDING) == pytest.approx(math.sqrt(2 * 2.0 * ORDER_COST / HOLDING))
+    assert economic_order_quantity(0.0, ORDER_COST, HOLDING) == 0
+
+
+def test_zero_usage_in_stock_needs_nothing():
+    plan = order_plan(np.array([5]), np.array([10.0]), np.array([0.0]), HOLDING)
+    assert not plan["needs"][0]
+    assert plan["cover"][0] == np.inf
+    assert plan["urgency"][0] == "OK"
+
+
+@pytest.mark.parametrize("qty", [0, -3])
+def test_out_of_stock_with_no_usage_is_ordered(qty):
+    plan = order_plan(np.array([qty]), np.array([10.0]), np.array([0.0]), HOLDING)
+    assert plan["needs"][0]
+    assert plan["cover"][0] == 0
+    assert plan["wanted"][0] == MIN_ORDER_QTY
+    assert plan["urgency"][0] == "CRITICAL"
+
+
+def test_out_of_stock_with_usage_wants_at_least_the_eoq():
+    plan = order_plan(np.array([0]), np.array([10.0]), np.array([4.0]), HOLDING)
+    eoq = economic_order_quantity(4.0, ORDER_COST, HOLDING)
+    assert plan["wanted"][0] == math.ceil(max(eoq, 4.0 * (REVIEW_DAYS + SAFETY_DAYS)))
+    assert plan["urgency"][0] == "CRITICAL"
+
+
+def test_short_cover_is_reordered_by_urgency():
+    qty = np.array([2, 10, 100])
+    rate = np.array([1.0, 2.0, 1.0])
+    plan = order_plan(qty, np.full(3, 5.0), rate, HOLDING)
+    np.testing.assert_allclose(plan["cover"], [2.0, 5.0, 100.0])
+    assert list(plan["needs"]) == [True, True, False]
+    assert list(plan["urgency"]) == ["HIGH", "MEDIUM", "OK"]
+    # Enough to cover the review period plus the safety stock, if more than the EOQ
+    big = order_plan(np.array([1]), np.array([5.0]), np.array([1000.0]), HOLDING, order_cost=0.0)
+    assert big["wanted"][0] == 1000 * (REVIEW_DAYS + SAFETY_DAYS) - 1
+
+
+def test_fit_to_budget_cuts_later_items_first():
+    wanted = np.array([10, 10, 10])
+    price = np.array([5.0, 3.0, 2.0])
+    np.testing.assert_array_equal(fit_to_budget(wanted, price, 1000.0), wanted)
+    np.testing.assert_array_equal(fit_to_budget(wanted, price, 65.0), [10, 5, 0])
+    np.testing.assert_array_equal(fit_to_budget(wanted, price, -10.0), [0, 0, 0])
+    # Free items are never cut
+    np.testing.assert_array_equal(fit_to_budget(np.array([4, 7]), np.array([5.0, 0.0]), 0.0), [0, 7])
+    # One budget per row
+    np.testing.assert_array_equal(fit_to_budget(np.tile(wanted, (2, 1)), price, np.array([1000.0, 50.0])),
+                                  [[10, 10, 10], [10, 0, 0]])
+
+
+def catalog():
+    return stock([
+        ["t", "VAC001", "Rabies", 0, 25.0, "Vaccine"],      # out, no usage
+        ["t", "VAC002", "Distemper", 3, 30.0, "Vaccine"],   # 1.5 days of cover
+        ["t", "MED001", "Antibiotic", 12, 15.0, "Medicine"],  # 4 days
+        ["t", "ACC001", "Syringe", 60, 0.5, "Accessory"],   # plenty
+        ["t", "ACC002", "Bandages", 8, 2.0, "Accessory"],   # in stock, no usage
+    ])
+
+
+RATES = {"VAC002": 2.0, "MED001": 3.0, "ACC001": 1.0}
+
+
+def test_recommendations_most_urgent_first():
+    recs = recommend_orders(catalog(), RATES, budget=100000.0, holding_cost=HOLDING)
+    assert list(recs["reference"]) == ["VAC001", "VAC002", "MED001"]
+    assert list(recs["urgency"]) == ["CRITICAL", "HIGH", "MEDIUM"]
+    assert recs.loc[0, "recommended_qty"] == MIN_ORDER_QTY
+    assert not recs["budget_limited"].any()
+    np.testing.assert_allclose(recs["total_cost"], recs["recommended_qty"] * recs["unit_price"])
+
+
+def test_recommendations_within_a_small_budget():
+    full = recommend_orders(catalog(), RATES, budget=100000.0, holding_cost=HOLDING)
+    recs = recommend_orders(catalog(), RATES, budget=400.0, holding_cost=HOLDING)
+    assert recs["total_cost"].sum() <= 400.0
+    # The out-of-stock item is bought in full, the rest cut in order
+    assert recs.loc[0, "recommended_qty"] == full.loc[0, "recommended_qty"]
+    assert list(recs["budget_limited"]) == [False, True, True]
+    assert recs.loc[2, "recommended_qty"] == 0
+
+
+def test_recommendations_with_no_usage_at_all():
+    recs = recommend_orders(catalog(), {}, budget=1000.0, holding_cost=HOLDING)
+    assert list(recs["reference"]) == ["VAC001"]
+
+
+def test_smoothing_ignores_days_out_of_stock():
+    rates = smooth(np.array([1.0, 1.0]), np.array([3, 0]), np.array([True, False]))
+    np.testing.assert_allclose(rates, [0.3 * 3 + 0.7 * 1.0, 1.0])
+
+
+def test_rates_from_history():
+    assert rates_from_history(pd.DataFrame()) == {}
+    daily = pd.DataFrame({"VAC001": [2, 0, 4]}, index=pd.date_range("2024-01-01", periods=3))
+    expected = 2.0
+    for used in (0, 4):
+        expected = 0.3 * used + 0.7 * expected
+    assert rates_from_history(daily)["VAC001"] == pytest.approx(expected)
+
+
+def test_daily_units_fills_missing_days_and_skips_services():
+    invoices = pd.DataFrame({"Invoice Number": ["A", "B"], "Timestamp": ["2024-01-01 09:00:00", "2024-01-03 09:00:00"]})
+    lines = pd.DataFrame({
+        "Invoice Number": ["A", "A", "B"], "Line": [1, 2, 1], "Name": ["Consultation Fee", "Rabies", "Rabies"],
+        "Quantity": [1, 2, 1], "Unit Price": [50.0, 50.0, 50.0], "Total": [50.0, 100.0, 50.0],
+        "Reference": [None, "VAC001", "VAC001"],
+    })
+    daily = daily_units(lines, invoices)
+    assert list(daily.columns) == ["VAC001"]
+    assert list(daily["VAC001"]) == [2, 0, 1]
+
+
+def test_analyze_stock_tiers():
+    result = analyze_stock(stock([
+        ["t", "A", "a", 0, 1.0, "Vaccine"],
+        ["t", "B", "b", 4, 1.0, "Vaccine"],
+        ["t", "C", "c", 9, 1.0, "Vaccine"],
+        ["t", "D", "d", 10, 1.0, "Vaccine"],
+        ["t", "E", "e", None, None, "Vaccine"],
+    ]))
+    assert list(result["urgency"]) == ["CRITICAL", "HIGH", "MEDIUM", "OK", "CRITICAL"]
+    assert list(result["quantity"]) == [0, 4, 9, 10, 0]
+
+
+def test_consumption_rates_from_state_or_history(client, app_module):
+    client.post("/simulation/advance?days=20")
+    state = app_module.get_simulation_state()
+    assert app_module.consumption_rates(state) == state["consumption"]["rates"]
+
+    del state["consumption"]
+    storage = app_module.storage
+    seeded = app_module.consumption_rates(state)
+    history = rates_from_history(daily_units(storage.read_table("InvoiceLines"), storage.read_table("Invoices")))
+    assert seeded == history
+    assert seeded and all(rate >= 0 for rate in seeded.values())
+
+
+def test_dss_recommends_out_of_stock_items(client, app_module):
+    storage = app_module.storage
+    with app_module.locks.write("Stock", app_module.AGGREGATES_LOCK):
+        storage.adjust_stock("VAC003", -int(storage.get_stock_item("VAC003")["Quantity"]), "2024-01-01 00:00:00")
+    recs = app_module.get_dss_recommendations()
+    vac003 = [r for r in recs if r["reference"] == "VAC003"]
+    assert vac003 and vac003[0]["urgency"] == "CRITICAL" and vac003[0]["recommended_qty"] >= MIN_ORDER_QTY
+    assert sum(r["total_cost"] for r in recs) <= app_module.get_simulation_state()["budget"]
@@ -0,0 +1,158 @@
+import json
+
+import pytest
+
+OWNERS = ["Mary Johnson", "Mike Brown", "Ann 50%_Off"]
+PAYMENTS = ["Cash", "Card"]
+
+
+def sample_invoices(n=12):
+    return [{
+        "Timestamp": f"2024-01-{1 + i // 3:02d} 10:{i:02d}:00",
+        "Invoice Number": f"INV-{i:03d}",
+        "Owner Name": OWNERS[i % 3],
+        "Items": "Consultation Fee (x1)",
+        # Repeats, so sorting by total has ties to break
+        "Total Amount": 10.0 * (i % 4 + 1),
+        "Payment Method": PAYMENTS[i % 2],
+        "PDF Path": "",
+    } for i in range(n)]
+
+
+def expected(rows, sort="date", descending=True, **filters):
+    column = {"date": "Timestamp", "number": "Invoice Number", "owner": "Owner Name", "total": "Total Amount"}[sort]
+    kept = [
+        (pos, row) for pos, row in enumerate(rows)
+        if row["Timestamp"][:10] >= filters.get("start", "")
+        and row["Timestamp"][:10] <= filters.get("end", "9999")
+        and filters.get("owner", "") in row["Owner Name"]
+        and filters.get("payment", row["Payment Method"]) == row["Payment Method"]
+    ]
+    kept.sort(key=lambda item: (item[1][column], item[0]), reverse=descending)
+    return [row["Invoice Number"] for _, row in kept]
+
+
+def numbers(rows):
+    return [row["Invoice Number"] for row, _ in rows]
+
+
+@pytest.fixture
+def invoices(storage):
+    rows = sample_invoices()
+    storage.commit(appends={"Invoices": rows})
+    return rows
+
+
+FILTERS = [
+    {},
+    {"start": "2024-01-02"},
+    {"end": "2024-01-02"},
+    {"start": "2024-01-02", "end": "2024-01-03"},
+    {"owner": "Mi"},
+    {"owner": "50%_"},
+    {"owner": "%"},
+    {"payment": "Card"},
+    {"owner": "Mary", "payment": "Cash", "start": "2024-01-02"},
+    {"start": "2024-02-01"},
+]
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_filters(storage, invoices, filters):
+    assert storage.count_invoices(filters) == len(expected(invoices, **filters))
+    assert numbers(storage.iter_invoices(filters)) == expected(invoices, **filters)
+
+
+@pytest.mark.parametrize("sort", ["date", "number", "owner", "total"])
+@pytest.mark.parametrize("descending", [True, False])
+def test_sort_and_order(storage, invoices, sort, descending):
+    assert numbers(storage.iter_invoices(sort=sort, descending=descending)) == expected(invoices, sort, descending)
+
+
+@pytest.mark.parametrize("sort", ["date", "total"])
+def test_cursor_resumes_after_the_last_row(storage, invoices, sort):
+    listed, after = [], None
+    while True:
+        page = list(storage.iter_invoices({"payment": "Card"}, sort, after=after, limit=2))
+        if not page:
+            break
+        listed += numbers(page)
+        after = page[-1][1]
+    assert listed == expected(invoices, sort, payment="Card")
+
+
+def test_offset_and_limit(storage, invoices):
+    order = expected(invoices)
+    assert numbers(storage.iter_invoices(offset=5, limit=4)) == order[5:9]
+    assert numbers(storage.iter_invoices(offset=10, limit=4)) == order[10:]
+    assert numbers(storage.iter_invoices(offset=12, limit=4)) == []
+
+
+@pytest.fixture
+def listed(client, app_module):
+    rows = sample_invoices()
+    with app_module.locks.write("Invoices"):
+        app_module.storage.commit(appends={"Invoices": rows})
+    return rows
+
+
+def page_numbers(html, rows):
+    return [row["Invoice Number"] for row in rows if f"<td>{row['Invoice Number']}</td>" in html]
+
+
+def test_page_bounds(client, listed):
+    html = client.get("/invoices?per_page=5&page=3").get_data(as_text=True)
+    assert "page 3 of 3" in html
+    assert sorted(page_numbers(html, listed)) == sorted(expected(listed)[10:])
+
+    # Past the end shows the last page
+    html = client.get("/invoices?per_page=5&page=9").get_data(as_text=True)
+    assert "page 3 of 3" in html
+    assert sorted(page_numbers(html, listed)) == sorted(expected(listed)[10:])
+
+    html = client.get("/invoices?per_page=100000").get_data(as_text=True)
+    assert "page 1 of 1" in html and len(page_numbers(html, listed)) == 12
+
+    for args in ("page=0", "page=-2", "page=x", "per_page=0&page=1"):
+        html = client.get(f"/invoices?{args}").get_data(as_text=True)
+        assert "page 1 of" in html
+
+
+def test_page_filters_and_invalid_sort_key(client, listed):
+    html = client.get("/invoices?owner=Mike&payment=Card&sort=nope&order=asc").get_data(as_text=True)
+    assert "2 invoices" in html
+    assert page_numbers(html, listed) == sorted(expected(listed, owner="Mike", payment="Card"))
+
+    html = client.get("/invoices?start=2024-13-01").get_data(as_text=True)
+    assert "YYYY-MM-DD" in html and "12 invoices" in html
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_streamed_listing(client, listed):
+    response = client.get("/api/invoices?sort=total&order=asc")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert [row["number"] for row in ndjson(response)] == expected(listed, "total", False)
+
+    # Continuing from each page's last cursor lists every invoice once
+    streamed, cursor = [], ""
+    while True:
+        page = ndjson(client.get(f"/api/invoices?owner=Ann&limit=2&cursor={cursor}"))
+        if not page:
+            break
+        streamed += [row["number"] for row in page]
+        cursor = page[-1]["cursor"]
+    assert streamed == expected(listed, owner="Ann")
+
+    first = ndjson(client.get("/api/invoices?limit=1"))[0]
+    assert set(first) == {"timestamp", "number", "owner", "payment", "total", "pdf_exists", "cursor"}
+
+
+@pytest.mark.parametrize("args", ["cursor=notbase64!", "cursor=WzFd", "limit=0", "limit=x", "start=2024-1-40"])
+def test_streamed_listing_rejects_bad_arguments(client, listed, args):
+    response = client.get(f"/api/invoices?{args}")
+    assert response.status_code == 400
+    assert "error" in response.get_json()
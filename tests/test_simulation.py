@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from simulation import Clinic, compare_policies, run_trials
+
+
+def start(quantities=(3, 2, 0, 5, 4, 6)):
+    stock = pd.DataFrame({
+        "Reference": ["VAC001", "VAC002", "VAC003", "MED001", "ACC001", "ACC002"],
+        "Name": ["Rabies", "Distemper", "Parvo", "Antibiotic", "Syringe", "Bandage"],
+        "Quantity": list(quantities),
+        "Price": [25.0, 30.0, 28.0, 15.0, 0.5, 2.0],
+        "Type": ["Vaccine", "Vaccine", "Vaccine", "Medicine", "Accessory", "Accessory"],
+    })
+    state = {"current_day": 1, "budget": 1000.0, "daily_events": [], "total_animals_treated": 0,
+             "start_date": "2024-01-01", "consumption": {"rates": {}}}
+    return state, stock
+
+
+def serve_one_by_one(clinic, draw):
+    """The per-visit loop the batch kernel replaced: each visit takes what is left, in order."""
+    days, trials = draw["counts"].shape
+    qty = clinic.qty.copy()
+    revenue = np.zeros((days, trials))
+    lost = np.zeros((days, trials), dtype=int)
+    cells = np.repeat(np.arange(days * trials), draw["counts"].ravel())
+    picks = 0
+    for visit, cell in enumerate(cells):
+        day, trial = divmod(cell, trials)
+        total = draw["fees"][visit]
+        while picks < len(draw["visits"]) and draw["visits"][picks] == visit:
+            sku, units, kind = draw["skus"][picks], draw["units"][picks], draw["types"][picks]
+            given = min(units, qty[trial, sku])
+            qty[trial, sku] -= given
+            lost[day, trial] += given == 0
+            total += round(clinic.sell_prices[kind, sku] * given, 2)
+            picks += 1
+        revenue[day, trial] += round(total, 2)
+    return qty, revenue, lost
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_batch_serves_like_the_per_visit_loop(seed):
+    state, stock = start()
+    batch = Clinic(state, stock, rng=np.random.default_rng(seed), trials=4)
+    loop = Clinic(state, stock, rng=np.random.default_rng(seed), trials=4)
+
+    totals = batch.simulate(10)
+    qty, revenue, lost = serve_one_by_one(loop, loop._draw(10))
+
+    np.testing.assert_array_equal(batch.qty, qty)
+    np.testing.assert_allclose(totals["revenue"], revenue)
+    np.testing.assert_array_equal(totals["lost_sales"], lost)
+    # Some rows ran out along the way, so the clipping was exercised
+    assert lost.sum() > 0
+
+
+def test_day_by_day_serving_matches_the_block():
+    state, stock = start()
+    block = Clinic(state, stock, rng=np.random.default_rng(3), trials=5)
+    daily = Clinic(state, stock, rng=np.random.default_rng(3), trials=5)
+
+    served = block.simulate(8)
+    # A policy that buys nothing makes the kernel serve one day at a time
+    stepped = daily.simulate(8, policy=lambda clinic: np.zeros_like(clinic.qty))
+
+    np.testing.assert_array_equal(block.qty, daily.qty)
+    for key in ("animals_treated", "revenue", "lost_sales", "total_units"):
+        np.testing.assert_allclose(served[key], stepped[key])
+    np.testing.assert_allclose(block.budget, daily.budget)
+
+
+def test_recorded_days_add_up():
+    state, stock = start()
+    clinic = Clinic(state, stock, rng=np.random.default_rng(11), record=True)
+    days = clinic.run_days(6)
+    appends = clinic.appends()
+    invoices, lines = appends["Invoices"], appends["InvoiceLines"]
+
+    # Stock never goes negative, and what was sold is what left the shelf
+    assert (clinic.qty >= 0).all()
+    sold = lines.dropna(subset=["Reference"]).groupby("Reference")["Quantity"].sum()
+    start_qty = dict(zip(stock["Reference"], stock["Quantity"]))
+    for row in clinic.stock_updates():
+        assert start_qty[row["Reference"]] - sold.get(row["Reference"], 0) == row["Quantity"]
+    assert "VAC003" not in set(lines["Reference"].dropna())
+
+    # Revenue is the sum of the invoices, and each invoice the sum of its lines
+    assert sum(d["revenue"] for d in days) == pytest.approx(invoices["Total Amount"].sum())
+    by_invoice = lines.groupby("Invoice Number")["Total"].sum()
+    np.testing.assert_allclose(by_invoice[invoices["Invoice Number"]].to_numpy(), invoices["Total Amount"].to_numpy())
+    assert invoices["Invoice Number"].is_unique
+    assert len(invoices) == len(appends["Animals"]) == sum(d["animals_treated"] for d in days)
+
+    # Budget: start + revenue - overhead
+    expected = 1000.0 + sum(d["revenue"] - d["overhead"] for d in days)
+    assert clinic.state["budget"] == pytest.approx(expected)
+
+
+def test_lost_sales_counted_once_stock_runs_out():
+    state, stock = start(quantities=(0, 0, 0, 0, 0, 0))
+    clinic = Clinic(state, stock, rng=np.random.default_rng(5), trials=3)
+    totals = clinic.simulate(5)
+
+    assert (clinic.qty == 0).all()
+    assert (totals["lost_sales"] > 0).all()
+    # Only consultation fees were charged
+    assert (totals["revenue"] >= 30 * totals["animals_treated"]).all()
+    assert (totals["revenue"] <= 80 * totals["animals_treated"]).all()
+
+
+def test_types_without_stock_rows_are_skipped():
+    state, stock = start()
+    stock = stock[stock["Type"] == "Vaccine"].reset_index(drop=True)
+    clinic = Clinic(state, stock, rng=np.random.default_rng(0), trials=2)
+    totals = clinic.simulate(3)
+    assert (clinic.qty >= 0).all()
+    # Only the vaccine pick of a visit can go unserved: at most one per visit
+    assert (totals["lost_sales"] <= totals["animals_treated"]).all()
+
+
+def test_trials_are_reproducible_and_independent_of_workers():
+    state, stock = start()
+    inline = run_trials(state, stock, "forecast", days=10, trials=250, seed=4, workers=0)
+    again = run_trials(state, stock, "forecast", days=10, trials=250, seed=4, workers=0)
+    assert inline == again
+    assert inline["final_budget"]["min"] <= inline["final_budget"]["p50"] <= inline["final_budget"]["max"]
+
+
+def test_policies_see_the_same_visits():
+    state, stock = start(quantities=(50, 50, 50, 50, 50, 50))
+    results = {r["policy"]: r for r in compare_policies(state, stock, days=3, trials=100, seed=9, workers=0)}
+    # With plenty of stock nobody buys in three days, so the outcomes agree
+    assert results["none"]["revenue"] == results["threshold"]["revenue"] == results["forecast"]["revenue"]
@@ -0,0 +1,48 @@
+import json
+import threading
+
+from transactions import MAX_ATTEMPTS
+
+
+def drop_consumption(app_module):
+    """The state as saved before consumption rates were kept in it."""
+    state = app_module.get_simulation_state()
+    del state["consumption"]
+    app_module.save_simulation_state(state)
+
+
+def run_with_timeout(fn, seconds=30):
+    result, errors = [], []
+
+    def target():
+        try:
+            result.append(fn())
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), "deadlocked"
+    if errors:
+        raise errors[0]
+    return result[0]
+
+
+def test_days_without_consumption_rates_commit_under_the_locks(client, app_module, monkeypatch):
+    client.post("/simulation/advance?days=3")
+    drop_consumption(app_module)
+    # Every optimistic attempt conflicts, so the last one runs under the locks
+    monkeypatch.setattr(app_module.transactions, "_unchanged", lambda txn, stock_df: False)
+    before = app_module.transactions.stats()
+
+    result = run_with_timeout(lambda: app_module.simulate_days(2))
+
+    stats = app_module.transactions.stats()
+    assert stats["commits"] == before["commits"] + 1
+    assert stats["conflicts"] == before["conflicts"] + MAX_ATTEMPTS - 1
+    assert result["last_day"] == result["first_day"] + 1
+    with open(app_module.STATE_FILENAME) as f:
+        state = json.load(f)
+    assert "consumption" in state
+    assert state["current_day"] == result["last_day"] + 1
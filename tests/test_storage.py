@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+import storage as storage_module
+from conftest import invoice_numbers, invoice_row, line_row, open_backend, stock_row
+from storage import DuplicateKeyError, ExcelBackend
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    backend = ExcelBackend(str(tmp_path / "animals.xlsx"))
+    backend.commit(stock_updates=[stock_row()])
+    backend.compact()
+    backend.commit(appends={"Invoices": [invoice_row("INV-1"), invoice_row("INV-2")]},
+                   stock_updates=[stock_row(quantity=8)])
+    return backend
+
+
+def reopened(backend):
+    return ExcelBackend(backend.path)
+
+
+def test_crash_before_the_workbook_rename_keeps_the_journal(workbook, monkeypatch):
+    def replace(src, dst):
+        raise Crash()
+
+    with monkeypatch.context() as m:
+        m.setattr(storage_module.os, "replace", replace)
+        with pytest.raises(Crash):
+            workbook.compact()
+
+    assert os.path.exists(workbook.journal_path)
+    assert [name for name in os.listdir(os.path.dirname(workbook.path)) if name.endswith(".tmp")] == []
+    fresh = reopened(workbook)
+    assert invoice_numbers(fresh) == ["INV-1", "INV-2"]
+    assert int(fresh.get_stock_item("VAC001")["Quantity"]) == 8
+
+
+def test_journal_left_after_compaction_is_not_replayed_twice(workbook, monkeypatch):
+    journal_path = workbook.journal_path
+    remove = os.remove
+
+    def crash_on_journal(path):
+        if path == journal_path:
+            raise Crash()
+        remove(path)
+
+    with monkeypatch.context() as m:
+        m.setattr(storage_module.os, "remove", crash_on_journal)
+        with pytest.raises(Crash):
+            workbook.compact()
+
+    assert os.path.exists(journal_path)
+    fresh = reopened(workbook)
+    assert invoice_numbers(fresh) == ["INV-1", "INV-2"]
+
+    # New writes go to the end of the same journal; only the bytes past the recorded offset are replayed
+    fresh.commit(appends={"Invoices": [invoice_row("INV-3")]})
+    assert invoice_numbers(reopened(workbook)) == ["INV-1", "INV-2", "INV-3"]
+    fresh.compact()
+    assert not os.path.exists(journal_path)
+    assert invoice_numbers(reopened(workbook)) == ["INV-1", "INV-2", "INV-3"]
+
+
+def test_torn_journal_line_is_ignored(workbook):
+    with open(workbook.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"table": "Invoices", "row": {"Invoice Nu')
+
+    fresh = reopened(workbook)
+    assert invoice_numbers(fresh) == ["INV-1", "INV-2"]
+    fresh.compact()
+    assert invoice_numbers(reopened(workbook)) == ["INV-1", "INV-2"]
+
+
+@pytest.mark.parametrize("kind", ["excel", "sqlite"])
+def test_duplicate_invoice_number_writes_nothing(kind, tmp_path):
+    backend = open_backend(kind, tmp_path)
+    backend.commit(appends={"Invoices": [invoice_row("INV-1")]}, stock_updates=[stock_row()])
+
+    with pytest.raises(DuplicateKeyError):
+        backend.commit(appends={"Invoices": [invoice_row("INV-2"), invoice_row("INV-1")],
+                                "InvoiceLines": [line_row("INV-2")]},
+                       stock_updates=[stock_row(quantity=3)])
+
+    for view in (backend, open_backend(kind, tmp_path)):
+        assert invoice_numbers(view) == ["INV-1"]
+        assert view.read_table("InvoiceLines").empty
+        assert int(view.get_stock_item("VAC001")["Quantity"]) == 10
+
+
+@pytest.mark.parametrize("kind", ["excel", "sqlite"])
+def test_duplicate_invoice_number_within_one_commit(kind, tmp_path):
+    backend = open_backend(kind, tmp_path)
+
+    with pytest.raises(DuplicateKeyError):
+        backend.commit(appends={"Invoices": [invoice_row("INV-1"), invoice_row("INV-1")]})
+
+    assert invoice_numbers(open_backend(kind, tmp_path)) == []
+
+
+def test_duplicate_key_error_is_a_value_error():
+    assert issubclass(DuplicateKeyError, ValueError)
+
+
+def test_workbook_with_a_retired_column(tmp_path):
+    path = str(tmp_path / "animals.xlsx")
+    storage_module.pd.DataFrame([{**invoice_row("INV-1"), "PDF Status": "Done"}]).to_excel(
+        path, sheet_name="Invoices", index=False)
+    backend = ExcelBackend(path)
+    backend.commit(appends={"Invoices": [invoice_row("INV-2")]})
+    assert "PDF Status" not in backend.read_table("Invoices").columns
+    backend.compact()
+    sheet = storage_module.pd.read_excel(path, sheet_name="Invoices")
+    assert list(sheet.columns) == storage_module.TABLE_COLUMNS["Invoices"]
+    assert list(sheet["Invoice Number"]) == ["INV-1", "INV-2"]
+
+
+def test_database_with_a_retired_column(tmp_path):
+    backend = open_backend("sqlite", tmp_path)
+    backend._connect().execute('ALTER TABLE Invoices ADD COLUMN "PDF Status" TEXT')
+    backend.commit(appends={"Invoices": [invoice_row("INV-1")], "InvoiceLines": [line_row("INV-1")]})
+    assert list(backend.read_table("Invoices").columns) == storage_module.TABLE_COLUMNS["Invoices"]
+    assert backend.get_invoice("INV-1")[0]["Invoice Number"] == "INV-1"
@@ -0,0 +1,198 @@
+import json
+import os
+
+import pytest
+
+from conftest import invoice_numbers, invoice_row, line_row, stock_row
+from transactions import TransactionAborted
+
+
+def buy(reference, quantity):
+    """A purchase as the app records it: spend the budget, add the units."""
+    def plan(txn):
+        item = txn.stock_item(reference)
+        txn.state["budget"] -= quantity * item["Price"]
+        txn.stock_updates = [{**stock_row(reference, price=item["Price"]), "Quantity": int(item["Quantity"]) + quantity}]
+    return plan
+
+
+def test_conflict_on_state_is_retried(manager, storage, state_file):
+    calls = []
+
+    def plan(txn):
+        calls.append(txn.state["version"])
+        if len(calls) == 1:
+            # Another writer commits between the snapshot and the commit
+            state_file.save({**state_file.load(), "budget": 900.0, "version": 1})
+        buy("VAC001", 2)(txn)
+
+    manager.run(plan)
+
+    assert calls == [0, 1]
+    assert manager.stats() == {"commits": 1, "conflicts": 1, "recovered": 0}
+    assert state_file.load() == {"budget": 850.0, "current_day": 1, "version": 2}
+    assert int(storage.get_stock_item("VAC001")["Quantity"]) == 12
+
+
+def test_conflict_on_stock_is_retried(manager, storage, state_file):
+    calls = []
+
+    def plan(txn):
+        calls.append(int(txn.stock_item("VAC001")["Quantity"]))
+        if len(calls) == 1:
+            storage.upsert_stock(stock_row(quantity=4))
+        buy("VAC001", 2)(txn)
+
+    manager.run(plan)
+
+    assert calls == [10, 4]
+    assert manager.stats()["conflicts"] == 1
+    assert int(storage.get_stock_item("VAC001")["Quantity"]) == 6
+
+
+def test_last_attempt_commits_under_the_locks(manager, storage, state_file):
+    calls = []
+
+    def plan(txn):
+        calls.append(txn.state["version"])
+        # Loses every optimistic attempt; the locked one still commits
+        state = state_file.load()
+        state_file.save({**state, "version": state["version"] + 1})
+        buy("VAC001", 1)(txn)
+
+    manager.run(plan, attempts=3)
+
+    assert len(calls) == 3
+    assert manager.stats() == {"commits": 1, "conflicts": 2, "recovered": 0}
+    assert int(storage.get_stock_item("VAC001")["Quantity"]) == 11
+
+
+def test_unrelated_stock_change_is_not_a_conflict(manager, storage):
+    storage.upsert_stock(stock_row("SYR010", quantity=3, price=1.0))
+
+    def plan(txn):
+        storage.upsert_stock(stock_row("SYR010", quantity=1, price=1.0))
+        buy("VAC001", 1)(txn)
+
+    manager.run(plan)
+
+    assert manager.stats()["conflicts"] == 0
+    assert int(storage.get_stock_item("VAC001")["Quantity"]) == 11
+
+
+def test_appends_commit_with_the_state(manager, storage, state_file):
+    def plan(txn):
+        txn.state["budget"] += 50.0
+        txn.appends = {"Invoices": [invoice_row("INV-1")], "InvoiceLines": [line_row("INV-1")]}
+
+    manager.run(plan, tables=("Invoices", "InvoiceLines"))
+
+    assert invoice_numbers(storage) == ["INV-1"]
+    assert state_file.load()["budget"] == 1050.0
+
+
+class Crash(Exception):
+    pass
+
+
+def sell(number):
+    def plan(txn):
+        txn.state["budget"] += 50.0
+        txn.appends = {"Invoices": [invoice_row(number)], "InvoiceLines": [line_row(number)]}
+        txn.stock_updates = [stock_row(quantity=9)]
+    return plan
+
+
+def crash(*args, **kwargs):
+    raise Crash()
+
+
+def test_recover_before_storage_commit(manager, storage, state_file, monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(storage, "commit", crash)
+        with pytest.raises(Crash):
+            manager.run(sell("INV-1"), tables=("Invoices", "InvoiceLines", "Stock"))
+    assert os.path.exists(manager.intent_path)
+    assert invoice_numbers(storage) == []
+
+    manager.recover()
+
+    assert not os.path.exists(manager.intent_path)
+    assert invoice_numbers(storage) == ["INV-1"]
+    assert int(storage.get_stock_item("VAC001")["Quantity"]) == 9
+    assert state_file.load()["budget"] == 1050.0
+
+
+def test_recover_after_storage_commit(manager, storage, state_file, monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(manager, "save_state", crash)
+        with pytest.raises(Crash):
+            manager.run(sell("INV-1"), tables=("Invoices", "InvoiceLines", "Stock"))
+    assert invoice_numbers(storage) == ["INV-1"]
+    assert state_file.load()["budget"] == 1000.0
+
+    manager.recover()
+
+    # The invoice is not appended a second time
+    assert invoice_numbers(storage) == ["INV-1"]
+    assert len(storage.read_table("InvoiceLines")) == 1
+    assert state_file.load()["budget"] == 1050.0
+    assert manager.stats()["recovered"] == 1
+
+
+def test_next_transaction_recovers_first(manager, storage, state_file, monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(manager, "save_state", crash)
+        with pytest.raises(Crash):
+            manager.run(sell("INV-1"), tables=("Invoices", "InvoiceLines", "Stock"))
+
+    manager.run(sell("INV-2"), tables=("Invoices", "InvoiceLines", "Stock"))
+
+    assert invoice_numbers(storage) == ["INV-1", "INV-2"]
+    assert state_file.load()["budget"] == 1100.0
+    assert not os.path.exists(manager.intent_path)
+
+
+def test_leftover_intent_with_a_taken_invoice_is_discarded(manager, storage, state_file):
+    # Someone else recorded INV-1 after the interrupted commit wrote its intent
+    storage.commit(appends={"Invoices": [invoice_row("INV-1")], "InvoiceLines": [line_row("INV-1")]})
+    intent = {
+        "state": {**state_file.load(), "budget": 1100.0, "version": 1},
+        "appends": {"Invoices": [invoice_row("INV-1"), invoice_row("INV-2")],
+                    "InvoiceLines": [line_row("INV-1"), line_row("INV-2")]},
+        "stock_updates": [],
+    }
+    with open(manager.intent_path, "w") as f:
+        json.dump(intent, f)
+
+    manager.recover()
+
+    assert not os.path.exists(manager.intent_path)
+    assert invoice_numbers(storage) == ["INV-1"]
+    assert len(storage.read_table("InvoiceLines")) == 1
+    assert state_file.load()["budget"] == 1000.0
+
+
+def test_taken_invoice_aborts_without_an_intent(manager, storage, state_file):
+    storage.commit(appends={"Invoices": [invoice_row("INV-1")]})
+
+    with pytest.raises(TransactionAborted):
+        manager.run(sell("INV-1"), tables=("Invoices", "InvoiceLines", "Stock"))
+
+    assert not os.path.exists(manager.intent_path)
+    assert invoice_numbers(storage) == ["INV-1"]
+    assert int(storage.get_stock_item("VAC001")["Quantity"]) == 10
+    assert state_file.load()["budget"] == 1000.0
+
+
+def test_invoice_taken_after_the_check_aborts_without_an_intent(manager, storage, state_file, monkeypatch):
+    storage.commit(appends={"Invoices": [invoice_row("INV-1")]})
+    # As if INV-1 was written between the check and the storage commit
+    monkeypatch.setattr(manager, "_existing_invoices", lambda appends: [])
+
+    with pytest.raises(TransactionAborted):
+        manager.run(sell("INV-1"), tables=("Invoices", "InvoiceLines", "Stock"))
+
+    assert not os.path.exists(manager.intent_path)
+    assert invoice_numbers(storage) == ["INV-1"]
+    assert state_file.load()["budget"] == 1000.0
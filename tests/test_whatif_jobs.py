@@ -0,0 +1,62 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import whatif_jobs
+from whatif_jobs import ORPHANED, WhatifJobs
+
+
+def write_job(directory, job_id, **record):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{job_id}.json"), "w") as f:
+        json.dump({"days": 5, "trials": 10, "seed": 0, **record}, f)
+
+
+def dead_pid():
+    child = subprocess.Popen([sys.executable, "-c", "pass"])
+    child.wait()
+    return child.pid
+
+
+def test_jobs_of_exited_processes_fail_at_startup(tmp_path):
+    directory = str(tmp_path / "whatif")
+    write_job(directory, "a" * 32, status="running", pid=dead_pid(), process="old")
+    # Same pid as this process, but from before a restart
+    write_job(directory, "b" * 32, status="running", pid=os.getpid(), process="old")
+    write_job(directory, "c" * 32, status="running", pid=os.getpid(), process=whatif_jobs._PROCESS)
+    write_job(directory, "d" * 32, status="done", results={})
+
+    jobs = WhatifJobs(directory, workers=1)
+    assert jobs.fail_orphans() == 2
+    assert jobs.get("a" * 32)["status"] == "failed"
+    assert jobs.get("b" * 32) == {"days": 5, "trials": 10, "seed": 0, "status": "failed", "pid": os.getpid(),
+                                  "process": "old", "error": ORPHANED}
+    assert jobs.get("c" * 32)["status"] == "running"
+    assert jobs.get("d" * 32)["status"] == "done"
+    assert jobs.fail_orphans() == 0
+
+
+def test_orphan_is_failed_when_read(tmp_path):
+    directory = str(tmp_path / "whatif")
+    jobs = WhatifJobs(directory, workers=1)
+    write_job(directory, "e" * 32, status="running", pid=dead_pid(), process="old")
+    assert jobs.get("e" * 32)["error"] == ORPHANED
+    assert jobs.get("not-a-job") is None
+    assert jobs.fail_orphans() == 0
+
+
+def test_comparison_runs_beside_the_pdf_pool(client, app_module):
+    response = client.post("/simulation/compare", data={"days": 3, "trials": 4, "seed": 1})
+    job_id = response.headers["Location"].rsplit("job=", 1)[1]
+    deadline = time.monotonic() + 60
+    while app_module.whatif_jobs.get(job_id)["status"] == "running":
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    job = app_module.whatif_jobs.get(job_id)
+    assert job["status"] == "done", job.get("error")
+    assert [r["policy"] for r in job["results"]] == ["none", "threshold", "forecast"]
+    # Rendered inline here (PDF_WORKERS=0): the comparison never started the PDF pool
+    assert app_module.pdf_jobs._pool is None
+    assert client.get(f"/simulation/compare?job={job_id}").status_code == 200
@@ -0,0 +1,214 @@
+"""Budget and stock changes committed together, with optimistic concurrency.
+
+A transaction reads the simulation state and the Stock rows it needs without
+holding any lock, works out the new budget, stock levels and rows to append,
+and only then takes the write locks to check that nothing it read has changed
+(the state's ``version``, the quantity and price of each stock row it looked
+at) and commit.  On a conflict it waits a random, growing delay and starts
+over with fresh data, so concurrent purchases can never spend the same
+budget twice.  The last attempt takes the locks first and runs entirely
+under them, so a transaction that keeps losing to other writers still
+commits instead of giving up.
+
+The commit spans two stores, storage and simulation_state.json.  It first
+writes an intent file with everything it is about to change, then commits
+storage, then the state, then removes the intent; ``recover`` finishes a
+commit that was interrupted half way.  A commit whose invoices would reuse
+existing Invoice Numbers is aborted before anything is written, so an intent
+can always be finished.
+"""
+from __future__ import annotations
+
+import copy
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from lazy_imports import lazy_import
+from storage import DuplicateKeyError
+
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+
+MAX_ATTEMPTS = 5
+# Seconds; the delay before retry n is drawn from [0, BACKOFF * 2**n)
+BACKOFF = 0.01
+
+
+class TransactionAborted(Exception):
+    """Raised by a transaction function to give up (nothing is written)."""
+
+
+class Transaction:
+    """A snapshot to read from, and the changes to commit."""
+
+    def __init__(self, state: dict, stock_df: pd.DataFrame):
+        self.state = state
+        self.appends = {}
+        self.stock_updates = []
+        self.result = None
+        self._stock = stock_df
+        self.read_refs = set()  # Stock references read (None: the whole table)
+
+    def stock_item(self, reference: str):
+        """The Stock row for ``reference`` as a dict, or None."""
+        if self.read_refs is not None:
+            self.read_refs.add(reference)
+        match = self._stock[self._stock["Reference"] == reference]
+        return None if match.empty else match.iloc[0].to_dict()
+
+    def stock_table(self) -> pd.DataFrame:
+        """The whole Stock table (every row then counts as read)."""
+        self.read_refs = None
+        return self._stock.copy()
+
+
+def _stock_levels(stock_df: pd.DataFrame, refs) -> dict:
+    if refs is not None:
+        stock_df = stock_df[stock_df["Reference"].isin(refs)]
+    qty = pd.to_numeric(stock_df["Quantity"], errors="coerce").fillna(0).astype(int)
+    price = pd.to_numeric(stock_df["Price"], errors="coerce").fillna(0.0)
+    return dict(zip(stock_df["Reference"].astype(str), zip(qty, price)))
+
+
+def _records(rows) -> list:
+    if isinstance(rows, pd.DataFrame):
+        return rows.to_dict("records")
+    return list(rows or [])
+
+
+def _json_default(value):
+    # numpy scalars in DataFrame-built rows
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class TransactionManager:
+    """Runs budget + stock transactions against one storage backend.
+
+    ``load_state``/``save_state`` read and write the simulation state file;
+    ``lock(tables)`` returns a context manager holding the write locks for
+    those tables plus the state and aggregates.
+    """
+
+    def __init__(self, storage, state_path: str, load_state, save_state, lock, aggregates=None):
+        self.storage = storage
+        self.intent_path = state_path + ".intent"
+        self.load_state = load_state
+        self.save_state = save_state
+        self.lock = lock
+        self.aggregates = aggregates
+        self.commits = 0
+        self.conflicts = 0
+        self.recovered = 0
+        self._stats_lock = threading.Lock()
+
+    def run(self, fn, tables=("Stock",), attempts: int = MAX_ATTEMPTS) -> Transaction:
+        """Call ``fn(txn)`` on a fresh snapshot and commit what it records.
+
+        ``tables`` are the tables the transaction writes.  ``fn`` may run
+        several times if other writers get in first; it must only change
+        ``txn`` and raise ``TransactionAborted`` to give up.  It must not
+        take locks either: the last attempt runs it with them held.  The first
+        ``attempts - 1`` runs are optimistic; the last holds the locks
+        throughout, so it cannot conflict.
+        """
+        for attempt in range(attempts - 1):
+            state = self.load_state()
+            stock_df = self.storage.read_table("Stock")
+            txn = Transaction(copy.deepcopy(state), stock_df)
+            fn(txn)
+            with self.lock(tables):
+                self._recover()
+                current = self.load_state()
+                if current.get("version", 0) == state.get("version", 0) and self._unchanged(txn, stock_df):
+                    return self._commit_counted(txn, state)
+            with self._stats_lock:
+                self.conflicts += 1
+            time.sleep(random.uniform(0, BACKOFF * 2 ** attempt))
+        with self.lock(tables):
+            self._recover()
+            state = self.load_state()
+            txn = Transaction(copy.deepcopy(state), self.storage.read_table("Stock"))
+            fn(txn)
+            return self._commit_counted(txn, state)
+
+    def _commit_counted(self, txn: Transaction, state: dict) -> Transaction:
+        txn.state["version"] = state.get("version", 0) + 1
+        self._commit(txn)
+        with self._stats_lock:
+            self.commits += 1
+        return txn
+
+    def recover(self):
+        """Finish a commit interrupted by a crash (call with all tables locked)."""
+        self._recover()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {"commits": self.commits, "conflicts": self.conflicts, "recovered": self.recovered}
+
+    def _unchanged(self, txn: Transaction, stock_df: pd.DataFrame) -> bool:
+        refs = txn.read_refs
+        current = self.storage.read_table("Stock")
+        return _stock_levels(stock_df, refs) == _stock_levels(current, refs)
+
+    def _commit(self, txn: Transaction):
+        appends = {table: _records(rows) for table, rows in txn.appends.items()}
+        taken = self._existing_invoices(appends)
+        if taken:
+            raise TransactionAborted(f"Invoice number {taken[0]} is already taken.")
+        intent = {"state": txn.state, "appends": appends, "stock_updates": txn.stock_updates}
+        tmp_path = f"{self.intent_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(intent, f, default=_json_default)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.intent_path)
+        try:
+            self._apply(intent, appends_done=False)
+        except DuplicateKeyError as e:
+            # Storage wrote nothing; neither did the state
+            os.remove(self.intent_path)
+            raise TransactionAborted(str(e)) from e
+
+    def _existing_invoices(self, appends: dict) -> list:
+        return [
+            row["Invoice Number"] for row in appends.get("Invoices") or []
+            if self.storage.get_invoice(row["Invoice Number"]) is not None
+        ]
+
+    def _recover(self):
+        if not os.path.exists(self.intent_path):
+            return
+        with open(self.intent_path, "r") as f:
+            intent = json.load(f)
+        # Appends are not idempotent: they went in if the invoices did
+        # (storage commits rows and stock updates atomically, so all or none)
+        invoices = intent["appends"].get("Invoices") or []
+        done = bool(invoices) and len(self._existing_invoices(intent["appends"])) == len(invoices)
+        try:
+            self._apply(intent, appends_done=done)
+        except DuplicateKeyError as e:
+            # Some invoices clash with other rows: the commit never reached
+            # storage or the state, so roll it back rather than half apply it
+            logger.warning("Discarding interrupted commit %s: %s", self.intent_path, e)
+            os.remove(self.intent_path)
+        with self._stats_lock:
+            self.recovered += 1
+
+    def _apply(self, intent: dict, appends_done: bool):
+        appends = {} if appends_done else intent["appends"]
+        before = self.aggregates.begin_write() if self.aggregates else None
+        # Stock updates set absolute values, so applying them twice is harmless
+        self.storage.commit(appends=appends, stock_updates=intent["stock_updates"])
+        if self.aggregates:
+            self.aggregates.record(before, appends=appends, stock_rows=intent["stock_updates"])
+        self.save_state(intent["state"])
+        os.remove(self.intent_path)
@@ -0,0 +1,162 @@
+"""What-if policy comparisons run as background jobs.
+
+Comparing the policies over many trials takes seconds of CPU, too long to
+hold a request thread.  ``WhatifJobs.start`` queues the comparison on a
+process pool of its own (WHATIF_WORKERS, default 1), so long comparisons
+never queue ahead of invoice PDFs, and returns a job id at once.  The job
+writes its results to ``<directory>/<id>.json``; any web worker can read
+that file, so the compare page polls it until the results are there.
+
+A job whose process died with it (a restart mid-run) would stay "running"
+forever; each record names the process that owns it, and records whose
+owner is gone read as failed.
+"""
+import atexit
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from simulation import compare_policies
+
+
+# How long finished jobs are kept before start() removes them
+KEEP_SECONDS = 24 * 3600
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+ORPHANED = "the process running this job exited"
+# Tells this process apart from an earlier one that had the same pid
+_PROCESS = uuid.uuid4().hex
+
+
+def default_workers() -> int:
+    """WHATIF_WORKERS env var, else 1 process."""
+    return max(1, int(os.environ.get("WHATIF_WORKERS", 1)))
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _orphaned(record: dict) -> bool:
+    """Whether a running job's owner process has gone away."""
+    if record.get("status") != "running":
+        return False
+    pid = record.get("pid")
+    if pid == os.getpid():
+        return record.get("process") != _PROCESS
+    return not isinstance(pid, int) or not _alive(pid)
+
+
+def _write(path: str, data: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def run_comparison(path: str, job: dict, state: dict, stock_df, days: int, trials: int, seed: int):
+    """Job body: compare the policies in this process and write the results to ``path``."""
+    start = time.perf_counter()
+    # Already in a pool process; don't start another pool per policy
+    results = compare_policies(state, stock_df, days=days, trials=trials, seed=seed, workers=0)
+    _write(path, {**job, "status": "done", "results": results, "elapsed": time.perf_counter() - start})
+
+
+class WhatifJobs:
+    """Starts comparisons in worker processes and reads back their state from ``directory``."""
+
+    def __init__(self, directory: str, workers: int = None):
+        self.directory = directory
+        self.workers = default_workers() if workers is None else workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                atexit.register(self.shutdown)
+            return self._pool
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def start(self, state: dict, stock_df, days: int, trials: int, seed: int) -> str:
+        """Queue a comparison; returns its job id."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._prune()
+        job_id = uuid.uuid4().hex
+        path = self._path(job_id)
+        job = {"days": days, "trials": trials, "seed": seed}
+        _write(path, {**job, "status": "running", "pid": os.getpid(), "process": _PROCESS})
+        future = self._executor().submit(run_comparison, path, job, state, stock_df, days, trials, seed)
+
+        def failed(future):
+            if future.exception() is not None:
+                _write(path, {**job, "status": "failed", "error": str(future.exception())})
+
+        future.add_done_callback(failed)
+        return job_id
+
+    def get(self, job_id: str):
+        """The job's record (``status`` running, done or failed), or None if there is no such job."""
+        if not _JOB_ID.fullmatch(job_id or ""):
+            return None
+        return self._read(self._path(job_id))
+
+    def _read(self, path: str):
+        try:
+            with open(path, encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if _orphaned(record):
+            record = {**record, "status": "failed", "error": ORPHANED}
+            _write(path, record)
+        return record
+
+    def fail_orphans(self) -> int:
+        """Mark running jobs whose process is gone as failed (run at startup); returns how many."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return 0
+        failed = 0
+        for name in names:
+            job_id, ext = os.path.splitext(name)
+            if ext != ".json" or not _JOB_ID.fullmatch(job_id):
+                continue
+            try:
+                with open(self._path(job_id), encoding="utf-8") as f:
+                    orphaned = _orphaned(json.load(f))
+            except (OSError, ValueError):
+                continue
+            if orphaned:
+                self._read(self._path(job_id))
+                failed += 1
+        return failed
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _prune(self):
+        cutoff = time.time() - KEEP_SECONDS
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass